@@ -0,0 +1,154 @@
+# coding=utf-8
+# Copyright 2024 XiaHan
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+"""
+Compares the uvicorn runtime profiles on the proxy cache-hit path.
+
+A file is written straight into a temporary proxy cache, with the revision and
+paths-info metadata it needs, and every profile serves it in offline mode, so no
+request leaves the machine:
+
+    python benchmarks/runtime_profile.py --requests 500 --concurrency 32
+"""
+
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List
+
+import httpx
+import typer
+
+from olah.cache.olah_cache import OlahCache
+from olah.commands.runtime import RUNTIME_PROFILES
+from olah.utils.cache_utils import write_cache_request
+from olah.utils.disk_utils import convert_bytes_to_human_readable, convert_to_bytes
+from olah.utils.repo_utils import get_meta_save_path
+
+REPO_TYPE = "models"
+ORG = "bench"
+REPO = "model"
+COMMIT = "0" * 40
+FILE_PATH = "model.bin"
+
+
+async def populate_cache(repos_path: str, file_size: int) -> None:
+    for revision in ["main", COMMIT]:
+        meta_path = get_meta_save_path(repos_path, REPO_TYPE, ORG, REPO, revision)
+        os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+        await write_cache_request(meta_path, 200, {}, json.dumps({"sha": COMMIT}).encode())
+
+    pathsinfo_path = os.path.join(
+        repos_path,
+        f"api/{REPO_TYPE}/{ORG}/{REPO}/paths-info/{COMMIT}/{FILE_PATH}/paths-info_post.json",
+    )
+    os.makedirs(os.path.dirname(pathsinfo_path), exist_ok=True)
+    pathsinfo = [{"type": "file", "path": FILE_PATH, "size": file_size}]
+    await write_cache_request(pathsinfo_path, 200, {}, json.dumps(pathsinfo).encode())
+
+    save_path = os.path.join(
+        repos_path, f"files/{REPO_TYPE}/{ORG}/{REPO}/resolve/{COMMIT}/{FILE_PATH}"
+    )
+    cache_file = OlahCache.create(save_path)
+    cache_file.resize(file_size)
+    block_size = cache_file._get_block_size()
+    data = os.urandom(min(file_size, block_size))
+    for block_index in range(cache_file._get_block_number()):
+        block = data[: min(block_size, file_size - block_index * block_size)]
+        await cache_file.write_block(block_index, block.ljust(block_size, b"\x00"))
+    cache_file.close()
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def _wait_ready(url: str, timeout: float = 30) -> None:
+    deadline = time.time() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.time() < deadline:
+            try:
+                await client.head(url)
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.2)
+    raise Exception(f"The server at {url} did not start in {timeout} seconds.")
+
+
+async def run_load(url: str, requests: int, concurrency: int) -> List[float]:
+    latencies: List[float] = []
+    next_request = 0
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+
+        async def worker() -> None:
+            nonlocal next_request
+            while next_request < requests:
+                next_request += 1
+                start = time.perf_counter()
+                async with client.stream("GET", url) as response:
+                    if response.status_code != 200:
+                        raise Exception(f"Unexpected status code: {response.status_code}")
+                    async for _ in response.aiter_raw():
+                        pass
+                latencies.append(time.perf_counter() - start)
+
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return latencies
+
+
+def main(
+    requests: int = typer.Option(500, help="Number of GET requests per profile"),
+    concurrency: int = typer.Option(32, help="Number of concurrent connections"),
+    file_size: str = typer.Option("1MB", help="Size of the served file"),
+    workers: int = typer.Option(1, help="Number of server worker processes"),
+):
+    size = convert_to_bytes(file_size)
+    with tempfile.TemporaryDirectory() as repos_path:
+        asyncio.run(populate_cache(repos_path, size))
+        print(f"{'profile':<12} {'req/s':>9} {'MB/s':>9} {'p50 ms':>9} {'p99 ms':>9}")
+        for profile in RUNTIME_PROFILES.keys():
+            port = _free_port()
+            server = subprocess.Popen(
+                [
+                    sys.executable, "-m", "olah.commands.app", "proxy",
+                    "--host", "127.0.0.1", "--port", str(port),
+                    "--repos-path", repos_path, "--offline",
+                    "--workers", str(workers), "--profile", profile,
+                ],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+            url = f"http://127.0.0.1:{port}/{ORG}/{REPO}/resolve/main/{FILE_PATH}"
+            try:
+                asyncio.run(_wait_ready(url))
+                # Warm up the memory of the server
+                asyncio.run(run_load(url, concurrency, concurrency))
+                start = time.perf_counter()
+                latencies = sorted(asyncio.run(run_load(url, requests, concurrency)))
+                elapsed = time.perf_counter() - start
+            finally:
+                server.terminate()
+                server.wait()
+            p50 = latencies[len(latencies) // 2] * 1000
+            p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+            print(
+                f"{profile:<12} {requests / elapsed:>9.1f} "
+                f"{requests * size / elapsed / 1024 / 1024:>9.1f} {p50:>9.1f} {p99:>9.1f}"
+            )
+        print(f"File size: {convert_bytes_to_human_readable(size)}, workers: {workers}.")
+
+
+if __name__ == "__main__":
+    typer.run(main)
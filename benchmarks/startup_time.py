@@ -0,0 +1,83 @@
+# coding=utf-8
+# Copyright 2024 XiaHan
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+"""
+Measures the import time of the CLI and of the server with `python -X importtime`,
+and fails if the median of the runs exceeds the budget:
+
+    python benchmarks/startup_time.py --runs 5
+"""
+
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+import typer
+
+# Milliseconds, measured in a fresh interpreter
+STARTUP_BUDGETS: Dict[str, float] = {
+    "olah.commands.app": 150,
+    "olah.server": 1200,
+}
+
+
+def import_times(module: str) -> List[Tuple[str, float, float]]:
+    """
+    Imports `module` in a fresh interpreter.
+
+    Returns:
+        List[Tuple[str, float, float]]: (module, self ms, cumulative ms) of every import.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        if not self_us.strip().isdigit():
+            continue
+        times.append((name.strip(), int(self_us) / 1000, int(cumulative_us) / 1000))
+    return times
+
+
+def main(
+    runs: int = typer.Option(5, help="Number of runs per module, the median is reported"),
+    top: int = typer.Option(10, help="Number of slowest imports to list"),
+    budget_scale: float = typer.Option(1.0, help="Multiplier of the budgets for slow machines"),
+):
+    over_budget = False
+    for module, budget in STARTUP_BUDGETS.items():
+        totals = []
+        for _ in range(runs):
+            times = import_times(module)
+            totals.append(next(c for name, _, c in times if name == module))
+        median = statistics.median(totals)
+        budget = budget * budget_scale
+        status = "ok" if median <= budget else "OVER BUDGET"
+        over_budget = over_budget or median > budget
+        print(f"{module}: {median:.1f} ms (budget {budget:.0f} ms) {status}")
+
+        # Cumulative times of the last run, for the top level imports of each package
+        slowest = sorted(
+            ((name, c) for name, _, c in times if name != module and "." not in name),
+            key=lambda item: item[1],
+            reverse=True,
+        )
+        for name, cumulative in slowest[:top]:
+            print(f"    {name:<32} {cumulative:>8.1f} ms")
+    if over_budget:
+        raise typer.Exit(code=1)
+
+
+if __name__ == "__main__":
+    typer.run(main)
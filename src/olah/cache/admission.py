@@ -0,0 +1,71 @@
+# coding=utf-8
+# Copyright 2024 XiaHan
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+from typing import Optional
+
+from olah.configs import OlahRule
+
+from .index import CacheAccessIndex
+from .policies import CountMinSketch
+
+
+class CacheAdmissionFilter(object):
+    """
+    Decides whether a requested object is persisted to the block cache.
+
+    Requests are counted in a counting Bloom filter (a Count-Min sketch with periodic
+    halving), so the memory stays constant however many one-off objects are pulled
+    and old counts fade out. Objects that already have cached blocks are always
+    admitted, so that a partially cached file gets completed.
+
+    Only the requests starting at the beginning of an object are counted: parallel and
+    resumable downloaders fetch an object with many range requests, which are a single
+    download.
+    """
+
+    def __init__(self, index: Optional[CacheAccessIndex] = None, width: int = 1 << 16) -> None:
+        self._index = index
+        self._sketch = CountMinSketch(width=width)
+
+    def record(self, key: str) -> int:
+        """
+        Counts a request of `key`.
+
+        Returns:
+            int: The estimated number of requests of `key`, including this one.
+        """
+        self._sketch.increment(key)
+        return self._sketch.estimate(key)
+
+    def estimate(self, key: str) -> int:
+        return self._sketch.estimate(key)
+
+    def admit(
+        self,
+        rule: Optional[OlahRule],
+        cache_path: str,
+        file_size: int,
+        range_start: int = 0,
+    ) -> bool:
+        """
+        Counts a request of the object cached at `cache_path` and checks the admission
+        settings of the cache rule deciding for its repository.
+
+        Args:
+            range_start (int): The first byte requested. Requests which do not start at
+                the beginning of the object are the following chunks of a download and
+                are not counted.
+        """
+        if range_start == 0:
+            access_count = self.record(cache_path)
+        else:
+            access_count = self.estimate(cache_path)
+        if rule is None:
+            return True
+        if self._index is not None and self._index.file_block_count(cache_path) > 0:
+            return True
+        return rule.admit(access_count, file_size)
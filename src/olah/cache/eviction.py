@@ -0,0 +1,264 @@
+# coding=utf-8
+# Copyright 2024 XiaHan
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+import asyncio
+import os
+import shutil
+import sys
+from typing import Dict, Optional, Tuple
+
+import fastapi.concurrency
+
+from olah.constants import (
+    CACHE_EVICTION_BATCH_BLOCKS,
+    CACHE_EVICTION_BATCH_INTERVAL,
+    CACHE_EVICTION_CHECK_INTERVAL,
+)
+from olah.metrics.collectors import CACHE_EVICTED_BLOCKS, CACHE_EVICTED_BYTES
+from olah.utils.disk_utils import convert_bytes_to_human_readable
+from olah.utils.worker_utils import FETCH_LOCK_FILE, BlockFetchLocks
+
+from .index import CacheAccessIndex
+from .ledger import CacheSizeLedger
+from .olah_cache import OlahCache
+
+
+class CacheEvictor(object):
+    """
+    Block-granular cache eviction driven by the `CacheAccessIndex`. The victims are
+    chosen by the eviction policy of the index.
+
+    Blocks are removed through `OlahCache.remove_block`, so the block presence, the
+    size ledger and the access index stay consistent. A cache file whose last block is
+    evicted is removed together with its `meta.bin`, while holding the fetch locks of
+    all its blocks, so that no worker is writing a block into it.
+    """
+
+    def __init__(
+        self,
+        ledger: CacheSizeLedger,
+        index: CacheAccessIndex,
+        fetch_locks: Optional[BlockFetchLocks] = None,
+    ) -> None:
+        self._ledger = ledger
+        self._index = index
+        self._fetch_locks = fetch_locks
+
+    @property
+    def strategy(self) -> str:
+        return self._index.policy.name
+
+    def _open_cache(self, cache_path: str) -> OlahCache:
+        return OlahCache(cache_path, ledger=self._ledger, index=self._index)
+
+    def _remove_empty_cache(self, cache_path: str) -> None:
+        if self._index.file_block_count(cache_path) != 0:
+            return
+        if self._fetch_locks is None:
+            if os.path.exists(os.path.join(cache_path, FETCH_LOCK_FILE)):
+                # The fetches of other workers cannot be ruled out
+                return
+        elif not self._fetch_locks.lock_file(cache_path):
+            # A block is being fetched into the file
+            return
+        try:
+            blocks_path = os.path.join(cache_path, "blocks")
+            if os.path.isdir(blocks_path) and len(os.listdir(blocks_path)) != 0:
+                return
+            meta_path = os.path.join(cache_path, "meta.bin")
+            if os.path.exists(meta_path):
+                self._ledger.remove(os.path.getsize(meta_path))
+            shutil.rmtree(cache_path, ignore_errors=True)
+        finally:
+            if self._fetch_locks is not None:
+                self._fetch_locks.unlock_file(cache_path)
+
+    def evict(self, target_size: int, max_blocks: Optional[int] = None) -> Tuple[int, int]:
+        """
+        Evicts blocks in priority order until the cache size drops below `target_size`.
+
+        This does blocking disk I/O and should run in a worker thread.
+
+        Args:
+            target_size (int): The cache size to reach, in bytes.
+            max_blocks (Optional[int]): Stops after evicting this many blocks, so that a
+                large eviction can be split into short batches.
+
+        Returns:
+            Tuple[int, int]: The number of evicted blocks and the number of freed bytes.
+        """
+        if self._ledger.size < target_size:
+            return 0, 0
+
+        opened: Dict[str, OlahCache] = {}
+        evicted_blocks = 0
+        evicted_size = 0
+        try:
+            while self._ledger.size >= target_size:
+                if max_blocks is not None and evicted_blocks >= max_blocks:
+                    break
+                victim = self._index.victim()
+                if victim is None:
+                    break
+                cache_path, block_index = victim
+                cache_file = opened.get(cache_path, None)
+                if cache_file is None:
+                    if not os.path.isdir(cache_path):
+                        # Removed outside of olah
+                        self._index.discard_file(cache_path)
+                        continue
+                    try:
+                        cache_file = self._open_cache(cache_path)
+                    except Exception:
+                        self._index.discard_file(cache_path)
+                        continue
+                    opened[cache_path] = cache_file
+
+                # Forget the victim first, so that a failing block cannot stall the loop
+                self._index.evict(cache_path, block_index)
+                freed_size = cache_file.remove_block(block_index)
+                if freed_size == 0:
+                    continue
+                evicted_blocks += 1
+                evicted_size += freed_size
+        finally:
+            for cache_path, cache_file in opened.items():
+                cache_file.close()
+                self._remove_empty_cache(cache_path)
+            CACHE_EVICTED_BLOCKS.inc(evicted_blocks)
+            CACHE_EVICTED_BYTES.inc(evicted_size)
+        return evicted_blocks, evicted_size
+
+
+class CacheEvictionDaemon(object):
+    """
+    Background task keeping the cache size between two watermarks.
+
+    The daemon sleeps until the ledger crosses the high watermark (or a block write is
+    announced that would cross it) and then evicts down to the low watermark. The
+    eviction runs in worker threads in batches of `batch_blocks` blocks with a pause in
+    between, so a large eviction never monopolizes the disk or the thread pool.
+    The size is also checked every `check_interval` seconds as a fallback.
+    """
+
+    def __init__(
+        self,
+        ledger: CacheSizeLedger,
+        index: CacheAccessIndex,
+        evictor: CacheEvictor,
+        limit_size: int,
+        high_watermark: float = 0.95,
+        low_watermark: float = 0.85,
+        check_interval: float = CACHE_EVICTION_CHECK_INTERVAL,
+        batch_blocks: int = CACHE_EVICTION_BATCH_BLOCKS,
+        batch_interval: float = CACHE_EVICTION_BATCH_INTERVAL,
+    ) -> None:
+        if not 0 < low_watermark <= high_watermark <= 1:
+            raise Exception(
+                "Invalid cache watermarks. Expected 0 < low watermark <= high watermark <= 1."
+            )
+        self._ledger = ledger
+        self._index = index
+        self._evictor = evictor
+        self.limit_size = limit_size
+        self.high_size = int(limit_size * high_watermark)
+        self.low_size = int(limit_size * low_watermark)
+        self._check_interval = check_interval
+        self._batch_blocks = batch_blocks
+        self._batch_interval = batch_interval
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def wake(self) -> None:
+        """
+        Wakes the daemon up. Safe to call from any thread.
+        """
+        if self._loop is None or self._wakeup is None or self._loop.is_closed():
+            return
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is self._loop:
+            self._wakeup.set()
+        else:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._ledger.set_watermark(self.high_size, self.wake)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        self._ledger.set_watermark(None, None)
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def _ready(self) -> bool:
+        # Evicting with a ledger that was never reconciled or an index that was never
+        # built would pick the wrong victims
+        return self._ledger.reconciled_at is not None and self._index.ready
+
+    async def run_once(self) -> Tuple[int, int]:
+        """
+        Evicts down to the low watermark if the cache is above the high watermark.
+
+        Returns:
+            Tuple[int, int]: The number of evicted blocks and the number of freed bytes.
+        """
+        if not self._ready() or self._ledger.size < self.high_size:
+            return 0, 0
+        limit_size_h = convert_bytes_to_human_readable(self.limit_size)
+        print(
+            f"Cache size exceeded the high watermark! Limit: {limit_size_h}, "
+            f"Current: {convert_bytes_to_human_readable(self._ledger.size)}."
+        )
+        total_blocks = 0
+        total_size = 0
+        while self._ledger.size >= self.low_size:
+            evicted_blocks, evicted_size = await fastapi.concurrency.run_in_threadpool(
+                self._evictor.evict, self.low_size, self._batch_blocks
+            )
+            total_blocks += evicted_blocks
+            total_size += evicted_size
+            if evicted_blocks == 0:
+                break
+            await asyncio.sleep(self._batch_interval)
+        print(
+            f"Removed {total_blocks} blocks. Size: {convert_bytes_to_human_readable(total_size)}. "
+            f"Limit: {limit_size_h}, Current: {convert_bytes_to_human_readable(self._ledger.size)}."
+        )
+        return total_blocks, total_size
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self._check_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Cache eviction failed: {e}", file=sys.stderr)
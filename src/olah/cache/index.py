@@ -0,0 +1,485 @@
+# coding=utf-8
+# Copyright 2024 XiaHan
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+import json
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import fastapi.concurrency
+
+from olah.constants import CACHE_INDEX_COMPACT_MIN_EVENTS
+
+from .ledger import atomic_write_json, get_state_dir
+from .policies import EvictionPolicy, LRUPolicy
+
+CURRENT_INDEX_VERSION = 1
+BLOCK_FILE_PATTERN = re.compile(r"^block_([0-9]+)\.bin$")
+INDEX_LOG_PATTERN = re.compile(r"^access_index-[0-9]+\.log$")
+
+
+@dataclass
+class BlockRecord:
+    size: int
+    created: float
+    last_access: float
+    hits: int = 0
+
+    def to_list(self) -> List:
+        return [self.size, self.created, self.last_access, self.hits]
+
+    @staticmethod
+    def from_list(data: List) -> "BlockRecord":
+        size, created, last_access, hits = data
+        return BlockRecord(size=size, created=created, last_access=last_access, hits=hits)
+
+
+class CacheAccessIndex(object):
+    """
+    In-process index of every cached block: (cache file, block index) -> size, creation
+    time, last access time and hit count.
+
+    Cache files are keyed by their path relative to `repos_path`, so the index stays valid
+    when the cache directory is mounted elsewhere. The index replaces file atime, which is
+    unreliable on `noatime` mounts, and is persisted to `<repos_path>/.olah/access_index.json`
+    plus an append-only log of the changes since that snapshot.
+
+    Every change is forwarded to the `EvictionPolicy`, which orders the eviction victims.
+    """
+
+    def __init__(self, repos_path: str, policy: Optional[EvictionPolicy] = None) -> None:
+        self._repos_path = os.path.abspath(repos_path)
+        self._index_path = os.path.join(get_state_dir(repos_path), "access_index.json")
+        self._journal_path = os.path.join(get_state_dir(repos_path), "index_journal")
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+
+        self._files: Dict[str, Dict[int, BlockRecord]] = {}
+        self._policy: EvictionPolicy = policy if policy is not None else LRUPolicy()
+        self._ready: bool = False
+        self._journal: Optional[List] = None
+
+        # Changes not persisted yet, and the log following the persisted snapshot
+        self._pending: List = []
+        self._log_name: Optional[str] = None
+        self._log_events: int = 0
+        self._snapshot_blocks: int = 0
+
+    @property
+    def ready(self) -> bool:
+        return self._ready
+
+    def _key(self, cache_path: str) -> str:
+        return os.path.relpath(os.path.abspath(cache_path), self._repos_path)
+
+    def get_cache_path(self, key: str) -> str:
+        return os.path.join(self._repos_path, key)
+
+    @property
+    def policy(self) -> EvictionPolicy:
+        return self._policy
+
+    def record_write(
+        self,
+        cache_path: str,
+        block_index: int,
+        size: int,
+        object_size: Optional[int] = None,
+    ) -> None:
+        self._apply(["write", self._key(cache_path), block_index, size, object_size, time.time()])
+
+    def record_access(
+        self,
+        cache_path: str,
+        block_index: int,
+        size: Optional[int] = None,
+        object_size: Optional[int] = None,
+    ) -> None:
+        self._apply(["access", self._key(cache_path), block_index, size, object_size, time.time()])
+
+    def discard(self, cache_path: str, block_index: int) -> None:
+        self._apply(["discard", self._key(cache_path), block_index])
+
+    def evict(self, cache_path: str, block_index: int) -> None:
+        # Like `discard`, for the victims of the eviction policy
+        self._apply(["evict", self._key(cache_path), block_index])
+
+    def discard_file(self, cache_path: str) -> None:
+        self._apply(["discard_file", self._key(cache_path)])
+
+    def _apply(self, event: List, journal: bool = True) -> None:
+        with self._lock:
+            self._apply_locked(event)
+            if journal and self._journal is not None:
+                self._journal.append(event)
+
+    def _apply_locked(self, event: List) -> None:
+        # Must hold `self._lock`.
+        if _apply_event(self._files, event, self._policy) and self._journal is None:
+            self._pending.append(event)
+
+    @property
+    def journaling(self) -> bool:
+        return self._journal is not None
+
+    def start_journal(self) -> None:
+        """
+        Starts recording the changes of this index, for a worker process that does not
+        own the persisted index. The changes are handed over with `flush_journal` and
+        applied by the owner with `ingest_journals`.
+        """
+        with self._lock:
+            if self._journal is None:
+                self._journal = []
+
+    def stop_journal(self) -> None:
+        self.flush_journal()
+        with self._lock:
+            self._journal = None
+
+    def flush_journal(self) -> None:
+        with self._lock:
+            if not self._journal:
+                return
+            events, self._journal = self._journal, []
+        atomic_write_json(
+            os.path.join(self._journal_path, f"{os.getpid()}-{time.time_ns()}.json"), events
+        )
+
+    def ingest_journals(self) -> int:
+        """
+        Applies the changes recorded by the other worker processes.
+
+        Returns:
+            int: The number of applied changes.
+        """
+        if not os.path.isdir(self._journal_path):
+            return 0
+        applied = 0
+        for name in sorted(os.listdir(self._journal_path)):
+            if name.startswith(".") or not name.endswith(".json"):
+                continue
+            path = os.path.join(self._journal_path, name)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    events = json.load(f)
+                os.remove(path)
+            except (OSError, json.JSONDecodeError):
+                continue
+            with self._lock:
+                for event in events:
+                    self._apply_locked(event)
+            applied += len(events)
+        return applied
+
+    async def aingest_journals(self) -> int:
+        return await fastapi.concurrency.run_in_threadpool(self.ingest_journals)
+
+    def victim(self) -> Optional[Tuple[str, int]]:
+        """
+        Returns the (cache path, block index) the eviction policy wants to evict next.
+        """
+        with self._lock:
+            victim = self._policy.victim()
+        if victim is None:
+            return None
+        key, block_index = victim
+        return self.get_cache_path(key), block_index
+
+    def get(self, cache_path: str, block_index: int) -> Optional[BlockRecord]:
+        key = self._key(cache_path)
+        with self._lock:
+            record = self._files.get(key, {}).get(block_index, None)
+            if record is None:
+                return None
+            return BlockRecord(record.size, record.created, record.last_access, record.hits)
+
+    def file_block_count(self, cache_path: str) -> int:
+        key = self._key(cache_path)
+        with self._lock:
+            return len(self._files.get(key, {}))
+
+    def file_last_access(self, cache_path: str) -> Optional[float]:
+        key = self._key(cache_path)
+        with self._lock:
+            blocks = self._files.get(key, None)
+            if not blocks:
+                return None
+            return max(r.last_access for r in blocks.values())
+
+    def snapshot(self) -> List[Tuple[str, int, BlockRecord]]:
+        """
+        Returns a consistent copy of all records as (key, block_index, record) tuples.
+        """
+        with self._lock:
+            return [
+                (key, block_index, BlockRecord(r.size, r.created, r.last_access, r.hits))
+                for key, blocks in self._files.items()
+                for block_index, r in blocks.items()
+            ]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(len(blocks) for blocks in self._files.values())
+
+    def load(self, keep_live: bool = True) -> bool:
+        """
+        Loads the persisted index. With `keep_live`, the writes and accesses recorded
+        since startup are kept, otherwise they are assumed to be part of the persisted
+        index already (handed over through the journal).
+
+        Returns:
+            bool: True if a valid index was found, False if the index needs a rebuild.
+        """
+        if not os.path.exists(self._index_path):
+            return False
+        try:
+            with open(self._index_path, "r", encoding="utf-8") as f:
+                obj = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return False
+        if obj.get("version", None) != CURRENT_INDEX_VERSION:
+            return False
+        files: Dict[str, Dict[int, BlockRecord]] = {}
+        for key, blocks in obj.get("files", {}).items():
+            files[key] = {
+                int(block_index): BlockRecord.from_list(data)
+                for block_index, data in blocks.items()
+            }
+        snapshot_blocks = sum(len(blocks) for blocks in files.values())
+        log_name = obj.get("log", None)
+        log_events, log_clean = 0, True
+        if log_name is not None:
+            log_events, log_clean = self._replay_log(files, log_name)
+        with self._lock:
+            if keep_live:
+                self._merge_live_records(files)
+            self._files = files
+            self._warm_up_policy()
+            self._ready = True
+            # A torn log is never appended to, the next save starts a new snapshot
+            self._log_name = log_name if log_clean else None
+            self._log_events = log_events
+            self._snapshot_blocks = snapshot_blocks
+        return True
+
+    def _replay_log(
+        self, files: Dict[str, Dict[int, BlockRecord]], log_name: str
+    ) -> Tuple[int, bool]:
+        # Returns the number of replayed changes, and whether every line could be read.
+        log_path = os.path.join(os.path.dirname(self._index_path), log_name)
+        if not os.path.exists(log_path):
+            return 0, True
+        replayed, clean = 0, True
+        try:
+            with open(log_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        event = json.loads(line)
+                    except json.JSONDecodeError:
+                        # The tail of a write interrupted by a crash
+                        clean = False
+                        continue
+                    _apply_event(files, event, None)
+                    replayed += 1
+        except OSError:
+            return replayed, False
+        return replayed, clean
+
+    def _merge_live_records(self, files: Dict[str, Dict[int, BlockRecord]]) -> None:
+        # Keep the writes and accesses recorded since startup. Must hold `self._lock`.
+        for key, blocks in self._files.items():
+            target = files.setdefault(key, {})
+            for block_index, record in blocks.items():
+                base = target.get(block_index, None)
+                if base is None:
+                    target[block_index] = record
+                    continue
+                base.last_access = max(base.last_access, record.last_access)
+                base.hits += record.hits
+                if record.size != 0:
+                    base.size = record.size
+
+    def _warm_up_policy(self) -> None:
+        # Replay the index into a fresh policy, oldest access first. Must hold `self._lock`.
+        self._policy = type(self._policy)(capacity=self._policy.capacity)
+        items = []
+        for key, blocks in self._files.items():
+            # Only the cached part of the file is known here
+            object_size = sum(r.size for r in blocks.values())
+            for block_index, r in blocks.items():
+                items.append((r.last_access, key, block_index, r, object_size))
+        items.sort(key=lambda item: item[0])
+        for _, key, block_index, r, object_size in items:
+            self._policy.warm_up((key, block_index), r.size, r.hits, object_size)
+
+    def save(self, compact: bool = False) -> None:
+        """
+        Persists the changes since the last save by appending them to the index log, so
+        that a save costs as much as the changes rather than the whole index. Once the log
+        outgrows the snapshot, or with `compact`, a new snapshot is written instead.
+        """
+        with self._save_lock:
+            with self._lock:
+                if not self._ready:
+                    # Never overwrite a persisted index with a partial one. The changes
+                    # are kept as live records by the coming load or rebuild.
+                    self._pending = []
+                    return
+                events, self._pending = self._pending, []
+                compact = (
+                    compact
+                    or self._log_name is None
+                    or self._log_events + len(events)
+                    > max(CACHE_INDEX_COMPACT_MIN_EVENTS, self._snapshot_blocks)
+                )
+                if compact:
+                    log_name = f"access_index-{time.time_ns()}.log"
+                    obj = {
+                        "version": CURRENT_INDEX_VERSION,
+                        "log": log_name,
+                        "files": {
+                            key: {str(i): r.to_list() for i, r in blocks.items()}
+                            for key, blocks in self._files.items()
+                        },
+                    }
+                    snapshot_blocks = sum(len(blocks) for blocks in self._files.values())
+            if compact:
+                self._write_snapshot(obj, log_name, snapshot_blocks)
+            elif len(events) > 0:
+                self._append_log(events)
+
+    def _write_snapshot(self, obj: Dict, log_name: str, snapshot_blocks: int) -> None:
+        # Must hold `self._save_lock`.
+        atomic_write_json(self._index_path, obj)
+        self._log_name = log_name
+        self._log_events = 0
+        self._snapshot_blocks = snapshot_blocks
+        # The logs of the previous snapshots, including ones left behind by a crash
+        state_dir = os.path.dirname(self._index_path)
+        for name in os.listdir(state_dir):
+            if INDEX_LOG_PATTERN.match(name) is not None and name != log_name:
+                try:
+                    os.remove(os.path.join(state_dir, name))
+                except OSError:
+                    pass
+
+    def _append_log(self, events: List) -> None:
+        # Must hold `self._save_lock`.
+        log_path = os.path.join(os.path.dirname(self._index_path), self._log_name)
+        with open(log_path, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(event, ensure_ascii=False) + "\n" for event in events))
+        self._log_events += len(events)
+
+    async def asave(self) -> None:
+        await fastapi.concurrency.run_in_threadpool(self.save)
+
+    def _walk_blocks(self) -> Iterator[Tuple[str, int, BlockRecord]]:
+        for sub_dir in ["files", "lfs"]:
+            for dirpath, dirnames, filenames in os.walk(os.path.join(self._repos_path, sub_dir)):
+                if os.path.basename(dirpath) != "blocks":
+                    continue
+                cache_path = os.path.dirname(dirpath)
+                for f in filenames:
+                    match = BLOCK_FILE_PATTERN.match(f)
+                    if match is None:
+                        continue
+                    try:
+                        stat_info = os.stat(os.path.join(dirpath, f))
+                    except OSError:
+                        continue
+                    yield self._key(cache_path), int(match.group(1)), BlockRecord(
+                        size=stat_info.st_size,
+                        created=stat_info.st_mtime,
+                        last_access=max(stat_info.st_atime, stat_info.st_mtime),
+                    )
+
+    def rebuild(self) -> int:
+        """
+        Rebuilds the index from the blocks on disk. The file times are only used as a
+        starting point for blocks that have not been accessed since startup.
+
+        Returns:
+            int: The number of indexed blocks.
+        """
+        files: Dict[str, Dict[int, BlockRecord]] = {}
+        for key, block_index, record in self._walk_blocks():
+            files.setdefault(key, {})[block_index] = record
+        with self._lock:
+            self._merge_live_records(files)
+            self._files = files
+            self._warm_up_policy()
+            self._ready = True
+        self.save(compact=True)
+        return len(self)
+
+    async def arebuild(self) -> int:
+        return await fastapi.concurrency.run_in_threadpool(self.rebuild)
+
+
+def _apply_event(
+    files: Dict[str, Dict[int, BlockRecord]], event: List, policy: Optional[EvictionPolicy]
+) -> bool:
+    """
+    Applies one change to the records in `files`, and to `policy` unless it is None.
+
+    Returns:
+        bool: True if the records changed.
+    """
+    op, key = event[0], event[1]
+    if op == "write":
+        _, _, block_index, size, object_size, now = event
+        blocks = files.setdefault(key, {})
+        record = blocks.get(block_index, None)
+        if record is None:
+            blocks[block_index] = BlockRecord(size=size, created=now, last_access=now)
+            if policy is not None:
+                policy.record_insert((key, block_index), size, object_size)
+        else:
+            record.size = size
+            record.last_access = now
+            if policy is not None:
+                policy.record_access((key, block_index), size, object_size)
+    elif op == "access":
+        _, _, block_index, size, object_size, now = event
+        blocks = files.setdefault(key, {})
+        record = blocks.get(block_index, None)
+        if record is None:
+            # Blocks written before the index existed
+            blocks[block_index] = BlockRecord(size=size or 0, created=now, last_access=now, hits=1)
+            if policy is not None:
+                policy.record_insert((key, block_index), size or 0, object_size)
+        else:
+            record.last_access = now
+            record.hits += 1
+            if policy is not None:
+                policy.record_access((key, block_index), record.size, object_size)
+    elif op == "discard" or op == "evict":
+        block_index = event[2]
+        if policy is not None and op == "evict":
+            policy.record_evict((key, block_index))
+        elif policy is not None:
+            policy.record_remove((key, block_index))
+        blocks = files.get(key, None)
+        if blocks is None:
+            return False
+        blocks.pop(block_index, None)
+        if len(blocks) == 0:
+            files.pop(key)
+    elif op == "discard_file":
+        blocks = files.pop(key, None)
+        if blocks is None:
+            return False
+        if policy is not None:
+            for block_index in blocks.keys():
+                policy.record_remove((key, block_index))
+    else:
+        return False
+    return True
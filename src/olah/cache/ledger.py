@@ -0,0 +1,195 @@
+# coding=utf-8
+# Copyright 2024 XiaHan
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Callable, Optional
+
+import fastapi.concurrency
+import portalocker
+
+from olah.utils.disk_utils import get_folder_size
+
+CURRENT_LEDGER_VERSION = 1
+OLAH_STATE_DIR = ".olah"
+
+
+def get_state_dir(repos_path: str) -> str:
+    return os.path.join(repos_path, OLAH_STATE_DIR)
+
+
+def atomic_write_json(path: str, obj) -> None:
+    """
+    Writes a JSON document to `path` through a temporary file and an atomic rename,
+    so that a crash never leaves a truncated state file behind.
+    """
+    save_dir = os.path.dirname(path)
+    os.makedirs(save_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=save_dir, prefix=".tmp_", suffix=".json")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(obj, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class CacheSizeLedger(object):
+    """
+    Running total of the bytes stored under `repos_path`.
+
+    The ledger is updated on every block write and delete, so reading the current
+    cache size is O(1). It is persisted to `<repos_path>/.olah/ledger.json` and
+    reconciled against a full directory walk from time to time to correct drift
+    caused by files written outside of the block cache (api json caches, crashes, ...).
+
+    Several worker processes can share a ledger: each one adds the changes made since
+    its last save to the persisted size, under a file lock, and picks up the changes of
+    the other workers in return.
+    """
+
+    def __init__(self, repos_path: str) -> None:
+        self._repos_path = repos_path
+        self._ledger_path = os.path.join(get_state_dir(repos_path), "ledger.json")
+        self._file_lock_path = self._ledger_path + ".lock"
+        self._lock = threading.Lock()
+
+        self._size: int = 0
+        self._reconciled_at: Optional[float] = None
+        # Changes not saved yet, and whether `_size` replaces the persisted size
+        self._pending: int = 0
+        self._dirty: bool = False
+
+        self._watermark: Optional[int] = None
+        self._watermark_callback: Optional[Callable[[], None]] = None
+
+    @property
+    def size(self) -> int:
+        with self._lock:
+            return self._size
+
+    @property
+    def reconciled_at(self) -> Optional[float]:
+        with self._lock:
+            return self._reconciled_at
+
+    def set_watermark(self, watermark: Optional[int], callback: Optional[Callable[[], None]]) -> None:
+        """
+        Registers `callback`, called whenever an addition leaves the cache size at or
+        above `watermark`. The callback runs on the writer's thread and must not block.
+        """
+        with self._lock:
+            self._watermark = watermark
+            self._watermark_callback = callback
+
+    def _notify(self, size: int) -> None:
+        callback = self._watermark_callback
+        if callback is not None and self._watermark is not None and size >= self._watermark:
+            callback()
+
+    def add(self, nbytes: int) -> None:
+        if nbytes == 0:
+            return
+        with self._lock:
+            self._size = max(0, self._size + nbytes)
+            self._pending += nbytes
+            size = self._size
+        if nbytes > 0:
+            self._notify(size)
+
+    def remove(self, nbytes: int) -> None:
+        self.add(-nbytes)
+
+    def reserve(self, nbytes: int) -> None:
+        """
+        Announces an upcoming write of `nbytes`, so that eviction can start before the
+        write pushes the cache over the watermark.
+        """
+        self._notify(self.size + nbytes)
+
+    def exceeds(self, limit: int) -> bool:
+        return self.size >= limit
+
+    def _read(self) -> Optional[dict]:
+        if not os.path.exists(self._ledger_path):
+            return None
+        try:
+            with open(self._ledger_path, "r", encoding="utf-8") as f:
+                obj = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+        if obj.get("version", None) != CURRENT_LEDGER_VERSION:
+            return None
+        return obj
+
+    def load(self) -> bool:
+        """
+        Loads the persisted ledger.
+
+        Returns:
+            bool: True if a valid ledger was found, False if the ledger needs a reconcile.
+        """
+        obj = self._read()
+        if obj is None:
+            return False
+        with self._lock:
+            self._size = max(0, int(obj.get("size", 0)) + self._pending)
+            self._reconciled_at = obj.get("reconciled_at", None)
+            self._dirty = False
+        return True
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(self._file_lock_path), exist_ok=True)
+        with portalocker.Lock(self._file_lock_path, "a", timeout=60, flags=portalocker.LOCK_EX):
+            persisted = self._read()
+            with self._lock:
+                if persisted is not None and not self._dirty:
+                    if self._pending == 0:
+                        # Nothing to add, only pick up the changes of other workers
+                        self._size = int(persisted.get("size", 0))
+                        self._reconciled_at = persisted.get("reconciled_at", None)
+                        return
+                    self._size = max(0, int(persisted.get("size", 0)) + self._pending)
+                    self._reconciled_at = persisted.get("reconciled_at", None)
+                obj = {
+                    "version": CURRENT_LEDGER_VERSION,
+                    "size": self._size,
+                    "reconciled_at": self._reconciled_at,
+                    "saved_at": time.time(),
+                }
+                self._pending = 0
+                self._dirty = False
+            atomic_write_json(self._ledger_path, obj)
+
+    async def asave(self) -> None:
+        await fastapi.concurrency.run_in_threadpool(self.save)
+
+    async def reconcile(self) -> int:
+        """
+        Recomputes the cache size with a full walk of `repos_path` in a worker thread.
+
+        Writes that happen while the walk is running may or may not be counted; the
+        remaining error is bounded by the in-flight writes and fixed at the next reconcile.
+
+        Returns:
+            int: The reconciled cache size in bytes.
+        """
+        walked_size = await fastapi.concurrency.run_in_threadpool(
+            get_folder_size, self._repos_path
+        )
+        with self._lock:
+            self._size = walked_size
+            self._reconciled_at = time.time()
+            self._pending = 0
+            self._dirty = True
+        await self.asave()
+        return walked_size
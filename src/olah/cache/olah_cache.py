@@ -12,14 +12,22 @@ import os
 import string
 import struct
 import threading
+import time
 import gzip
 from typing import BinaryIO, Dict, List, Optional
 
-import aiofiles
 import fastapi
 import fastapi.concurrency
 import portalocker
+from olah.metrics.collectors import (
+    CACHE_BLOCK_COMPRESSION_DURATION,
+    CACHE_BLOCK_READ_DURATION,
+    CACHE_BLOCK_WRITE_DURATION,
+)
+from olah.utils.executors import FS_EXECUTOR, run_in_executor
 from .bitset import Bitset
+from .index import CacheAccessIndex
+from .ledger import CacheSizeLedger
 
 CURRENT_OLAH_CACHE_VERSION = 9
 # Due to the download chunk settings: https://github.com/huggingface/huggingface_hub/blob/main/src/huggingface_hub/constants.py#L37
@@ -130,11 +138,21 @@ class OlahCacheHeader(object):
 
 
 class OlahCache(object):
-    def __init__(self, path: str, block_size: int = DEFAULT_BLOCK_SIZE) -> None:
+    def __init__(
+        self,
+        path: str,
+        block_size: int = DEFAULT_BLOCK_SIZE,
+        ledger: Optional[CacheSizeLedger] = None,
+        index: Optional[CacheAccessIndex] = None,
+    ) -> None:
         self.path: Optional[str] = path
         self.header: Optional[OlahCacheHeader] = None
         self.is_open: bool = False
 
+        # Size and access accounting
+        self._ledger = ledger
+        self._index = index
+
         # Lock
         self._header_lock = threading.Lock()
         
@@ -145,8 +163,13 @@ class OlahCache(object):
         self.open(path, block_size=block_size)
 
     @staticmethod
-    def create(path: str, block_size: int = DEFAULT_BLOCK_SIZE):
-        return OlahCache(path, block_size=block_size)
+    def create(
+        path: str,
+        block_size: int = DEFAULT_BLOCK_SIZE,
+        ledger: Optional[CacheSizeLedger] = None,
+        index: Optional[CacheAccessIndex] = None,
+    ):
+        return OlahCache(path, block_size=block_size, ledger=ledger, index=index)
 
     def open(self, path: str, block_size: int = DEFAULT_BLOCK_SIZE):
         if self.is_open:
@@ -174,6 +197,8 @@ class OlahCache(object):
                         file_size=0,
                     )
                     self.header.write(f)
+            if self._ledger is not None:
+                self._ledger.add(OlahCacheHeader.HEADER_FIX_SIZE)
 
         self.is_open = True
 
@@ -193,7 +218,13 @@ class OlahCache(object):
         if self.path is None:
             raise Exception("The path of cache file is None")
         with self._header_lock:
-            with portalocker.Lock(self._meta_path, "rb+", flags=portalocker.LOCK_EX) as f:
+            # The cache folder may have been evicted while this file was open
+            if os.path.exists(self._meta_path):
+                mode = "rb+"
+            else:
+                os.makedirs(self.path, exist_ok=True)
+                mode = "wb"
+            with portalocker.Lock(self._meta_path, mode, flags=portalocker.LOCK_EX) as f:
                 f.seek(0)
                 self.header.write(f)
 
@@ -245,9 +276,51 @@ class OlahCache(object):
             raise Exception("This file has been close.")
         self._flush_header()
 
+    def _get_block_path(self, block_index: int) -> str:
+        return string.Template(self._data_path).substitute(block_index=f"{block_index:0>8}")
+
     def has_block(self, block_index: int) -> bool:
-        block_path = string.Template(self._data_path).substitute(block_index=f"{block_index:0>8}")
-        return os.path.exists(block_path)
+        return os.path.exists(self._get_block_path(block_index))
+
+    def get_block_disk_size(self, block_index: int) -> int:
+        try:
+            return os.path.getsize(self._get_block_path(block_index))
+        except OSError:
+            return 0
+
+    def remove_block(self, block_index: int) -> int:
+        """
+        Removes a cached block from disk and returns the number of bytes freed.
+        """
+        if not self.is_open:
+            raise Exception("This file has been closed.")
+        block_path = self._get_block_path(block_index)
+        if not os.path.exists(block_path):
+            return 0
+        with portalocker.Lock(block_path, "rb", timeout=60, flags=portalocker.LOCK_EX) as fh:
+            freed_size = os.fstat(fh.fileno()).st_size
+        os.remove(block_path)
+        if self._ledger is not None:
+            self._ledger.remove(freed_size)
+        if self._index is not None:
+            self._index.discard(self.path, block_index)
+        return freed_size
+
+    @staticmethod
+    def _read_block_file(block_path: str) -> Optional[bytes]:
+        try:
+            with portalocker.Lock(block_path, "rb", timeout=60, flags=portalocker.LOCK_SH) as fh:
+                # Compressed blocks can be larger than the block size
+                return fh.read()
+        except FileNotFoundError:
+            # The block has not been cached, or has been evicted
+            return None
+
+    @staticmethod
+    def _write_block_file(block_path: str, block_data: bytes) -> None:
+        os.makedirs(os.path.dirname(block_path), exist_ok=True)
+        with portalocker.Lock(block_path, "wb+", timeout=60, flags=portalocker.LOCK_EX) as fh:
+            fh.write(block_data)
 
     async def read_block(self, block_index: int) -> Optional[bytes]:
         if not self.is_open:
@@ -262,35 +335,40 @@ class OlahCache(object):
         if self.header is None:
             raise Exception("The header of cache file is None")
 
-        if not self.has_block(block_index=block_index):
+        block_path = self._get_block_path(block_index)
+
+        read_start = time.perf_counter()
+        # The file lock can wait on a writer for long, take it off the event loop
+        raw_block = await run_in_executor(FS_EXECUTOR, self._read_block_file, block_path)
+        if raw_block is None:
             return None
-        
-        block_path = string.Template(self._data_path).substitute(block_index=f"{block_index:0>8}")
 
-        with portalocker.Lock(block_path, "rb", timeout=60, flags=portalocker.LOCK_SH) as fh:
-            async with aiofiles.open(block_path, mode='rb') as f:
-                raw_block = await f.read(self._get_block_size())
+        if self._index is not None:
+            self._index.record_access(
+                self.path, block_index, len(raw_block), self._get_file_size()
+            )
         
         def decompression(block_data: bytes, compression_algo: int):
             # compression
             if compression_algo == 0:
-                return block_data
-            elif compression_algo == 1:
-                block_data = gzip.decompress(block_data)
-            elif compression_algo == 2:
-                lzma_dec = lzma.LZMADecompressor()
-                block_data = lzma_dec.decompress(block_data)
-            else:
-                raise Exception("Unsupported compression algorithm.")
-            return block_data
-
-        raw_block = await fastapi.concurrency.run_in_threadpool(
+                return self._pad_block(block_data)
+            with CACHE_BLOCK_COMPRESSION_DURATION.time(operation="decompress"):
+                if compression_algo == 1:
+                    block_data = gzip.decompress(block_data)
+                elif compression_algo == 2:
+                    lzma_dec = lzma.LZMADecompressor()
+                    block_data = lzma_dec.decompress(block_data)
+                else:
+                    raise Exception("Unsupported compression algorithm.")
+            return self._pad_block(block_data)
+
+        block = await fastapi.concurrency.run_in_threadpool(
             decompression,
             raw_block,
             self.header.compression_algo
         )
 
-        block = self._pad_block(raw_block)
+        CACHE_BLOCK_READ_DURATION.observe(time.perf_counter() - read_start)
         return block
 
     async def write_block(self, block_index: int, block_bytes: bytes) -> None:
@@ -320,15 +398,18 @@ class OlahCache(object):
         def compression(block_data: bytes, compression_algo: int):
             if compression_algo == 0:
                 return block_data
-            elif compression_algo == 1:
-                block_data = gzip.compress(block_data, compresslevel=4)
-            elif compression_algo == 2:
-                lzma_enc = lzma.LZMACompressor()
-                block_data = lzma_enc.compress(block_data)
-            else:
-                raise Exception("Unsupported compression algorithm.")
+            with CACHE_BLOCK_COMPRESSION_DURATION.time(operation="compress"):
+                if compression_algo == 1:
+                    block_data = gzip.compress(block_data, compresslevel=4)
+                elif compression_algo == 2:
+                    lzma_enc = lzma.LZMACompressor()
+                    block_data = lzma_enc.compress(block_data)
+                else:
+                    raise Exception("Unsupported compression algorithm.")
             return block_data
 
+        write_start = time.perf_counter()
+
         # Run in the default thread pool executor
         real_block_bytes = await fastapi.concurrency.run_in_threadpool(
             compression,
@@ -336,13 +417,23 @@ class OlahCache(object):
             self.header.compression_algo
         )
    
-        block_path = string.Template(self._data_path).substitute(block_index=f"{block_index:0>8}")
-
-        with portalocker.Lock(block_path, 'wb+', timeout=60, flags=portalocker.LOCK_EX) as fh:
-            async with aiofiles.open(block_path, mode='wb+') as f:
-                await f.write(real_block_bytes)
+        block_path = self._get_block_path(block_index)
+        old_disk_size = await run_in_executor(FS_EXECUTOR, self.get_block_disk_size, block_index)
+        if self._ledger is not None:
+            # Wake up the eviction before the write lands, not after the disk is full
+            self._ledger.reserve(len(real_block_bytes) - old_disk_size)
+
+        await run_in_executor(FS_EXECUTOR, self._write_block_file, block_path, real_block_bytes)
+
+        if self._ledger is not None:
+            self._ledger.add(len(real_block_bytes) - old_disk_size)
+        if self._index is not None:
+            self._index.record_write(
+                self.path, block_index, len(real_block_bytes), self._get_file_size()
+            )
 
-        self._flush_header()
+        await run_in_executor(FS_EXECUTOR, self._flush_header)
+        CACHE_BLOCK_WRITE_DURATION.observe(time.perf_counter() - write_start)
 
     def _resize_file_size(self, file_size: int):
         """
@@ -0,0 +1,464 @@
+# coding=utf-8
+# Copyright 2024 XiaHan
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+import hashlib
+import heapq
+import itertools
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional, Tuple
+
+EVICTION_POLICIES = ["LRU", "FIFO", "LARGE_FIRST", "LFU", "2Q", "TINYLFU", "GDSF"]
+
+
+class EvictionPolicy(ABC):
+    """
+    Decides which cached block is evicted next.
+
+    A policy observes every insert, access and removal of a block and keeps whatever
+    state it needs to answer `victim()`. Keys are opaque and hashable; `size` is the
+    size of the block on disk and `object_size` the size of the whole file the block
+    belongs to, for size-aware policies.
+
+    Policies are not thread-safe, the owner serializes the calls.
+    """
+
+    name: str = ""
+
+    def __init__(self, capacity: Optional[int] = None) -> None:
+        self.capacity = capacity
+
+    @abstractmethod
+    def record_insert(self, key: Hashable, size: int, object_size: Optional[int] = None) -> None:
+        pass
+
+    @abstractmethod
+    def record_access(self, key: Hashable, size: int, object_size: Optional[int] = None) -> None:
+        pass
+
+    @abstractmethod
+    def record_remove(self, key: Hashable) -> None:
+        pass
+
+    def record_evict(self, key: Hashable) -> None:
+        """
+        Removes a key that was evicted as the victim, unlike `record_remove` which is also
+        used for blocks deleted or replaced for other reasons.
+        """
+        self.record_remove(key)
+
+    @abstractmethod
+    def victim(self) -> Optional[Hashable]:
+        """
+        Returns the key that should be evicted next, or None if the policy is empty.
+        The key stays tracked until `record_remove` is called.
+        """
+        pass
+
+    @abstractmethod
+    def __len__(self) -> int:
+        pass
+
+    def warm_up(self, key: Hashable, size: int, hits: int, object_size: Optional[int] = None) -> None:
+        """
+        Restores a block from the persisted access index. Blocks are warmed up in
+        increasing order of their last access time.
+        """
+        self.record_insert(key, size, object_size)
+        if hits > 0:
+            self.record_access(key, size, object_size)
+
+
+class LRUPolicy(EvictionPolicy):
+    name = "LRU"
+
+    def __init__(self, capacity: Optional[int] = None) -> None:
+        super().__init__(capacity)
+        self._entries: "OrderedDict[Hashable, int]" = OrderedDict()
+
+    def record_insert(self, key, size, object_size=None) -> None:
+        self._entries[key] = size
+        self._entries.move_to_end(key)
+
+    def record_access(self, key, size, object_size=None) -> None:
+        if key not in self._entries:
+            self.record_insert(key, size, object_size)
+            return
+        self._entries.move_to_end(key)
+
+    def record_remove(self, key) -> None:
+        self._entries.pop(key, None)
+
+    def victim(self) -> Optional[Hashable]:
+        return next(iter(self._entries), None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class FIFOPolicy(LRUPolicy):
+    name = "FIFO"
+
+    def record_access(self, key, size, object_size=None) -> None:
+        if key not in self._entries:
+            self.record_insert(key, size, object_size)
+
+
+class HeapPolicy(EvictionPolicy):
+    """
+    Base class of priority based policies. The entry with the lowest priority is
+    evicted first. Stale heap entries are skipped lazily and compacted from time to time.
+    """
+
+    def __init__(self, capacity: Optional[int] = None) -> None:
+        super().__init__(capacity)
+        self._heap: List[Tuple[Tuple, int, Hashable]] = []
+        self._current: Dict[Hashable, int] = {}
+        self._counter = itertools.count()
+
+    def _push(self, key: Hashable, priority: Tuple) -> None:
+        seq = next(self._counter)
+        self._current[key] = seq
+        heapq.heappush(self._heap, (priority, seq, key))
+        if len(self._heap) > 2 * len(self._current) + 1024:
+            self._heap = [item for item in self._heap if self._current.get(item[2], None) == item[1]]
+            heapq.heapify(self._heap)
+
+    def _top(self) -> Optional[Tuple[Tuple, int, Hashable]]:
+        while self._heap:
+            item = self._heap[0]
+            if self._current.get(item[2], None) == item[1]:
+                return item
+            heapq.heappop(self._heap)
+        return None
+
+    def record_remove(self, key) -> None:
+        self._current.pop(key, None)
+
+    def victim(self) -> Optional[Hashable]:
+        top = self._top()
+        if top is None:
+            return None
+        return top[2]
+
+    def __len__(self) -> int:
+        return len(self._current)
+
+
+class LargeFirstPolicy(HeapPolicy):
+    name = "LARGE_FIRST"
+
+    def record_insert(self, key, size, object_size=None) -> None:
+        self._push(key, (-size,))
+
+    def record_access(self, key, size, object_size=None) -> None:
+        if key not in self._current:
+            self.record_insert(key, size, object_size)
+
+
+class LFUPolicy(HeapPolicy):
+    """
+    Least frequently used, ties broken by recency.
+    """
+
+    name = "LFU"
+
+    def __init__(self, capacity: Optional[int] = None) -> None:
+        super().__init__(capacity)
+        self._hits: Dict[Hashable, int] = {}
+
+    def record_insert(self, key, size, object_size=None) -> None:
+        self._hits[key] = self._hits.get(key, 0)
+        self._push(key, (self._hits[key],))
+
+    def record_access(self, key, size, object_size=None) -> None:
+        self._hits[key] = self._hits.get(key, 0) + 1
+        self._push(key, (self._hits[key],))
+
+    def record_remove(self, key) -> None:
+        super().record_remove(key)
+        self._hits.pop(key, None)
+
+    def warm_up(self, key, size, hits, object_size=None) -> None:
+        self._hits[key] = hits
+        self._push(key, (hits,))
+
+
+class GDSFPolicy(HeapPolicy):
+    """
+    GreedyDual-Size-Frequency: priority = L + frequency * cost / size.
+
+    The size is the size of the whole object the block belongs to, so blocks of huge
+    one-off checkpoints lose against blocks of small, frequently used files. L is the
+    inflation value, raised to the priority of every evicted entry so that entries
+    which stop being accessed age out. Other removals leave L alone.
+    """
+
+    name = "GDSF"
+
+    def __init__(self, capacity: Optional[int] = None, cost: float = 1.0) -> None:
+        super().__init__(capacity)
+        self._cost = cost
+        self._inflation = 0.0
+        self._frequency: Dict[Hashable, int] = {}
+        self._priority: Dict[Hashable, float] = {}
+
+    def _update(self, key: Hashable, size: int, object_size: Optional[int]) -> None:
+        weight = max(object_size or size, 1)
+        priority = self._inflation + self._frequency[key] * self._cost / weight
+        self._priority[key] = priority
+        self._push(key, (priority,))
+
+    def record_insert(self, key, size, object_size=None) -> None:
+        self._frequency[key] = self._frequency.get(key, 0) + 1
+        self._update(key, size, object_size)
+
+    def record_access(self, key, size, object_size=None) -> None:
+        self.record_insert(key, size, object_size)
+
+    def record_remove(self, key) -> None:
+        super().record_remove(key)
+        self._frequency.pop(key, None)
+        self._priority.pop(key, None)
+
+    def record_evict(self, key) -> None:
+        priority = self._priority.get(key, None)
+        if priority is not None and priority > self._inflation:
+            self._inflation = priority
+        self.record_remove(key)
+
+    def warm_up(self, key, size, hits, object_size=None) -> None:
+        self._frequency[key] = hits + 1
+        self._update(key, size, object_size)
+
+
+class TwoQueuePolicy(EvictionPolicy):
+    """
+    Full 2Q. New blocks enter the FIFO `A1in`; blocks evicted from it are remembered in
+    the ghost queue `A1out`, and only blocks referenced again while remembered there are
+    promoted into the LRU `Am`. A single large scan therefore only flushes `A1in`.
+    """
+
+    name = "2Q"
+
+    def __init__(
+        self,
+        capacity: Optional[int] = None,
+        in_ratio: float = 0.25,
+        out_ratio: float = 0.5,
+    ) -> None:
+        super().__init__(capacity)
+        self._in_ratio = in_ratio
+        self._out_ratio = out_ratio
+        self._a1in: "OrderedDict[Hashable, int]" = OrderedDict()
+        self._a1out: "OrderedDict[Hashable, int]" = OrderedDict()
+        self._am: "OrderedDict[Hashable, int]" = OrderedDict()
+        self._a1in_bytes = 0
+        self._a1out_bytes = 0
+        self._am_bytes = 0
+
+    def _capacity(self) -> int:
+        if self.capacity is not None:
+            return self.capacity
+        return self._a1in_bytes + self._am_bytes
+
+    def record_insert(self, key, size, object_size=None) -> None:
+        if key in self._a1in or key in self._am:
+            self.record_access(key, size, object_size)
+            return
+        if key in self._a1out:
+            self._a1out_bytes -= self._a1out.pop(key)
+            self._am[key] = size
+            self._am_bytes += size
+        else:
+            self._a1in[key] = size
+            self._a1in_bytes += size
+
+    def record_access(self, key, size, object_size=None) -> None:
+        if key in self._am:
+            self._am.move_to_end(key)
+        elif key not in self._a1in:
+            self.record_insert(key, size, object_size)
+
+    def record_remove(self, key) -> None:
+        if key in self._a1in:
+            size = self._a1in.pop(key)
+            self._a1in_bytes -= size
+            self._a1out[key] = size
+            self._a1out_bytes += size
+            out_capacity = self._capacity() * self._out_ratio
+            while self._a1out and self._a1out_bytes > out_capacity:
+                _, ghost_size = self._a1out.popitem(last=False)
+                self._a1out_bytes -= ghost_size
+        elif key in self._am:
+            self._am_bytes -= self._am.pop(key)
+
+    def victim(self) -> Optional[Hashable]:
+        if self._a1in and (self._a1in_bytes > self._capacity() * self._in_ratio or not self._am):
+            return next(iter(self._a1in))
+        return next(iter(self._am), None)
+
+    def warm_up(self, key, size, hits, object_size=None) -> None:
+        # Blocks that have been hit before belong to the hot queue
+        if hits > 0:
+            self._am[key] = size
+            self._am_bytes += size
+        else:
+            self._a1in[key] = size
+            self._a1in_bytes += size
+
+    def __len__(self) -> int:
+        return len(self._a1in) + len(self._am)
+
+
+class CountMinSketch(object):
+    """
+    Count-Min sketch with 4-bit style saturation and periodic halving, as used by TinyLFU.
+    """
+
+    def __init__(self, width: int = 1 << 16, depth: int = 4, max_count: int = 15) -> None:
+        self._width = width
+        self._depth = depth
+        self._max_count = max_count
+        self._table = [bytearray(width) for _ in range(depth)]
+        self._additions = 0
+        self._sample_size = 10 * width
+
+    def _indexes(self, key: Hashable) -> List[int]:
+        digest = hashlib.blake2b(repr(key).encode("utf-8"), digest_size=8 * self._depth).digest()
+        return [
+            int.from_bytes(digest[i * 8:(i + 1) * 8], "little") % self._width
+            for i in range(self._depth)
+        ]
+
+    def increment(self, key: Hashable) -> None:
+        for row, i in zip(self._table, self._indexes(key)):
+            if row[i] < self._max_count:
+                row[i] += 1
+        self._additions += 1
+        if self._additions >= self._sample_size:
+            self._reset()
+
+    def estimate(self, key: Hashable) -> int:
+        return min(row[i] for row, i in zip(self._table, self._indexes(key)))
+
+    def _reset(self) -> None:
+        for row in self._table:
+            for i in range(self._width):
+                row[i] >>= 1
+        self._additions //= 2
+
+
+class TinyLFUPolicy(EvictionPolicy):
+    """
+    W-TinyLFU. New blocks enter a small LRU window; when the window overflows, its
+    oldest block only replaces the oldest block of the main LRU if the frequency
+    sketch says it is accessed more often. One-off pulls never leave the window.
+    """
+
+    name = "TINYLFU"
+
+    def __init__(
+        self,
+        capacity: Optional[int] = None,
+        window_ratio: float = 0.01,
+        sketch_width: int = 1 << 16,
+    ) -> None:
+        super().__init__(capacity)
+        self._window_ratio = window_ratio
+        self._sketch = CountMinSketch(width=sketch_width)
+        self._window: "OrderedDict[Hashable, int]" = OrderedDict()
+        self._main: "OrderedDict[Hashable, int]" = OrderedDict()
+        self._window_bytes = 0
+        self._main_bytes = 0
+
+    def _window_capacity(self) -> float:
+        if self.capacity is not None:
+            return self.capacity * self._window_ratio
+        return (self._window_bytes + self._main_bytes) * self._window_ratio
+
+    def record_insert(self, key, size, object_size=None) -> None:
+        self._sketch.increment(key)
+        if key in self._window or key in self._main:
+            self.record_access(key, size, object_size)
+            return
+        self._window[key] = size
+        self._window_bytes += size
+
+    def record_access(self, key, size, object_size=None) -> None:
+        if key in self._window:
+            self._sketch.increment(key)
+            self._window.move_to_end(key)
+        elif key in self._main:
+            self._sketch.increment(key)
+            self._main.move_to_end(key)
+        else:
+            self.record_insert(key, size, object_size)
+
+    def record_remove(self, key) -> None:
+        if key in self._window:
+            self._window_bytes -= self._window.pop(key)
+        elif key in self._main:
+            self._main_bytes -= self._main.pop(key)
+
+    def _main_capacity(self) -> float:
+        if self.capacity is not None:
+            return self.capacity - self._window_capacity()
+        return (self._window_bytes + self._main_bytes) - self._window_capacity()
+
+    def victim(self) -> Optional[Hashable]:
+        while self._window and self._window_bytes > self._window_capacity():
+            candidate = next(iter(self._window))
+            if self._main_bytes + self._window[candidate] <= self._main_capacity():
+                # The main space has room left, no admission is needed
+                size = self._window.pop(candidate)
+                self._window_bytes -= size
+                self._main[candidate] = size
+                self._main_bytes += size
+                continue
+            main_victim = next(iter(self._main), None)
+            if main_victim is None:
+                return candidate
+            if self._sketch.estimate(candidate) <= self._sketch.estimate(main_victim):
+                return candidate
+            # The candidate wins the admission, move it into the main space
+            size = self._window.pop(candidate)
+            self._window_bytes -= size
+            self._main[candidate] = size
+            self._main_bytes += size
+            return main_victim
+        victim = next(iter(self._main), None)
+        if victim is None:
+            victim = next(iter(self._window), None)
+        return victim
+
+    def warm_up(self, key, size, hits, object_size=None) -> None:
+        for _ in range(min(hits, 15)):
+            self._sketch.increment(key)
+        self._main[key] = size
+        self._main_bytes += size
+
+    def __len__(self) -> int:
+        return len(self._window) + len(self._main)
+
+
+def create_eviction_policy(name: str, capacity: Optional[int] = None) -> EvictionPolicy:
+    policies = {
+        "LRU": LRUPolicy,
+        "FIFO": FIFOPolicy,
+        "LARGE_FIRST": LargeFirstPolicy,
+        "LFU": LFUPolicy,
+        "2Q": TwoQueuePolicy,
+        "TINYLFU": TinyLFUPolicy,
+        "GDSF": GDSFPolicy,
+    }
+    policy_class = policies.get(name.upper(), None)
+    if policy_class is None:
+        raise Exception(
+            f"Unsupported cache clean strategy: {name}. Available strategies: {', '.join(EVICTION_POLICIES)}"
+        )
+    return policy_class(capacity=capacity)
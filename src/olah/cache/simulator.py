@@ -0,0 +1,169 @@
+# coding=utf-8
+# Copyright 2024 XiaHan
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+"""
+Offline cache simulator.
+
+Replays an access log against the eviction policies and compares their hit ratio
+and byte hit ratio. The access log is a JSON lines file, one request per line:
+
+    {"repo": "org/repo", "revision": "main", "path": "model.safetensors",
+     "file_size": 1000000, "range_start": 0, "range_end": 1000000}
+
+`repo` and `revision` are optional; `range_start` and `range_end` (exclusive)
+default to the whole file.
+"""
+
+import json
+from dataclasses import dataclass
+from typing import Dict, Hashable, Iterable, Iterator, List, Optional, Tuple
+
+import typer
+
+from olah.cache.olah_cache import DEFAULT_BLOCK_SIZE
+from olah.cache.policies import EVICTION_POLICIES, EvictionPolicy, create_eviction_policy
+from olah.utils.disk_utils import convert_bytes_to_human_readable, convert_to_bytes
+
+
+@dataclass
+class Access:
+    object_key: str
+    file_size: int
+    range_start: int
+    range_end: int
+
+
+@dataclass
+class SimulationResult:
+    policy: str
+    requests: int = 0
+    block_requests: int = 0
+    block_hits: int = 0
+    requested_bytes: int = 0
+    hit_bytes: int = 0
+    written_bytes: int = 0
+    evicted_bytes: int = 0
+
+    @property
+    def hit_ratio(self) -> float:
+        if self.block_requests == 0:
+            return 0.0
+        return self.block_hits / self.block_requests
+
+    @property
+    def byte_hit_ratio(self) -> float:
+        if self.requested_bytes == 0:
+            return 0.0
+        return self.hit_bytes / self.requested_bytes
+
+
+def read_access_log(path: str) -> Iterator[Access]:
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if len(line) == 0:
+                continue
+            try:
+                obj = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if "path" not in obj or "file_size" not in obj:
+                continue
+            file_size = int(obj["file_size"])
+            parts = [obj.get("repo", None), obj.get("revision", None), obj["path"]]
+            yield Access(
+                object_key="/".join(p for p in parts if p),
+                file_size=file_size,
+                range_start=int(obj.get("range_start", 0)),
+                range_end=int(obj.get("range_end", file_size)),
+            )
+
+
+def iter_blocks(access: Access, block_size: int) -> Iterator[Tuple[int, int, int]]:
+    """
+    Yields (block index, block size, requested bytes in the block) for an access.
+    """
+    if access.range_end <= access.range_start:
+        return
+    start_block = access.range_start // block_size
+    end_block = (access.range_end - 1) // block_size
+    for block_index in range(start_block, end_block + 1):
+        block_start = block_index * block_size
+        block_end = min(block_start + block_size, access.file_size)
+        requested = min(block_end, access.range_end) - max(block_start, access.range_start)
+        yield block_index, block_end - block_start, requested
+
+
+def simulate(
+    accesses: Iterable[Access],
+    policy: EvictionPolicy,
+    capacity: int,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+) -> SimulationResult:
+    result = SimulationResult(policy=policy.name)
+    cached: Dict[Hashable, int] = {}
+    used = 0
+    for access in accesses:
+        result.requests += 1
+        for block_index, size, requested in iter_blocks(access, block_size):
+            key = (access.object_key, block_index)
+            result.block_requests += 1
+            result.requested_bytes += requested
+            if key in cached:
+                result.block_hits += 1
+                result.hit_bytes += requested
+                policy.record_access(key, size, access.file_size)
+                continue
+
+            if size > capacity:
+                continue
+            cached[key] = size
+            used += size
+            result.written_bytes += size
+            policy.record_insert(key, size, access.file_size)
+            while used > capacity:
+                victim = policy.victim()
+                if victim is None:
+                    break
+                policy.record_evict(victim)
+                victim_size = cached.pop(victim, 0)
+                used -= victim_size
+                result.evicted_bytes += victim_size
+    return result
+
+
+def main(
+    log: str = typer.Option(..., "--log", "-l", help="The JSON lines access log to replay"),
+    capacity: str = typer.Option(..., "--capacity", "-c", help="The simulated cache size, e.g. 500GB"),
+    policies: str = typer.Option(
+        ",".join(EVICTION_POLICIES), "--policies", "-p", help="Comma separated eviction policies"
+    ),
+    block_size: int = typer.Option(DEFAULT_BLOCK_SIZE, "--block-size", help="The cache block size in bytes"),
+):
+    capacity_bytes: Optional[int] = convert_to_bytes(capacity)
+    if capacity_bytes is None:
+        print(f"Invalid capacity: {capacity}")
+        raise typer.Exit(1)
+
+    accesses: List[Access] = list(read_access_log(log))
+    print(f"Requests: {len(accesses)}. Capacity: {convert_bytes_to_human_readable(capacity_bytes)}.")
+    print(f"{'Policy':<12}{'Hit Ratio':>12}{'Byte Hit Ratio':>16}{'Written':>14}{'Evicted':>14}")
+    for name in policies.split(","):
+        name = name.strip()
+        if len(name) == 0:
+            continue
+        policy = create_eviction_policy(name, capacity=capacity_bytes)
+        result = simulate(accesses, policy, capacity_bytes, block_size=block_size)
+        print(
+            f"{result.policy:<12}{result.hit_ratio:>12.4f}{result.byte_hit_ratio:>16.4f}"
+            f"{convert_bytes_to_human_readable(result.written_bytes):>14}"
+            f"{convert_bytes_to_human_readable(result.evicted_bytes):>14}"
+        )
+
+
+if __name__ == "__main__":
+    typer.run(main)
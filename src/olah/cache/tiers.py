@@ -0,0 +1,145 @@
+# coding=utf-8
+# Copyright 2024 XiaHan
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+from olah.utils.s3_client import S3Client
+
+CACHE_TIERS = ["memory", "disk", "peer", "s3", "upstream"]
+
+# How long the existence of an S3 object is remembered
+S3_PRESENCE_TTL = 10 * 60
+S3_ABSENCE_TTL = 60
+
+
+@dataclass
+class TierStats:
+    hits: int = 0
+    bytes: int = 0
+
+
+class MemoryBlockCache(object):
+    """
+    Bounded LRU of decoded cache blocks, in front of the disk blocks.
+
+    Blocks of the same file at the same revision never change, so entries are only
+    dropped to honor `capacity` (in bytes).
+    """
+
+    def __init__(self, capacity: int) -> None:
+        self.capacity = capacity
+        self._blocks: "OrderedDict[Tuple[str, int], bytes]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @property
+    def size(self) -> int:
+        with self._lock:
+            return self._size
+
+    def get(self, cache_path: str, block_index: int) -> Optional[bytes]:
+        key = (cache_path, block_index)
+        with self._lock:
+            block = self._blocks.get(key, None)
+            if block is not None:
+                self._blocks.move_to_end(key)
+            return block
+
+    def put(self, cache_path: str, block_index: int, block: bytes) -> None:
+        if len(block) > self.capacity:
+            return
+        key = (cache_path, block_index)
+        with self._lock:
+            old_block = self._blocks.pop(key, None)
+            if old_block is not None:
+                self._size -= len(old_block)
+            self._blocks[key] = block
+            self._size += len(block)
+            while self._size > self.capacity:
+                _, evicted_block = self._blocks.popitem(last=False)
+                self._size -= len(evicted_block)
+
+    def discard(self, cache_path: str, block_index: int) -> None:
+        with self._lock:
+            block = self._blocks.pop((cache_path, block_index), None)
+            if block is not None:
+                self._size -= len(block)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._blocks)
+
+
+class TieredCache(object):
+    """
+    Read-through storage tiers of the file cache: memory, local disk blocks, cluster
+    peers, S3, and finally the upstream site.
+
+    Blocks read from disk are promoted into memory, and blocks fetched from S3 or
+    upstream are promoted to disk by the regular block write path (subject to the
+    cache rules and admission). Cold blocks are demoted by the disk eviction: once a
+    file is in S3, evicting it locally leaves it served from the bucket.
+    """
+
+    def __init__(
+        self,
+        memory: Optional[MemoryBlockCache] = None,
+        s3_client: Optional[S3Client] = None,
+        s3_read_through: bool = True,
+    ) -> None:
+        self.memory = memory
+        self.s3_client = s3_client
+        self.s3_read_through = s3_read_through
+        self._stats: Dict[str, TierStats] = {tier: TierStats() for tier in CACHE_TIERS}
+        self._s3_presence: Dict[str, Tuple[Optional[int], float]] = {}
+        self._lock = threading.Lock()
+
+    def record_hit(self, tier: str, nbytes: int) -> None:
+        with self._lock:
+            stats = self._stats[tier]
+            stats.hits += 1
+            stats.bytes += nbytes
+
+    def stats(self) -> Dict[str, TierStats]:
+        with self._lock:
+            return {
+                tier: TierStats(hits=stats.hits, bytes=stats.bytes)
+                for tier, stats in self._stats.items()
+            }
+
+    def forget_s3_object(self, key: str) -> None:
+        self._s3_presence.pop(key, None)
+
+    def remember_s3_object(self, key: str, size: int) -> None:
+        self._s3_presence[key] = (size, time.time() + S3_PRESENCE_TTL)
+
+    async def s3_has_object(self, key: str, file_size: int) -> bool:
+        """
+        Checks whether the complete object is in the bucket. Results are cached for a
+        while, so that cache misses do not pay a HEAD request each.
+        """
+        if self.s3_client is None:
+            return False
+        now = time.time()
+        cached = self._s3_presence.get(key, None)
+        if cached is not None and cached[1] > now:
+            return cached[0] == file_size
+
+        try:
+            object_headers = await self.s3_client.head_object(key)
+        except Exception:
+            return False
+        if object_headers is None or "content-length" not in object_headers:
+            self._s3_presence[key] = (None, now + S3_ABSENCE_TTL)
+            return False
+        object_size = int(object_headers["content-length"])
+        self._s3_presence[key] = (object_size, now + S3_PRESENCE_TTL)
+        return object_size == file_size
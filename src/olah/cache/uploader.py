@@ -0,0 +1,254 @@
+# coding=utf-8
+# Copyright 2024 XiaHan
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+import asyncio
+import logging
+import os
+import time
+from typing import Callable, Dict, List, Optional, Set
+
+from olah.constants import S3_UPLOAD_CONCURRENCY, S3_UPLOAD_IDLE_TTL, S3_UPLOAD_RETRIES
+from olah.utils.executors import FS_EXECUTOR, run_in_executor
+from olah.utils.s3_client import S3Client
+
+from .olah_cache import OlahCache
+
+logger = logging.getLogger(__name__)
+
+
+def _has_blocks(cache_file: OlahCache, block_indices: List[int]) -> bool:
+    return all(cache_file.has_block(i) for i in block_indices)
+
+
+class MultipartUploadSession(object):
+    def __init__(self, key: str, block_size: int, file_size: int) -> None:
+        self.key = key
+        self.block_size = block_size
+        self.file_size = file_size
+        self.block_number = (file_size + block_size - 1) // block_size
+        self.upload_id: Optional[str] = None
+        self.parts: Dict[int, str] = {}
+        self.pending: Set[int] = set()
+        self.failed = False
+        self.lock = asyncio.Lock()
+        self.last_active = time.monotonic()
+
+    @property
+    def complete(self) -> bool:
+        return len(self.parts) == self.block_number
+
+
+class S3BlockUploader(object):
+    """
+    Uploads cached files to S3 block by block while they are downloaded.
+
+    Every cache block is one part of a multipart upload, submitted as soon as the
+    block is persisted. Parts are uploaded concurrently through a pool bounded by
+    `concurrency`, each retried with a backoff, and the upload is completed when all
+    parts are present. At most `2 * concurrency` parts are held in memory; further
+    submissions wait for a free slot. Blocks which were already on disk are picked
+    up by `fill_missing_blocks`.
+
+    Files which are never cached in full, e.g. read by ranges or evicted, would keep
+    their multipart upload open in the bucket. Uploads without a new part for
+    `idle_ttl` seconds are aborted; the blocks cached later start a new one.
+
+    S3 allows at most 10000 parts, so files above 10000 blocks are not uploaded.
+    """
+
+    MAX_PARTS = 10000
+
+    def __init__(
+        self,
+        s3_client: S3Client,
+        concurrency: int = S3_UPLOAD_CONCURRENCY,
+        retries: int = S3_UPLOAD_RETRIES,
+        on_complete: Optional[Callable[[str, int], None]] = None,
+        idle_ttl: float = S3_UPLOAD_IDLE_TTL,
+    ) -> None:
+        self._s3_client = s3_client
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._slots = asyncio.Semaphore(concurrency * 2)
+        self._retries = retries
+        self._on_complete = on_complete
+        self._idle_ttl = idle_ttl
+        self._sessions: Dict[str, MultipartUploadSession] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self._expire_task: Optional[asyncio.Task] = None
+
+    def _get_session(self, key: str, block_size: int, file_size: int) -> Optional[MultipartUploadSession]:
+        session = self._sessions.get(key, None)
+        if session is None:
+            session = MultipartUploadSession(key, block_size, file_size)
+            if session.block_number == 0 or session.block_number > self.MAX_PARTS:
+                return None
+            self._sessions[key] = session
+            if self._expire_task is None:
+                self._expire_task = asyncio.create_task(self._expire_loop())
+        if session.failed or session.file_size != file_size:
+            return None
+        session.last_active = time.monotonic()
+        return session
+
+    async def expire_idle_sessions(self) -> int:
+        """
+        Aborts the uploads which got no part for `idle_ttl` seconds.
+
+        Returns:
+            int: The number of aborted uploads.
+        """
+        deadline = time.monotonic() - self._idle_ttl
+        idle_sessions = [
+            session
+            for session in self._sessions.values()
+            if len(session.pending) == 0 and session.last_active <= deadline
+        ]
+        for session in idle_sessions:
+            logger.info("Aborting the idle upload of %s to S3", session.key)
+            await self._abort(session)
+        return len(idle_sessions)
+
+    async def _expire_loop(self) -> None:
+        while True:
+            await asyncio.sleep(max(self._idle_ttl / 2, 0.01))
+            try:
+                await self.expire_idle_sessions()
+            except Exception as e:
+                logger.warning("Failed to abort the idle uploads to S3: %s", e)
+
+    def _release_slot(self, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        self._slots.release()
+
+    async def submit_block(self, key: str, cache_file: OlahCache, block_index: int, block: bytes) -> None:
+        """
+        Schedules the upload of a persisted block. Only waits if too many parts are
+        already queued.
+        """
+        session = self._get_session(key, cache_file._get_block_size(), cache_file._get_file_size())
+        if session is None:
+            return
+        if block_index in session.parts or block_index in session.pending:
+            return
+        part_size = min(session.block_size, session.file_size - block_index * session.block_size)
+        session.pending.add(block_index)
+        await self._slots.acquire()
+        task = asyncio.create_task(self._upload_part(session, block_index, bytes(block[:part_size])))
+        self._tasks.add(task)
+        task.add_done_callback(self._release_slot)
+
+    async def fill_missing_blocks(self, key: str, cache_path: str) -> None:
+        """
+        Submits the cached blocks of `cache_path` which were never submitted, so that
+        files cached earlier, or partially in this process, get uploaded as well.
+        """
+        if not await run_in_executor(FS_EXECUTOR, os.path.exists, cache_path):
+            return
+        cache_file = await run_in_executor(FS_EXECUTOR, OlahCache, cache_path)
+        try:
+            session = self._get_session(key, cache_file._get_block_size(), cache_file._get_file_size())
+            if session is None:
+                return
+            missing_blocks = [i for i in range(session.block_number) if i not in session.parts]
+            if not await run_in_executor(FS_EXECUTOR, _has_blocks, cache_file, missing_blocks):
+                # Wait for the missing blocks to be downloaded
+                return
+            for block_index in range(session.block_number):
+                if session.failed:
+                    return
+                if block_index in session.parts or block_index in session.pending:
+                    continue
+                block = await cache_file.read_block(block_index)
+                if block is None:
+                    return
+                await self.submit_block(key, cache_file, block_index, block)
+        finally:
+            await run_in_executor(FS_EXECUTOR, cache_file.close)
+
+    def schedule_fill_missing_blocks(self, key: str, cache_path: str) -> None:
+        task = asyncio.create_task(self.fill_missing_blocks(key, cache_path))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _ensure_upload_id(self, session: MultipartUploadSession) -> str:
+        async with session.lock:
+            if session.upload_id is None:
+                session.upload_id = await self._s3_client.create_multipart_upload(session.key)
+            return session.upload_id
+
+    async def _upload_part(self, session: MultipartUploadSession, block_index: int, data: bytes) -> None:
+        try:
+            async with self._semaphore:
+                for attempt in range(self._retries + 1):
+                    try:
+                        upload_id = await self._ensure_upload_id(session)
+                        etag = await self._s3_client.upload_part(
+                            session.key, upload_id, block_index + 1, data
+                        )
+                        break
+                    except Exception as e:
+                        if attempt == self._retries:
+                            raise
+                        logger.warning(
+                            "Failed to upload part %d of %s, retrying: %s", block_index + 1, session.key, e
+                        )
+                        await asyncio.sleep(2 ** attempt)
+            session.parts[block_index] = etag
+            session.last_active = time.monotonic()
+        except Exception as e:
+            logger.warning("Failed to upload %s to S3: %s", session.key, e)
+            await self._abort(session)
+            return
+        finally:
+            session.pending.discard(block_index)
+
+        if session.complete:
+            await self._complete(session)
+
+    async def _complete(self, session: MultipartUploadSession) -> None:
+        async with session.lock:
+            if self._sessions.get(session.key, None) is not session:
+                # Already completed by another part
+                return
+            try:
+                await self._s3_client.complete_multipart_upload(
+                    session.key, session.upload_id, [(i + 1, etag) for i, etag in session.parts.items()]
+                )
+                completed = True
+            except Exception as e:
+                logger.warning("Failed to complete the upload of %s to S3: %s", session.key, e)
+                completed = False
+            self._sessions.pop(session.key, None)
+        if not completed:
+            await self._abort(session)
+        elif self._on_complete is not None:
+            self._on_complete(session.key, session.file_size)
+
+    async def _abort(self, session: MultipartUploadSession) -> None:
+        if session.failed:
+            return
+        session.failed = True
+        if self._sessions.get(session.key, None) is session:
+            self._sessions.pop(session.key, None)
+        if session.upload_id is not None:
+            try:
+                await self._s3_client.abort_multipart_upload(session.key, session.upload_id)
+            except Exception as e:
+                logger.warning("Failed to abort the upload of %s to S3: %s", session.key, e)
+
+    async def close(self) -> None:
+        """
+        Waits for the running part uploads and aborts the uploads left incomplete.
+        """
+        if self._expire_task is not None:
+            self._expire_task.cancel()
+            await asyncio.gather(self._expire_task, return_exceptions=True)
+            self._expire_task = None
+        while len(self._tasks) != 0:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+        for session in list(self._sessions.values()):
+            await self._abort(session)
@@ -0,0 +1,288 @@
+# coding=utf-8
+# Copyright 2024 XiaHan
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+import asyncio
+import fnmatch
+import hashlib
+import hmac
+import logging
+import socket
+import time
+from typing import Dict, Iterable, List, Optional, Set
+from urllib.parse import urlparse
+
+import httpx
+
+from olah.utils.executors import FS_EXECUTOR, run_in_executor
+
+from .ring import ConsistentHashRing
+
+logger = logging.getLogger(__name__)
+
+CLUSTER_SECRET_HEADER = "x-olah-cluster-secret"
+CLUSTER_FILE_SIZE_HEADER = "x-olah-file-size"
+CLUSTER_BLOCK_DIGEST_HEADER = "x-olah-block-digest"
+
+# How long the resolved addresses of the static peers are trusted
+PEER_ADDRESS_TTL = 5 * 60
+# The owner of a missing block fetches it upstream before answering
+BLOCK_READ_TIMEOUT = 120
+
+
+def normalize_node_url(url: str) -> str:
+    return url.rstrip("/")
+
+
+class ClusterMembership(object):
+    """
+    The set of olah nodes sharing their caches, and the owner of every cache block.
+
+    Blocks are assigned to nodes with a consistent hash ring over the cache key of the
+    file (repo, revision and path) and the block index. Membership starts from the
+    static `peers`; with a positive `gossip_interval`, nodes also exchange their member
+    lists, so a node only needs one live seed to join. A peer that fails a request is
+    taken out of the ring for `suspect_time` seconds.
+
+    The internal endpoints are protected by the shared `secret`, which also signs the
+    served blocks. Gossip only adds the nodes matching the static peers or the
+    `allowed_peers` patterns. Without a secret, gossip must be off, and only the
+    addresses of the static peers are served.
+    """
+
+    def __init__(
+        self,
+        node_url: str,
+        peers: Iterable[str] = (),
+        virtual_nodes: int = 64,
+        secret: Optional[str] = None,
+        allowed_peers: Iterable[str] = (),
+        gossip_interval: float = 30,
+        peer_timeout: float = 5,
+        suspect_time: float = 30,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ) -> None:
+        if secret is None and gossip_interval > 0:
+            raise Exception(
+                "The cluster needs a secret, unless gossip is off (gossip-interval = 0) "
+                "and the nodes are only the static peers."
+            )
+        self.node_url = normalize_node_url(node_url)
+        self._static_peers = {normalize_node_url(peer) for peer in peers}
+        self._allowed_peers = list(allowed_peers)
+        self._peer_addresses: Set[str] = set()
+        self._peer_addresses_expire = 0.0
+        self._virtual_nodes = virtual_nodes
+        self._secret = secret
+        self._gossip_interval = gossip_interval
+        self._peer_timeout = peer_timeout
+        self._suspect_time = suspect_time
+        self._transport = transport
+
+        self._members: Set[str] = {self.node_url}
+        self._down_until: Dict[str, float] = {}
+        self._ring: Optional[ConsistentHashRing] = None
+        self._client: Optional[httpx.AsyncClient] = None
+        self._task: Optional[asyncio.Task] = None
+        self.merge(peers)
+
+    @property
+    def members(self) -> List[str]:
+        return sorted(self._members)
+
+    def alive_members(self) -> List[str]:
+        now = time.time()
+        return sorted(m for m in self._members if self._down_until.get(m, 0) <= now)
+
+    def is_allowed(self, peer: str) -> bool:
+        return (
+            peer == self.node_url
+            or peer in self._static_peers
+            or any(fnmatch.fnmatchcase(peer, pattern) for pattern in self._allowed_peers)
+        )
+
+    def merge(self, peers: Iterable[str]) -> None:
+        for peer in peers:
+            peer = normalize_node_url(peer)
+            if len(peer) == 0 or peer in self._members:
+                continue
+            if not self.is_allowed(peer):
+                logger.warning("Ignoring the cluster member %s, not an allowed peer", peer)
+                continue
+            self._members.add(peer)
+            self._ring = None
+
+    def mark_down(self, peer: str) -> None:
+        self._down_until[peer] = time.time() + self._suspect_time
+        self._ring = None
+
+    def mark_up(self, peer: str) -> None:
+        if self._down_until.pop(peer, None) is not None:
+            self._ring = None
+
+    def _get_ring(self) -> ConsistentHashRing:
+        now = time.time()
+        if self._ring is not None and all(t > now for t in self._down_until.values()):
+            return self._ring
+        # Forget the expired suspicions and rebuild
+        self._down_until = {m: t for m, t in self._down_until.items() if t > now}
+        self._ring = ConsistentHashRing(self.alive_members(), virtual_nodes=self._virtual_nodes)
+        return self._ring
+
+    def owner(self, cache_key: str, block_index: int) -> Optional[str]:
+        """
+        Returns the peer owning a block, or None if this node owns it.
+        """
+        owner = self._get_ring().owner(f"{cache_key}#{block_index}")
+        if owner is None or owner == self.node_url:
+            return None
+        return owner
+
+    async def _get_peer_addresses(self) -> Set[str]:
+        if time.time() < self._peer_addresses_expire:
+            return self._peer_addresses
+        loop = asyncio.get_running_loop()
+        addresses: Set[str] = set()
+        for peer in self._static_peers:
+            host = urlparse(peer).hostname
+            if host is None:
+                continue
+            try:
+                infos = await loop.getaddrinfo(host, None, type=socket.SOCK_STREAM)
+            except OSError as e:
+                logger.warning("Failed to resolve the cluster peer %s: %s", peer, e)
+                continue
+            addresses.update(info[4][0] for info in infos)
+        self._peer_addresses = addresses
+        self._peer_addresses_expire = time.time() + PEER_ADDRESS_TTL
+        return addresses
+
+    async def check_caller(self, secret: Optional[str], client_host: Optional[str]) -> bool:
+        """
+        Checks a request to the internal endpoints: it carries the secret, or comes from
+        a static peer when the cluster has no secret.
+        """
+        if self._secret is not None:
+            return secret is not None and hmac.compare_digest(secret, self._secret)
+        return client_host is not None and client_host in await self._get_peer_addresses()
+
+    def block_digest(self, cache_key: str, block_index: int, file_size: int, block: bytes) -> Optional[str]:
+        """
+        Signs a served block with the secret, so that the requester only accepts the
+        bytes of a node of the cluster, for the block it asked for.
+        """
+        if self._secret is None:
+            return None
+        digest = hmac.new(self._secret.encode("utf-8"), digestmod=hashlib.sha256)
+        digest.update(f"{cache_key}\n{block_index}\n{file_size}\n".encode("utf-8"))
+        digest.update(block)
+        return digest.hexdigest()
+
+    def _headers(self) -> Dict[str, str]:
+        if self._secret is None:
+            return {}
+        return {CLUSTER_SECRET_HEADER: self._secret}
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(timeout=self._peer_timeout, transport=self._transport)
+        return self._client
+
+    async def fetch_block(
+        self,
+        peer: str,
+        cache_key: str,
+        block_index: int,
+        file_size: int,
+        block_length: int,
+        read_through: bool = False,
+        authorization: Optional[str] = None,
+    ) -> Optional[bytes]:
+        """
+        Fetches a block from the cache of a peer. With `read_through`, a peer which does
+        not have the block fetches it upstream with `authorization` and caches it first.
+        Returns None if the peer does not have it, or cannot be reached.
+        """
+        params = {"key": cache_key, "block": str(block_index)}
+        headers = self._headers()
+        if read_through:
+            params["size"] = str(file_size)
+            if authorization is not None:
+                headers["authorization"] = authorization
+        try:
+            response = await self._get_client().get(
+                f"{peer}/internal/cluster/block",
+                params=params,
+                headers=headers,
+                timeout=httpx.Timeout(self._peer_timeout, read=BLOCK_READ_TIMEOUT),
+            )
+        except httpx.HTTPError as e:
+            logger.warning("Failed to reach the cluster peer %s: %s", peer, e)
+            self.mark_down(peer)
+            return None
+        if response.status_code != 200:
+            return None
+        if response.headers.get(CLUSTER_FILE_SIZE_HEADER, None) != str(file_size):
+            # The peer cached a different file under the same key
+            return None
+        if len(response.content) != block_length:
+            return None
+        if self._secret is not None:
+            expected_digest = await run_in_executor(
+                FS_EXECUTOR, self.block_digest, cache_key, block_index, file_size, response.content
+            )
+            if not hmac.compare_digest(
+                response.headers.get(CLUSTER_BLOCK_DIGEST_HEADER, ""), expected_digest
+            ):
+                logger.warning(
+                    "The cluster peer %s served a block of %s with a wrong digest", peer, cache_key
+                )
+                self.mark_down(peer)
+                return None
+        return response.content
+
+    async def gossip_once(self) -> None:
+        for peer in self.members:
+            if peer == self.node_url:
+                continue
+            try:
+                response = await self._get_client().post(
+                    f"{peer}/internal/cluster/members",
+                    json={"node": self.node_url, "members": self.members},
+                    headers=self._headers(),
+                )
+                response.raise_for_status()
+            except httpx.HTTPError:
+                self.mark_down(peer)
+                continue
+            self.mark_up(peer)
+            self.merge(response.json().get("members", []))
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.gossip_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Cluster gossip failed: %s", e)
+            await asyncio.sleep(self._gossip_interval)
+
+    def start(self) -> None:
+        if self._gossip_interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
@@ -0,0 +1,56 @@
+# coding=utf-8
+# Copyright 2024 XiaHan
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+import bisect
+import hashlib
+from typing import Iterable, List, Optional, Tuple
+
+
+def ring_hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class ConsistentHashRing(object):
+    """
+    Consistent hash ring with `virtual_nodes` points per node, so that adding or
+    removing a node only moves about 1/N of the keys.
+    """
+
+    def __init__(self, nodes: Iterable[str] = (), virtual_nodes: int = 64) -> None:
+        self._virtual_nodes = virtual_nodes
+        self._points: List[Tuple[int, str]] = []
+        self._nodes = set()
+        for node in nodes:
+            self.add(node)
+
+    @property
+    def nodes(self) -> List[str]:
+        return sorted(self._nodes)
+
+    def add(self, node: str) -> None:
+        if node in self._nodes:
+            return
+        self._nodes.add(node)
+        for i in range(self._virtual_nodes):
+            bisect.insort(self._points, (ring_hash(f"{node}#{i}"), node))
+
+    def remove(self, node: str) -> None:
+        if node not in self._nodes:
+            return
+        self._nodes.discard(node)
+        self._points = [point for point in self._points if point[1] != node]
+
+    def owner(self, key: str) -> Optional[str]:
+        if len(self._points) == 0:
+            return None
+        i = bisect.bisect(self._points, (ring_hash(key), ""))
+        if i == len(self._points):
+            i = 0
+        return self._points[i][1]
+
+    def __len__(self) -> int:
+        return len(self._nodes)
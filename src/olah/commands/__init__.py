@@ -17,20 +17,31 @@ Olah CLI 命令模块
 """
 
 from olah.commands.app import app, main
-from olah.commands.factory import (
-    AppFactory,
-    ModelBinFactory,
-    MirrorFactory,
-    ProxyFactory,
-    S3Factory,
-    ServeFactory,
-)
 from olah.commands.proxy import proxy
 from olah.commands.mirror import mirror
 from olah.commands.model_bin import model_bin
 from olah.commands.s3 import s3
 from olah.commands.serve import serve
 
+# 工厂类按需导入，避免 CLI 启动时加载 uvicorn 和配置模块
+_FACTORIES = (
+    "AppFactory",
+    "ModelBinFactory",
+    "MirrorFactory",
+    "ProxyFactory",
+    "S3Factory",
+    "ServeFactory",
+)
+
+
+def __getattr__(name: str):
+    if name in _FACTORIES:
+        from olah.commands import factory
+
+        return getattr(factory, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 __all__ = [
     "app",
     "main",
@@ -43,5 +43,9 @@ def main():
     app()
 
 
+# The `olah-cli` entry point
+cli = main
+
+
 if __name__ == "__main__":
     app()
@@ -30,7 +30,12 @@ def create_app_with_config(config_obj: OlahConfig):
     from olah.server import app as fastapi_app, AppSettings
     from olah.utils.s3_client import S3Client
 
-    logger = build_logger("olah", "olah.log")
+    logger = build_logger(
+        "olah",
+        "olah.log",
+        queue_size=config_obj.logging.queue_size,
+        drop_policy=config_obj.logging.drop_policy,
+    )
 
     # 如果 host 是逗号分隔的字符串，则拆分为列表
     if isinstance(config_obj.basic.host, str) and "," in config_obj.basic.host:
@@ -14,8 +14,7 @@ Olah 应用工厂模块。
 from abc import ABC, abstractmethod
 from typing import Optional, List
 
-import uvicorn
-
+from olah.commands.runtime import get_uvicorn_options
 from olah.configs import OlahConfig
 
 
@@ -51,23 +50,9 @@ class AppFactory(ABC):
     
     def _create_s3_client(self, config: OlahConfig):
         """创建 S3 客户端（如果启用）。"""
-        from olah.utils.s3_client import S3Client
-        
-        if (
-            config.s3.enable
-            and config.s3.endpoint
-            and config.s3.access_key
-            and config.s3.secret_key
-            and config.s3.bucket
-        ):
-            return S3Client(
-                endpoint=config.s3.endpoint,
-                region=config.s3.region,
-                access_key=config.s3.access_key,
-                secret_key=config.s3.secret_key,
-                bucket=config.s3.bucket,
-            )
-        return None
+        from olah.utils.s3_client import create_s3_client
+
+        return create_s3_client(config)
     
     def run(self):
         """创建应用并启动服务器。"""
@@ -76,14 +61,23 @@ class AppFactory(ABC):
     
     def _run_server(self, config: OlahConfig):
         """使用 uvicorn 启动服务器。"""
+        import uvicorn
+
+        if config.basic.workers > 1:
+            # 工作进程会重新导入应用，通过环境变量传递配置
+            from olah.utils.worker_utils import export_worker_config
+
+            export_worker_config(config)
         uvicorn.run(
             "olah.server:app",
             host=config.basic.host,
             port=config.basic.port,
+            workers=config.basic.workers,
             log_level="info",
             reload=False,
             ssl_keyfile=config.basic.ssl_key,
             ssl_certfile=config.basic.ssl_cert,
+            **get_uvicorn_options(config),
         )
 
 
@@ -100,12 +94,16 @@ class ModelBinFactory(AppFactory):
         model_bin_path: str,
         host: str = "0.0.0.0",
         port: int = 8090,
+        workers: int = 1,
+        profile: str = "default",
         ssl_key: Optional[str] = None,
         ssl_cert: Optional[str] = None,
     ):
         self.model_bin_path = model_bin_path
         self.host = host
         self.port = port
+        self.workers = workers
+        self.profile = profile
         self.ssl_key = ssl_key
         self.ssl_cert = ssl_cert
     
@@ -115,6 +113,8 @@ class ModelBinFactory(AppFactory):
         # 基础网络设置
         config.basic.host = self.host
         config.basic.port = self.port
+        config.basic.workers = self.workers
+        config.server.profile = self.profile
         config.basic.ssl_key = self.ssl_key
         config.basic.ssl_cert = self.ssl_cert
         
@@ -145,6 +145,8 @@ class ProxyFactory(AppFactory):
         self,
         host: str = "0.0.0.0",
         port: int = 8090,
+        workers: int = 1,
+        profile: str = "default",
         repos_path: str = "./repos",
         hf_scheme: str = "https",
         hf_netloc: str = "huggingface.co",
@@ -157,6 +159,8 @@ class ProxyFactory(AppFactory):
     ):
         self.host = host
         self.port = port
+        self.workers = workers
+        self.profile = profile
         self.repos_path = repos_path
         self.hf_scheme = hf_scheme
         self.hf_netloc = hf_netloc
@@ -173,6 +177,8 @@ class ProxyFactory(AppFactory):
         # 基础网络设置
         config.basic.host = self.host
         config.basic.port = self.port
+        config.basic.workers = self.workers
+        config.server.profile = self.profile
         config.basic.repos_path = self.repos_path
         config.basic.ssl_key = self.ssl_key
         config.basic.ssl_cert = self.ssl_cert
@@ -210,6 +216,8 @@ class MirrorFactory(AppFactory):
         mirrors_path: List[str],
         host: str = "0.0.0.0",
         port: int = 8090,
+        workers: int = 1,
+        profile: str = "default",
         repos_path: str = "./repos",
         hf_scheme: str = "https",
         hf_netloc: str = "huggingface.co",
@@ -222,6 +230,8 @@ class MirrorFactory(AppFactory):
         self.mirrors_path = mirrors_path
         self.host = host
         self.port = port
+        self.workers = workers
+        self.profile = profile
         self.repos_path = repos_path
         self.hf_scheme = hf_scheme
         self.hf_netloc = hf_netloc
@@ -237,6 +247,8 @@ class MirrorFactory(AppFactory):
         # 基础网络设置
         config.basic.host = self.host
         config.basic.port = self.port
+        config.basic.workers = self.workers
+        config.server.profile = self.profile
         config.basic.repos_path = self.repos_path
         config.basic.mirrors_path = list(self.mirrors_path)
         config.basic.ssl_key = self.ssl_key
@@ -273,6 +285,8 @@ class S3Factory(AppFactory):
         region: str = "us-east-1",
         host: str = "0.0.0.0",
         port: int = 8090,
+        workers: int = 1,
+        profile: str = "default",
         repos_path: str = "./repos",
         hf_scheme: str = "https",
         hf_netloc: str = "huggingface.co",
@@ -287,6 +301,8 @@ class S3Factory(AppFactory):
         self.region = region
         self.host = host
         self.port = port
+        self.workers = workers
+        self.profile = profile
         self.repos_path = repos_path
         self.hf_scheme = hf_scheme
         self.hf_netloc = hf_netloc
@@ -300,6 +316,8 @@ class S3Factory(AppFactory):
         # 基础网络设置
         config.basic.host = self.host
         config.basic.port = self.port
+        config.basic.workers = self.workers
+        config.server.profile = self.profile
         config.basic.repos_path = self.repos_path
         config.basic.ssl_key = self.ssl_key
         config.basic.ssl_cert = self.ssl_cert
@@ -336,18 +354,26 @@ class ServeFactory(AppFactory):
         config_path: str,
         host: Optional[str] = None,
         port: Optional[int] = None,
+        workers: Optional[int] = None,
+        profile: Optional[str] = None,
     ):
         self.config_path = config_path
         self.host = host
         self.port = port
+        self.workers = workers
+        self.profile = profile
     
     def create_config(self) -> OlahConfig:
         config = OlahConfig.from_toml(self.config_path)
         
-        # 覆盖 host 和 port（如果指定）
+        # 覆盖 host、port、workers 和 profile（如果指定）
         if self.host is not None:
             config.basic.host = self.host
         if self.port is not None:
             config.basic.port = self.port
+        if self.workers is not None:
+            config.basic.workers = self.workers
+        if self.profile is not None:
+            config.server.profile = self.profile
         
         return config
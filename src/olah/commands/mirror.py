@@ -15,12 +15,12 @@ from typing import List, Optional
 
 import typer
 
-from olah.commands.factory import MirrorFactory
-
 
 def mirror(
     host: str = typer.Option("0.0.0.0", help="服务器绑定地址"),
     port: int = typer.Option(8090, help="服务器绑定端口"),
+    workers: int = typer.Option(1, help="工作进程数"),
+    profile: str = typer.Option("default", help="运行时配置: default, performance"),
     mirrors_path: List[str] = typer.Option(
         ..., "--mirrors-path", "-m", help="本地 Git 镜像目录列表"
     ),
@@ -51,10 +51,14 @@ def mirror(
     从本地 Git 镜像仓库提供文件服务。
     可选择本地找不到时是否回退到代理模式。
     """
+    from olah.commands.factory import MirrorFactory
+
     factory = MirrorFactory(
         mirrors_path=list(mirrors_path),
         host=host,
         port=port,
+        workers=workers,
+        profile=profile,
         repos_path=repos_path,
         hf_scheme=hf_scheme,
         hf_netloc=hf_netloc,
@@ -15,8 +15,6 @@ from typing import Optional
 
 import typer
 
-from olah.commands.factory import ModelBinFactory
-
 
 def model_bin(
     model_bin_path: str = typer.Option(
@@ -24,6 +22,8 @@ def model_bin(
     ),
     host: str = typer.Option("0.0.0.0", help="服务器绑定地址"),
     port: int = typer.Option(8090, help="服务器绑定端口"),
+    workers: int = typer.Option(1, help="工作进程数"),
+    profile: str = typer.Option("default", help="运行时配置: default, performance"),
     ssl_key: Optional[str] = typer.Option(None, help="SSL 密钥文件路径"),
     ssl_cert: Optional[str] = typer.Option(None, help="SSL 证书文件路径"),
 ):
@@ -33,10 +33,14 @@ def model_bin(
     从本地目录结构提供模型文件服务。
     目录结构: <model_bin_path>/<org>/<repo>/<file_path>
     """
+    from olah.commands.factory import ModelBinFactory
+
     factory = ModelBinFactory(
         model_bin_path=model_bin_path,
         host=host,
         port=port,
+        workers=workers,
+        profile=profile,
         ssl_key=ssl_key,
         ssl_cert=ssl_cert,
     )
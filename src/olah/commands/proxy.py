@@ -15,13 +15,14 @@ from typing import Optional
 
 import typer
 
-from olah.commands.factory import ProxyFactory
 from olah.utils.disk_utils import convert_to_bytes
 
 
 def proxy(
     host: str = typer.Option("0.0.0.0", help="服务器绑定地址"),
     port: int = typer.Option(8090, help="服务器绑定端口"),
+    workers: int = typer.Option(1, help="工作进程数"),
+    profile: str = typer.Option("default", help="运行时配置: default, performance"),
     hf_scheme: str = typer.Option(
         "https", help="HuggingFace 站点协议 (http/https)"
     ),
@@ -36,7 +37,7 @@ def proxy(
         None, help="缓存大小限制 (例如: '100MB', '2GB')"
     ),
     cache_clean_strategy: str = typer.Option(
-        "LRU", help="缓存清理策略: LRU, FIFO, LARGE_FIRST"
+        "LRU", help="缓存清理策略: LRU, FIFO, LARGE_FIRST, LFU, 2Q, TINYLFU, GDSF"
     ),
     ssl_key: Optional[str] = typer.Option(None, help="SSL 密钥文件路径"),
     ssl_cert: Optional[str] = typer.Option(None, help="SSL 证书文件路径"),
@@ -52,9 +53,14 @@ def proxy(
     if cache_size_limit is not None:
         cache_limit_bytes = convert_to_bytes(cache_size_limit)
     
+    # 运行时才导入工厂，保持 --help 快速
+    from olah.commands.factory import ProxyFactory
+
     factory = ProxyFactory(
         host=host,
         port=port,
+        workers=workers,
+        profile=profile,
         repos_path=repos_path,
         hf_scheme=hf_scheme,
         hf_netloc=hf_netloc,
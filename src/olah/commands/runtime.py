@@ -0,0 +1,81 @@
+# coding=utf-8
+# Copyright 2024 XiaHan
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+"""
+uvicorn 运行时配置。
+
+`default` 使用 uvicorn 的默认设置；`performance` 使用 uvloop 事件循环和 httptools
+解析器，并调大连接积压、并发上限和 keep-alive 超时。uvloop 和 httptools 可通过
+`pip install "uvicorn[standard]"` 安装，未安装时回退到 asyncio 和 h11。
+"""
+
+import importlib.util
+import sys
+from typing import Any, Dict
+
+from olah.configs import OlahConfig
+
+RUNTIME_PROFILES: Dict[str, Dict[str, Any]] = {
+    "default": {},
+    "performance": {
+        "loop": "uvloop",
+        "http": "httptools",
+        "backlog": 4096,
+        "limit_concurrency": 4096,
+        # huggingface_hub 会复用连接依次下载多个文件
+        "timeout_keep_alive": 30,
+        # 仅在回退到 h11 时生效
+        "h11_max_incomplete_event_size": 64 * 1024,
+    },
+}
+
+# uvicorn 的事件循环和 HTTP 实现，及其依赖的模块和回退选项
+_RUNTIME_IMPLEMENTATIONS = {
+    "loop": {"uvloop": ("uvloop", "asyncio")},
+    "http": {"httptools": ("httptools", "h11")},
+}
+
+
+def get_uvicorn_options(config: OlahConfig) -> Dict[str, Any]:
+    """
+    根据运行时配置生成 uvicorn 的参数。
+
+    Args:
+        config: Olah 配置对象
+
+    Returns:
+        Dict[str, Any]: 传给 `uvicorn.run` 的参数
+    """
+    server = config.server
+    if server.profile not in RUNTIME_PROFILES:
+        raise Exception(
+            f"Unknown runtime profile: {server.profile}. "
+            f"Available profiles: {', '.join(RUNTIME_PROFILES.keys())}."
+        )
+    options = dict(RUNTIME_PROFILES[server.profile])
+
+    for name, value in [
+        ("backlog", server.backlog),
+        ("limit_concurrency", server.limit_concurrency),
+        ("timeout_keep_alive", server.timeout_keep_alive),
+        ("h11_max_incomplete_event_size", server.h11_max_incomplete_event_size),
+    ]:
+        if value is not None:
+            options[name] = value
+
+    for option, implementations in _RUNTIME_IMPLEMENTATIONS.items():
+        if options.get(option, None) not in implementations:
+            continue
+        module, fallback = implementations[options[option]]
+        if importlib.util.find_spec(module) is None:
+            print(
+                f"{module} is not installed, falling back to {fallback}. "
+                'Install it with `pip install "uvicorn[standard]"`.',
+                file=sys.stderr,
+            )
+            options[option] = fallback
+    return options
@@ -15,12 +15,12 @@ from typing import Optional
 
 import typer
 
-from olah.commands.factory import S3Factory
-
 
 def s3(
     host: str = typer.Option("0.0.0.0", help="服务器绑定地址"),
     port: int = typer.Option(8090, help="服务器绑定端口"),
+    workers: int = typer.Option(1, help="工作进程数"),
+    profile: str = typer.Option("default", help="运行时配置: default, performance"),
     endpoint: str = typer.Option(..., "--endpoint", "-e", help="S3 端点 URL"),
     access_key: str = typer.Option(..., "--access-key", "-a", help="S3 访问密钥 ID"),
     secret_key: str = typer.Option(
@@ -47,6 +47,8 @@ def s3(
     缓存并上传模型文件到 S3 兼容存储。
     作为带 S3 后端的代理模式运行。
     """
+    from olah.commands.factory import S3Factory
+
     factory = S3Factory(
         endpoint=endpoint,
         access_key=access_key,
@@ -55,6 +57,8 @@ def s3(
         region=region,
         host=host,
         port=port,
+        workers=workers,
+        profile=profile,
         repos_path=repos_path,
         hf_scheme=hf_scheme,
         hf_netloc=hf_netloc,
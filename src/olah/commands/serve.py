@@ -15,8 +15,6 @@ from typing import Optional
 
 import typer
 
-from olah.commands.factory import ServeFactory
-
 
 def serve(
     config: str = typer.Option(
@@ -24,6 +22,8 @@ def serve(
     ),
     host: Optional[str] = typer.Option(None, help="覆盖配置中的 host"),
     port: Optional[int] = typer.Option(None, help="覆盖配置中的 port"),
+    workers: Optional[int] = typer.Option(None, help="覆盖配置中的 workers"),
+    profile: Optional[str] = typer.Option(None, help="覆盖配置中的运行时配置: default, performance"),
 ):
     """
     以 SERVE 模式启动 Olah（完整模式）。
@@ -31,9 +31,13 @@ def serve(
     从 TOML 配置文件加载所有设置，
     启用所有可用后端（代理、镜像、model-bin、S3）。
     """
+    from olah.commands.factory import ServeFactory
+
     factory = ServeFactory(
         config_path=config,
         host=host,
         port=port,
+        workers=workers,
+        profile=profile,
     )
     factory.run()
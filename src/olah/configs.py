@@ -10,11 +10,13 @@ from __future__ import annotations
 import dataclasses
 import fnmatch
 import re
+import typing
 from dataclasses import dataclass, field
 from typing import Any, Dict, List, Literal, Optional, Union
 
 import toml
 
+from olah.constants import LOG_QUEUE_SIZE
 from olah.utils.disk_utils import convert_to_bytes
 
 DEFAULT_PROXY_RULES = [
@@ -28,22 +30,58 @@ DEFAULT_CACHE_RULES = [
 ]
 
 
+def _dataclass_from_dict(cls: Any, data: Dict[str, Any]) -> Any:
+    """
+    Builds a dataclass from `dataclasses.asdict`, with its nested dataclasses and lists
+    of dataclasses.
+    """
+    hints = typing.get_type_hints(cls)
+    values = {}
+    for f in dataclasses.fields(cls):
+        if f.name not in data:
+            continue
+        value = data[f.name]
+        hint = hints[f.name]
+        if dataclasses.is_dataclass(hint) and isinstance(value, dict):
+            value = _dataclass_from_dict(hint, value)
+        elif typing.get_origin(hint) is list and isinstance(value, list):
+            item_hint = typing.get_args(hint)[0]
+            if dataclasses.is_dataclass(item_hint):
+                value = [_dataclass_from_dict(item_hint, item) for item in value]
+        values[f.name] = value
+    return cls(**values)
+
+
 @dataclass
 class OlahRule:
     repo: str = ""
     type: str = "*"
     allow: bool = False
     use_re: bool = False
+    # Cache admission, only used by cache rules. An object is persisted once it has
+    # been requested `min_accesses` times, or right away if it is at most `max_size` bytes.
+    min_accesses: int = 1
+    max_size: Optional[int] = None
 
     @staticmethod
     def from_dict(data: Dict[str, Any]) -> "OlahRule":
+        max_size = data.get("max_size", None)
+        if max_size is not None:
+            max_size = convert_to_bytes(str(max_size))
         return OlahRule(
             repo=data.get("repo", ""),
             type=data.get("type", "*"),
             allow=data.get("allow", False),
             use_re=data.get("use_re", False),
+            min_accesses=int(data.get("min_accesses", 1)),
+            max_size=max_size,
         )
 
+    def admit(self, access_count: int, file_size: int) -> bool:
+        if access_count >= self.min_accesses:
+            return True
+        return self.max_size is not None and file_size <= self.max_size
+
     def match(self, repo_name: str) -> bool:
         if self.use_re:
             return re.match(self.repo, repo_name) is not None
@@ -59,11 +97,18 @@ class OlahRuleList:
         return OlahRuleList([OlahRule.from_dict(item) for item in data])
 
     def allow(self, repo_name: str) -> bool:
-        allow = False
+        rule = self.match_rule(repo_name)
+        return rule is not None and rule.allow
+
+    def match_rule(self, repo_name: str) -> Optional[OlahRule]:
+        """
+        Returns the last rule matching `repo_name`, which is the one that decides.
+        """
+        matched = None
         for rule in self.rules:
             if rule.match(repo_name):
-                allow = rule.allow
-        return allow
+                matched = rule
+        return matched
 
     def clear(self) -> None:
         self.rules.clear()
@@ -73,11 +118,15 @@ class OlahRuleList:
 class BasicConfig:
     host: Union[List[str], str] = "localhost"
     port: int = 8090
+    workers: int = 1
     ssl_key: Optional[str] = None
     ssl_cert: Optional[str] = None
     repos_path: str = "./repos"
     cache_size_limit: Optional[int] = None
-    cache_clean_strategy: Literal["LRU", "FIFO", "LARGE_FIRST"] = "LRU"
+    cache_clean_strategy: Literal["LRU", "FIFO", "LARGE_FIRST", "LFU", "2Q", "TINYLFU", "GDSF"] = "LRU"
+    cache_high_watermark: float = 0.95
+    cache_low_watermark: float = 0.85
+    memory_cache_size: Optional[int] = None
     hf_scheme: str = "https"
     hf_netloc: str = "huggingface.co"
     hf_lfs_netloc: str = "cdn-lfs.huggingface.co"
@@ -116,6 +165,44 @@ class BasicConfig:
         return f"{self.mirror_scheme}://{self.mirror_lfs_netloc}"
 
 
+@dataclass
+class ServerConfig:
+    # Runtime profile of uvicorn, the other options override the profile values
+    profile: Literal["default", "performance"] = "default"
+    backlog: Optional[int] = None
+    limit_concurrency: Optional[int] = None
+    timeout_keep_alive: Optional[int] = None
+    h11_max_incomplete_event_size: Optional[int] = None
+
+
+@dataclass
+class LoggingConfig:
+    # Records are written by a background thread, the queue holds the pending ones
+    queue_size: int = LOG_QUEUE_SIZE
+    # "oldest" or "newest", the record dropped when the queue is full
+    drop_policy: Literal["oldest", "newest"] = "oldest"
+    # JSON lines log of the file downloads, disabled when not set
+    access_log: Optional[str] = None
+    access_log_sample_rate: float = 1.0
+
+
+@dataclass
+class MetricsConfig:
+    # Prometheus metrics served at /metrics
+    enable: bool = False
+
+
+@dataclass
+class DebugConfig:
+    # Profiling and task dump endpoints under /internal/debug
+    enable: bool = False
+    # Required in the x-olah-debug-secret header, only local clients are served without it
+    secret: Optional[str] = None
+    # Logs the callbacks and task steps blocking the event loop longer than this, in seconds
+    slow_callback_threshold: Optional[float] = None
+    loop_lag_interval: float = 0.5
+
+
 @dataclass
 class S3Config:
     enable: bool = False
@@ -124,6 +211,23 @@ class S3Config:
     access_key: Optional[str] = None
     secret_key: Optional[str] = None
     bucket: Optional[str] = None
+    read_through: bool = True
+    redirect: bool = False
+    redirect_expires: int = 15 * 60
+
+
+@dataclass
+class ClusterConfig:
+    enable: bool = False
+    # The URL other nodes reach this node at, the mirror URL by default
+    node: Optional[str] = None
+    peers: List[str] = field(default_factory=list)
+    secret: Optional[str] = None
+    # Patterns of the node URLs gossip may add, besides the static peers
+    allowed_peers: List[str] = field(default_factory=list)
+    virtual_nodes: int = 64
+    gossip_interval: int = 30
+    peer_timeout: int = 5
 
 
 @dataclass
@@ -143,7 +247,12 @@ class AccessibilityConfig:
 class OlahConfig:
     basic: BasicConfig = field(default_factory=BasicConfig)
     accessibility: AccessibilityConfig = field(default_factory=AccessibilityConfig)
+    server: ServerConfig = field(default_factory=ServerConfig)
+    logging: LoggingConfig = field(default_factory=LoggingConfig)
+    metrics: MetricsConfig = field(default_factory=MetricsConfig)
+    debug: DebugConfig = field(default_factory=DebugConfig)
     s3: S3Config = field(default_factory=S3Config)
+    cluster: ClusterConfig = field(default_factory=ClusterConfig)
     model_bin: ModelBinConfig = field(default_factory=ModelBinConfig)
 
     @classmethod
@@ -153,6 +262,13 @@ class OlahConfig:
             config.apply_toml(path)
         return config
 
+    def to_dict(self) -> Dict[str, Any]:
+        return dataclasses.asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "OlahConfig":
+        return _dataclass_from_dict(cls, data)
+
     def apply_toml(self, path: str) -> None:
         config = toml.load(path)
 
@@ -160,6 +276,7 @@ class OlahConfig:
             basic = config["basic"]
             self.basic.host = basic.get("host", self.basic.host)
             self.basic.port = basic.get("port", self.basic.port)
+            self.basic.workers = basic.get("workers", self.basic.workers)
             self.basic.ssl_key = self._empty_str(basic.get("ssl-key", self.basic.ssl_key))
             self.basic.ssl_cert = self._empty_str(basic.get("ssl-cert", self.basic.ssl_cert))
             self.basic.repos_path = basic.get("repos-path", self.basic.repos_path)
@@ -169,6 +286,15 @@ class OlahConfig:
             self.basic.cache_clean_strategy = basic.get(
                 "cache-clean-strategy", self.basic.cache_clean_strategy
             )
+            self.basic.cache_high_watermark = basic.get(
+                "cache-high-watermark", self.basic.cache_high_watermark
+            )
+            self.basic.cache_low_watermark = basic.get(
+                "cache-low-watermark", self.basic.cache_low_watermark
+            )
+            memory_cache_size = basic.get("memory-cache-size", None)
+            if memory_cache_size:
+                self.basic.memory_cache_size = convert_to_bytes(str(memory_cache_size))
             self.basic.hf_scheme = basic.get("hf-scheme", self.basic.hf_scheme)
             self.basic.hf_netloc = basic.get("hf-netloc", self.basic.hf_netloc)
             self.basic.hf_lfs_netloc = basic.get("hf-lfs-netloc", self.basic.hf_lfs_netloc)
@@ -191,6 +317,46 @@ class OlahConfig:
                 accessibility.get("cache", DEFAULT_CACHE_RULES)
             )
 
+        if "server" in config:
+            server = config["server"]
+            self.server.profile = server.get("profile", self.server.profile)
+            self.server.backlog = server.get("backlog", self.server.backlog)
+            self.server.limit_concurrency = server.get(
+                "limit-concurrency", self.server.limit_concurrency
+            )
+            self.server.timeout_keep_alive = server.get(
+                "timeout-keep-alive", self.server.timeout_keep_alive
+            )
+            self.server.h11_max_incomplete_event_size = server.get(
+                "h11-max-incomplete-event-size", self.server.h11_max_incomplete_event_size
+            )
+
+        if "logging" in config:
+            logging = config["logging"]
+            self.logging.queue_size = logging.get("queue-size", self.logging.queue_size)
+            self.logging.drop_policy = logging.get("drop-policy", self.logging.drop_policy)
+            self.logging.access_log = self._empty_str(
+                logging.get("access-log", self.logging.access_log)
+            )
+            self.logging.access_log_sample_rate = float(
+                logging.get("access-log-sample-rate", self.logging.access_log_sample_rate)
+            )
+
+        if "metrics" in config:
+            metrics = config["metrics"]
+            self.metrics.enable = metrics.get("enable", self.metrics.enable)
+
+        if "debug" in config:
+            debug = config["debug"]
+            self.debug.enable = debug.get("enable", self.debug.enable)
+            self.debug.secret = self._empty_str(debug.get("secret", self.debug.secret))
+            self.debug.slow_callback_threshold = debug.get(
+                "slow-callback-threshold", self.debug.slow_callback_threshold
+            )
+            self.debug.loop_lag_interval = debug.get(
+                "loop-lag-interval", self.debug.loop_lag_interval
+            )
+
         if "s3" in config:
             s3 = config["s3"]
             self.s3.enable = s3.get("enable", self.s3.enable)
@@ -199,6 +365,22 @@ class OlahConfig:
             self.s3.access_key = self._empty_str(s3.get("access-key", self.s3.access_key))
             self.s3.secret_key = self._empty_str(s3.get("secret-key", self.s3.secret_key))
             self.s3.bucket = self._empty_str(s3.get("bucket", self.s3.bucket))
+            self.s3.read_through = s3.get("read-through", self.s3.read_through)
+            self.s3.redirect = s3.get("redirect", self.s3.redirect)
+            self.s3.redirect_expires = s3.get("redirect-expires", self.s3.redirect_expires)
+
+        if "cluster" in config:
+            cluster = config["cluster"]
+            self.cluster.enable = cluster.get("enable", self.cluster.enable)
+            self.cluster.node = self._empty_str(cluster.get("node", self.cluster.node))
+            self.cluster.peers = cluster.get("peers", self.cluster.peers)
+            self.cluster.secret = self._empty_str(cluster.get("secret", self.cluster.secret))
+            self.cluster.allowed_peers = cluster.get("allowed-peers", self.cluster.allowed_peers)
+            self.cluster.virtual_nodes = cluster.get("virtual-nodes", self.cluster.virtual_nodes)
+            self.cluster.gossip_interval = cluster.get(
+                "gossip-interval", self.cluster.gossip_interval
+            )
+            self.cluster.peer_timeout = cluster.get("peer-timeout", self.cluster.peer_timeout)
 
         if "model-bin" in config:
             model_bin = config["model-bin"]
@@ -213,6 +395,10 @@ class OlahConfig:
     def port(self) -> int:
         return self.basic.port
 
+    @property
+    def workers(self) -> int:
+        return self.basic.workers
+
     @property
     def ssl_key(self) -> Optional[str]:
         return self.basic.ssl_key
@@ -230,9 +416,21 @@ class OlahConfig:
         return self.basic.cache_size_limit
 
     @property
-    def cache_clean_strategy(self) -> Literal["LRU", "FIFO", "LARGE_FIRST"]:
+    def cache_clean_strategy(self) -> Literal["LRU", "FIFO", "LARGE_FIRST", "LFU", "2Q", "TINYLFU", "GDSF"]:
         return self.basic.cache_clean_strategy
 
+    @property
+    def cache_high_watermark(self) -> float:
+        return self.basic.cache_high_watermark
+
+    @property
+    def cache_low_watermark(self) -> float:
+        return self.basic.cache_low_watermark
+
+    @property
+    def memory_cache_size(self) -> Optional[int]:
+        return self.basic.memory_cache_size
+
     @property
     def hf_scheme(self) -> str:
         return self.basic.hf_scheme
@@ -297,6 +495,18 @@ class OlahConfig:
     def s3_bucket(self) -> Optional[str]:
         return self.s3.bucket
 
+    @property
+    def s3_read_through(self) -> bool:
+        return self.s3.read_through
+
+    @property
+    def s3_redirect(self) -> bool:
+        return self.s3.redirect
+
+    @property
+    def s3_redirect_expires(self) -> int:
+        return self.s3.redirect_expires
+
     @property
     def model_bin_enable(self) -> bool:
         return self.model_bin.enable
@@ -12,15 +12,59 @@ WORKER_API_TIMEOUT = 15
 CHUNK_SIZE = 4096
 LFS_FILE_BLOCK = 64 * 1024 * 1024
 
+CACHE_STATE_SAVE_INTERVAL = 60
+CACHE_LEDGER_RECONCILE_INTERVAL = 24 * 60 * 60
+# The access index log is compacted into a snapshot once it holds more changes than
+# both this and the number of blocks in the snapshot
+CACHE_INDEX_COMPACT_MIN_EVENTS = 100000
+CACHE_EVICTION_CHECK_INTERVAL = 60
+CACHE_EVICTION_BATCH_BLOCKS = 64
+CACHE_EVICTION_BATCH_INTERVAL = 0.1
+
+S3_UPLOAD_CONCURRENCY = 4
+S3_UPLOAD_RETRIES = 3
+# Multipart uploads without a new part for this many seconds are aborted, e.g. the
+# uploads of files which are only partially downloaded
+S3_UPLOAD_IDLE_TTL = 15 * 60
+
 DEFAULT_LOGGER_DIR = "./logs"
+# Log records buffered for the log writer thread, the ones beyond are dropped
+LOG_QUEUE_SIZE = 10000
+# Threads of the executors running the blocking work of the request handlers
+GIT_EXECUTOR_WORKERS = 8
+FS_EXECUTOR_WORKERS = 32
+# Mirror repositories kept open per process, and the lookups memoized per repository
+MIRROR_REPO_CACHE_SIZE = 32
+MIRROR_COMMIT_CACHE_SIZE = 1024
+MIRROR_TREE_CACHE_SIZE = 8192
+# Commits per mirror repository whose snapshot and last commits of paths are kept, and
+# the most commits a snapshot is derived across from the snapshot of an ancestor
+MIRROR_SNAPSHOT_CACHE_SIZE = 8
+MIRROR_SNAPSHOT_MAX_DISTANCE = 64
+# Mirror blobs up to this size are read with the lookup, larger ones and LFS objects
+# are streamed in chunks of MIRROR_STREAM_CHUNK_SIZE
+MIRROR_BLOB_INLINE_SIZE = 1024 * 1024
+MIRROR_STREAM_CHUNK_SIZE = 1024 * 1024
+# Bytes read at a time from `git log` when looking up the last commits of paths
+MIRROR_LOG_READ_SIZE = 64 * 1024
+# Items per page of the mirror listings, as on the Hub, and the bytes per chunk of the
+# streamed JSON arrays
+MIRROR_TREE_PAGE_SIZE = 1000
+MIRROR_TREE_EXPAND_PAGE_SIZE = 50
+MIRROR_COMMITS_PAGE_SIZE = 50
+JSON_STREAM_CHUNK_SIZE = 64 * 1024
 OLAH_CODE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 ORIGINAL_LOC = "oriloc"
 
-from huggingface_hub.constants import (
-    REPO_TYPES_MAPPING,
-    HUGGINGFACE_CO_URL_TEMPLATE,
-    HUGGINGFACE_HEADER_X_REPO_COMMIT,
-    HUGGINGFACE_HEADER_X_LINKED_ETAG,
-    HUGGINGFACE_HEADER_X_LINKED_SIZE,
-)
+# Same values as `huggingface_hub.constants`, which is slow to import
+REPO_TYPES_MAPPING = {
+    "datasets": "dataset",
+    "spaces": "space",
+    "models": "model",
+    "kernels": "kernel",
+}
+HUGGINGFACE_CO_URL_TEMPLATE = "https://huggingface.co/{repo_id}/resolve/{revision}/{filename}"
+HUGGINGFACE_HEADER_X_REPO_COMMIT = "X-Repo-Commit"
+HUGGINGFACE_HEADER_X_LINKED_ETAG = "X-Linked-Etag"
+HUGGINGFACE_HEADER_X_LINKED_SIZE = "X-Linked-Size"
@@ -6,13 +6,14 @@
 # https://opensource.org/licenses/MIT.
 
 import os
+from typing import Optional
 from peewee import *
 import datetime
 
 from olah.utils.olah_utils import get_olah_path
 
-db_path = os.path.join(get_olah_path(), "database.db")
-db = SqliteDatabase(db_path)
+# Bound to a SQLite database on first use by `init_database`
+db = DatabaseProxy()
 
 class BaseModel(Model):
     class Meta:
@@ -39,9 +40,21 @@ class FileLevelLRU(BaseModel):
     path = CharField()
     datetime = DateTimeField(default=datetime.datetime.now)
 
-db.connect()
-db.create_tables([
-    Token,
-    DownloadLogs,
-    FileLevelLRU,
-])
+
+
+def init_database(db_path: Optional[str] = None) -> Database:
+    """
+    Opens the database and creates the missing tables. Calling it again is a no-op.
+    """
+    if db.obj is None:
+        if db_path is None:
+            db_path = os.path.join(get_olah_path(), "database.db")
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        db.initialize(SqliteDatabase(db_path))
+        db.connect(reuse_if_open=True)
+        db.create_tables([
+            Token,
+            DownloadLogs,
+            FileLevelLRU,
+        ])
+    return db.obj
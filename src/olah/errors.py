@@ -62,6 +62,17 @@ def error_revision_not_found(revision: str) -> Response:
     )
 
 
+def error_invalid_cursor() -> Response:
+    return JSONResponse(
+        content={"error": "Invalid cursor"},
+        headers={
+            "x-error-code": "BadRequest",
+            "x-error-message": "Invalid cursor",
+        },
+        status_code=400,
+    )
+
+
 # Olah Custom Messages
 def error_proxy_timeout() -> Response:
     return Response(
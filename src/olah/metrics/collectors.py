@@ -0,0 +1,136 @@
+# coding=utf-8
+# Copyright 2024 XiaHan
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+"""
+The metrics of Olah. Counters of events are updated where the events happen; the
+values Olah already keeps (tier statistics, cache size...) are copied in by the
+collector of the application at scrape time.
+"""
+
+from typing import Callable, Optional
+
+from olah.metrics.registry import REGISTRY, Counter, Gauge, Histogram
+from olah.utils.logging import get_dropped_records
+
+# Cache blocks are up to 50 MB, their reads and writes take longer than requests
+BLOCK_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+HTTP_REQUESTS = Counter(
+    "olah_http_requests_total",
+    "HTTP requests by router, method and status code.",
+    ["router", "method", "status"],
+)
+HTTP_REQUEST_DURATION = Histogram(
+    "olah_http_request_duration_seconds",
+    "Time until the response is fully sent, by router.",
+    ["router"],
+)
+CACHE_TIER_HITS = Counter(
+    "olah_cache_tier_hits_total",
+    "Ranges served by each tier. The upstream tier counts the cache misses.",
+    ["tier"],
+)
+CACHE_TIER_BYTES = Counter(
+    "olah_cache_tier_bytes_total",
+    "Bytes served by each tier. The upstream tier counts the cache misses.",
+    ["tier"],
+)
+CACHE_BLOCK_READ_DURATION = Histogram(
+    "olah_cache_block_read_seconds",
+    "Time to read and decompress a cache block from disk.",
+    buckets=BLOCK_BUCKETS,
+)
+CACHE_BLOCK_WRITE_DURATION = Histogram(
+    "olah_cache_block_write_seconds",
+    "Time to compress and write a cache block to disk.",
+    buckets=BLOCK_BUCKETS,
+)
+CACHE_BLOCK_COMPRESSION_DURATION = Histogram(
+    "olah_cache_block_compression_seconds",
+    "Time to compress or decompress a cache block.",
+    ["operation"],
+    buckets=BLOCK_BUCKETS,
+)
+CACHE_EVICTED_BLOCKS = Counter(
+    "olah_cache_evicted_blocks_total",
+    "Cache blocks removed by the eviction.",
+)
+CACHE_EVICTED_BYTES = Counter(
+    "olah_cache_evicted_bytes_total",
+    "Disk bytes freed by the eviction.",
+)
+CACHE_SIZE = Gauge("olah_cache_size_bytes", "Disk size of the cache blocks.")
+CACHE_SIZE_LIMIT = Gauge("olah_cache_size_limit_bytes", "The configured cache size limit.")
+MEMORY_CACHE_SIZE = Gauge("olah_memory_cache_size_bytes", "Size of the in-memory block cache.")
+UPSTREAM_REQUESTS = Counter(
+    "olah_upstream_requests_total",
+    "Ranged file requests sent upstream, by status code.",
+    ["status"],
+)
+UPSTREAM_REQUESTS_IN_FLIGHT = Gauge(
+    "olah_upstream_requests_in_flight",
+    "Upstream file requests with an open connection.",
+)
+DOWNLOADS_IN_FLIGHT = Gauge("olah_downloads_in_flight", "File downloads being streamed.")
+EVENT_LOOP_LAG = Gauge(
+    "olah_event_loop_lag_seconds",
+    "Delay of the event loop in running a scheduled callback, last and max measured.",
+    ["stat"],
+)
+LOG_RECORDS_DROPPED = Counter(
+    "olah_log_records_dropped_total",
+    "Log records dropped because the log queue was full.",
+)
+
+for metric in [
+    HTTP_REQUESTS,
+    HTTP_REQUEST_DURATION,
+    CACHE_TIER_HITS,
+    CACHE_TIER_BYTES,
+    CACHE_BLOCK_READ_DURATION,
+    CACHE_BLOCK_WRITE_DURATION,
+    CACHE_BLOCK_COMPRESSION_DURATION,
+    CACHE_EVICTED_BLOCKS,
+    CACHE_EVICTED_BYTES,
+    CACHE_SIZE,
+    CACHE_SIZE_LIMIT,
+    MEMORY_CACHE_SIZE,
+    UPSTREAM_REQUESTS,
+    UPSTREAM_REQUESTS_IN_FLIGHT,
+    DOWNLOADS_IN_FLIGHT,
+    EVENT_LOOP_LAG,
+    LOG_RECORDS_DROPPED,
+]:
+    REGISTRY.register(metric)
+
+
+def create_app_collector(app) -> Callable[[], None]:
+    """
+    Creates the collector copying the state of the application into the metrics.
+    """
+
+    def collect() -> None:
+        tiers = getattr(app.state, "cache_tiers", None)
+        if tiers is not None:
+            for tier, stats in tiers.stats().items():
+                CACHE_TIER_HITS.set_total(stats.hits, tier=tier)
+                CACHE_TIER_BYTES.set_total(stats.bytes, tier=tier)
+            if tiers.memory is not None:
+                MEMORY_CACHE_SIZE.set(tiers.memory.size)
+        ledger = getattr(app.state, "cache_ledger", None)
+        if ledger is not None:
+            CACHE_SIZE.set(ledger.size)
+        limit: Optional[int] = app.state.app_settings.config.cache_size_limit
+        if limit is not None:
+            CACHE_SIZE_LIMIT.set(limit)
+        monitor = getattr(app.state, "loop_lag_monitor", None)
+        if monitor is not None:
+            EVENT_LOOP_LAG.set(monitor.last_lag, stat="last")
+            EVENT_LOOP_LAG.set(monitor.max_lag, stat="max")
+        LOG_RECORDS_DROPPED.set_total(get_dropped_records())
+
+    return collect
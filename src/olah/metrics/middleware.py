@@ -0,0 +1,55 @@
+# coding=utf-8
+# Copyright 2024 XiaHan
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+import time
+
+from olah.metrics.collectors import HTTP_REQUEST_DURATION, HTTP_REQUESTS
+
+ROUTER_MODULE_PREFIX = "olah.router."
+
+
+def get_router_name(scope) -> str:
+    """
+    Names the router of a request after the module of its endpoint, e.g. `files`.
+    """
+    route = scope.get("route", None)
+    endpoint = getattr(route, "endpoint", None)
+    module = getattr(endpoint, "__module__", "") or ""
+    if module.startswith(ROUTER_MODULE_PREFIX):
+        return module[len(ROUTER_MODULE_PREFIX):]
+    return "none" if route is None else "other"
+
+
+class MetricsMiddleware(object):
+    """
+    ASGI middleware counting the requests and timing them until the last byte of the
+    response is sent. It does nothing while the metrics are disabled.
+    """
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http" or getattr(scope["app"].state, "metrics", None) is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            router = get_router_name(scope)
+            HTTP_REQUESTS.inc(router=router, method=scope["method"], status=str(status_code))
+            HTTP_REQUEST_DURATION.observe(time.perf_counter() - start, router=router)
@@ -4,28 +4,219 @@
 # Use of this source code is governed by an MIT-style
 # license that can be found in the LICENSE file or at
 # https://opensource.org/licenses/MIT.
+import bisect
+import functools
 import hashlib
-import io
+import json
 import os
 import re
-from typing import Any, Dict, List, Union
+import subprocess
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Set, Tuple, Union
 import gitdb
-from git import Commit, Optional, Repo, Tree
+from git import Blob, Commit, Git, Optional, Repo, Tree
 from git.objects.base import IndexObjUnion
-from gitdb.base import OStream
 import yaml
 
+from olah.constants import (
+    MIRROR_BLOB_INLINE_SIZE,
+    MIRROR_COMMIT_CACHE_SIZE,
+    MIRROR_LOG_READ_SIZE,
+    MIRROR_REPO_CACHE_SIZE,
+    MIRROR_SNAPSHOT_CACHE_SIZE,
+    MIRROR_SNAPSHOT_MAX_DISTANCE,
+    MIRROR_TREE_CACHE_SIZE,
+)
 from olah.mirror.meta import RepoMeta
+from olah.mirror.snapshots import (
+    TREE_MODE,
+    RepoSnapshot,
+    SnapshotStore,
+    TreeIndex,
+    apply_diff_tree,
+    parse_ls_tree,
+)
+
+LFS_POINTER_PATTERN = re.compile(
+    r"version https://git-lfs\.github\.com/spec/v[0-9]\noid sha256:([0-9a-z]{64})\nsize ([0-9]+?)\n"
+)
+
+
+def get_refs_signature(git_dir: str) -> Tuple:
+    """
+    Identifies the state of the refs of a repository. Git writes a ref to a new file
+    and renames it over the old one, so the inodes of the ref files change with them.
+    """
+    signature = []
+    for name in ["HEAD", "packed-refs"]:
+        try:
+            stat = os.stat(os.path.join(git_dir, name))
+            signature.append((name, stat.st_ino, stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            signature.append((name, None, None, None))
+    dirs = [os.path.join(git_dir, "refs")]
+    while len(dirs) != 0:
+        try:
+            with os.scandir(dirs.pop()) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        dirs.append(entry.path)
+                    else:
+                        signature.append((entry.path, entry.inode(), None, None))
+        except FileNotFoundError:
+            continue
+    return tuple(sorted(signature, key=lambda item: item[0]))
+
+
+def _git_command(git_dir: str, *args: str) -> List[str]:
+    return [Git.GIT_PYTHON_GIT_EXECUTABLE, "--git-dir", git_dir, *args]
+
+
+def _run_git(git_dir: str, *args: str) -> bytes:
+    """
+    Runs a git command without the GitPython handle of the repository, so that it can
+    run while the lock of the handle is released.
+    """
+    return subprocess.run(
+        _git_command(git_dir, *args),
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        check=True,
+    ).stdout
+
+
+def _tree_order_key(tree_index: TreeIndex, prefix: str, path: str) -> Tuple:
+    """
+    Sort key of a path under the tree `prefix`, in the order of `_iter_tree_entries`:
+    the entries of the tree in git order, which sorts the subtrees as if their names
+    ended with "/", then the entries of each subtree.
+    """
+    parts = path[len(prefix):].split("/")
+    name = parts[-1]
+    item = tree_index.get(path, None)
+    if item is not None and item[1] == TREE_MODE:
+        name += "/"
+    key: Tuple = (0, name)
+    for part in reversed(parts[:-1]):
+        key = (1, part + "/", key)
+    return key
+
+
+class MirrorRepoLock(object):
+    """
+    A reentrant lock, which the thread holding it can step out of while it runs a git
+    process which does not use the handle.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._owner: Optional[int] = None
+        self._count = 0
+
+    def acquire(self) -> None:
+        if self._owner == threading.get_ident():
+            self._count += 1
+            return
+        self._lock.acquire()
+        self._owner = threading.get_ident()
+        self._count = 1
+
+    def release(self) -> None:
+        self._count -= 1
+        if self._count == 0:
+            self._owner = None
+            self._lock.release()
+
+    def __enter__(self) -> "MirrorRepoLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.release()
+
+    @contextmanager
+    def unlocked(self) -> Iterator[None]:
+        """
+        Releases the lock if the calling thread holds it, and takes it again after.
+        """
+        if self._owner != threading.get_ident():
+            yield
+            return
+        count = self._count
+        self._owner = None
+        self._count = 0
+        self._lock.release()
+        try:
+            yield
+        finally:
+            self._lock.acquire()
+            self._owner = threading.get_ident()
+            self._count = count
 
 
 class LocalMirrorRepo(object):
-    def __init__(self, path: str, repo_type: str, org: str, repo: str) -> None:
+    """
+    A git repository served as a mirror of a Hugging Face repository.
+
+    GitPython handles are not thread-safe: hold `lock` while using an instance. The
+    snapshots and the last commits are computed by git processes which run with the
+    lock released, so that they do not hold up the other queries of the repository.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        repo_type: str,
+        org: str,
+        repo: str,
+        snapshots: Optional[SnapshotStore] = None,
+    ) -> None:
         self._path = path
         self._repo_type = repo_type
         self._org = org
         self._repo = repo
 
         self._git_repo = Repo(self._path)
+        self.refs_signature = get_refs_signature(self._git_repo.git_dir)
+        self.lock = MirrorRepoLock()
+
+        # Revisions and paths resolved in this repository. Branches only move with the
+        # refs, and the registry opens the repository again when they change.
+        self._commits: "OrderedDict[str, Optional[Commit]]" = OrderedDict()
+        self._index_objects: "OrderedDict[Tuple[str, str], Optional[IndexObjUnion]]" = OrderedDict()
+        self._lfs_pointers: "OrderedDict[str, Optional[Tuple[str, int]]]" = OrderedDict()
+        # The last commit changing each path listed so far, per commit. None for the
+        # paths the walk did not find, so that they are not walked for again.
+        self._last_commits: "OrderedDict[str, Dict[str, Optional[str]]]" = OrderedDict()
+        # The sorted paths of the paginated tree listings, per (commit, tree, recursive)
+        self._tree_listings: "OrderedDict[Tuple[str, str, bool], List[str]]" = OrderedDict()
+        # The snapshots of the commits, which outlive this handle
+        if snapshots is None:
+            snapshots = SnapshotStore(MIRROR_SNAPSHOT_CACHE_SIZE)
+        self._snapshots = snapshots
+
+    @property
+    def git_dir(self) -> str:
+        return self._git_repo.git_dir
+
+    def close(self) -> None:
+        self._git_repo.close()
+
+    def _get_commit(self, commit_hash: str) -> Optional[Commit]:
+        if commit_hash in self._commits:
+            self._commits.move_to_end(commit_hash)
+            return self._commits[commit_hash]
+        try:
+            commit = self._git_repo.commit(commit_hash)
+        except (gitdb.exc.BadName, gitdb.exc.BadObject):
+            commit = None
+        self._commits[commit_hash] = commit
+        if len(self._commits) > MIRROR_COMMIT_CACHE_SIZE:
+            self._commits.popitem(last=False)
+        return commit
 
     def _sha256(self, text: Union[str, bytes]) -> str:
         if isinstance(text, bytes) or isinstance(text, bytearray):
@@ -55,32 +246,16 @@ class LocalMirrorRepo(object):
         out = re.sub(pattern, "", readme, flags=re.S)
         return out
 
-    def _get_readme(self, commit: Commit) -> str:
-        if "README.md" not in commit.tree:
-            return ""
-        else:
-            out: bytes = commit.tree["README.md"].data_stream.read()
-            return out.decode()
-
-    def _get_description(self, commit: Commit) -> str:
-        readme = self._get_readme(commit)
-        return self._remove_card(readme)
+    def _format_date(self, commit: Commit) -> str:
+        return commit.committed_datetime.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
 
-    def _get_tree_filepaths_recursive(self, tree: Tree, include_dir: bool = False) -> List[str]:
-        out_paths = []
-        for entry in tree:
-            if entry.type == "tree":
-                out_paths.extend(self._get_tree_filepaths_recursive(entry))
-                if include_dir:
-                    out_paths.append(entry.path)
-            else:
-                out_paths.append(entry.path)
-        return out_paths
-
-    def _get_commit_filepaths_recursive(self, commit: Commit) -> List[str]:
-        return self._get_tree_filepaths_recursive(commit.tree)
-
-    def _get_path_info(self, entry: IndexObjUnion, expand: bool = False) -> Dict[str, Union[int, str]]:
+    def _get_path_info(
+        self,
+        entry: IndexObjUnion,
+        expand: bool = False,
+        last_commit: Optional[Commit] = None,
+        commit: Optional[Commit] = None,
+    ) -> Dict[str, Union[int, str]]:
         lfs = False
         if entry.type != "tree":
             t = "file"
@@ -123,14 +298,20 @@ class LocalMirrorRepo(object):
                 "lfs": lfs_data,
             }
         if expand:
-            last_commit = next(self._git_repo.iter_commits(paths=entry.path, max_count=1))
-            item["lastCommit"] = {
-                "id": last_commit.hexsha,
-                "title": last_commit.message,
-                "date": last_commit.committed_datetime.strftime(
-                    "%Y-%m-%dT%H:%M:%S.%fZ"
+            if last_commit is None:
+                # The history of the listed commit, not of HEAD
+                rev = commit.hexsha if commit is not None else None
+                last_commit = next(
+                    self._git_repo.iter_commits(rev, paths=entry.path, max_count=1), None
                 )
-            }
+            if last_commit is not None:
+                item["lastCommit"] = {
+                    "id": last_commit.hexsha,
+                    "title": last_commit.message,
+                    "date": last_commit.committed_datetime.strftime(
+                        "%Y-%m-%dT%H:%M:%S.%fZ"
+                    )
+                }
             item["security"] = {
                 "blobId": entry.hexsha,
                 "name": entry.name,
@@ -144,78 +325,315 @@ class LocalMirrorRepo(object):
             }
         return item
 
-    def _get_tree_files(
-        self, tree: Tree, recursive: bool = False, expand: bool = False
-    ) -> List[Dict[str, Union[int, str]]]:
-        entries = []
+    def _iter_tree_entries(self, tree: Tree, recursive: bool = False) -> Iterator[IndexObjUnion]:
+        """
+        Yields the entries of a tree, then, if `recursive`, the entries of each subtree
+        in the same order. Every tree is read once.
+        """
+        subtrees = []
         for entry in tree:
-            entries.append(self._get_path_info(entry=entry, expand=expand))
+            yield entry
+            if recursive and entry.type == "tree":
+                subtrees.append(entry)
+        for subtree in subtrees:
+            yield from self._iter_tree_entries(subtree, recursive=recursive)
 
-        if recursive:
-            for entry in tree:
-                if entry.type == "tree":
-                    entries.extend(self._get_tree_files(entry, recursive=recursive, expand=expand))
-        return entries
+    def _get_tree_files(
+        self,
+        tree: Tree,
+        recursive: bool = False,
+        expand: bool = False,
+        commit: Optional[Commit] = None,
+    ) -> List[Dict[str, Union[int, str]]]:
+        entries = list(self._iter_tree_entries(tree, recursive=recursive))
+        return self._get_entries_info(entries, expand=expand, commit=commit)
+
+    def _get_entries_info(
+        self,
+        entries: List[IndexObjUnion],
+        expand: bool = False,
+        commit: Optional[Commit] = None,
+    ) -> List[Dict[str, Union[int, str]]]:
+        last_commits = {}
+        if expand and commit is not None:
+            last_commits = self.get_last_commits(commit.hexsha, [entry.path for entry in entries])
+        return [
+            self._get_path_info(
+                entry=entry,
+                expand=expand,
+                last_commit=last_commits.get(entry.path, None),
+                commit=commit,
+            )
+            for entry in entries
+        ]
 
     def _get_commit_files(self, commit: Commit) -> List[Dict[str, Union[int, str]]]:
         return self._get_tree_files(commit.tree)
 
-    def _get_earliest_commit(self) -> Commit:
-        earliest_commit = None
-        earliest_commit_date = None
-
-        for commit in self._git_repo.iter_commits():
-            commit_date = commit.committed_datetime
-
-            if earliest_commit_date is None or commit_date < earliest_commit_date:
-                earliest_commit = commit
-                earliest_commit_date = commit_date
-
-        return earliest_commit
+    def _walk_last_commits(self, git_dir: str, commit_sha: str, paths: Set[str]) -> Dict[str, str]:
+        """
+        Finds the last commit changing each of `paths`, files or directories, with a
+        single `git log --name-only` walk of the history of a commit, instead of a
+        `git rev-list` per path. The walk stops once every path is found.
+        """
+        last_commits: Dict[str, str] = {}
+        process = subprocess.Popen(
+            _git_command(
+                git_dir, "log", commit_sha, "-z", "--name-only", "--no-renames", "--format=%x01%H"
+            ),
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            each_commit_sha = None
+            buffer = b""
+            while len(last_commits) < len(paths):
+                chunk = process.stdout.read1(MIRROR_LOG_READ_SIZE)
+                if len(chunk) == 0:
+                    break
+                *tokens, buffer = (buffer + chunk).split(b"\0")
+                for token in tokens:
+                    # The names of a commit follow its formatted line
+                    if token.startswith(b"\n"):
+                        token = token[1:]
+                    if token.startswith(b"\x01"):
+                        each_commit_sha = token[1:].decode("ascii")
+                        continue
+                    path = token.decode("utf-8")
+                    # A change of a file is a change of its directories
+                    while path != "" and path not in last_commits:
+                        if path in paths:
+                            last_commits[path] = each_commit_sha
+                        path = path.rpartition("/")[0]
+        finally:
+            process.stdout.close()
+            if process.poll() is None:
+                process.kill()
+            process.wait()
+        return last_commits
+
+    def get_last_commits(self, commit_hash: str, paths: List[str]) -> Dict[str, Commit]:
+        """
+        Returns the last commit changing each of `paths` in the history of a commit.
+        The results are kept per commit, so that the next listings only walk the
+        history for the paths not seen yet.
+        """
+        commit = self._get_commit(commit_hash)
+        if commit is None:
+            return {}
+        known = self._last_commits.get(commit.hexsha, None)
+        if known is None:
+            known = {}
+            self._last_commits[commit.hexsha] = known
+            if len(self._last_commits) > MIRROR_SNAPSHOT_CACHE_SIZE:
+                self._last_commits.popitem(last=False)
+        else:
+            self._last_commits.move_to_end(commit.hexsha)
+        missing = set(path for path in paths if path not in known)
+        if len(missing) != 0:
+            git_dir = self.git_dir
+            with self.lock.unlocked():
+                found = self._walk_last_commits(git_dir, commit.hexsha, missing)
+            for path in missing:
+                known[path] = found.get(path, None)
+        return {
+            path: self._get_commit(known[path]) for path in paths if known[path] is not None
+        }
 
     def get_index_object_by_path(
         self, commit_hash: str, path: str
     ) -> Optional[IndexObjUnion]:
-        try:
-            commit = self._git_repo.commit(commit_hash)
-        except gitdb.exc.BadName:
+        commit = self._get_commit(commit_hash)
+        if commit is None:
             return None
-        path_part = path.split("/")
-        path_part = [part for part in path_part if len(part.strip()) != 0]
-        tree = commit.tree
-        items = self._get_tree_files(tree=tree)
+        key = (commit.hexsha, path)
+        if key in self._index_objects:
+            self._index_objects.move_to_end(key)
+            return self._index_objects[key]
+        index_object = self._find_index_object(commit, path)
+        self._index_objects[key] = index_object
+        if len(self._index_objects) > MIRROR_TREE_CACHE_SIZE:
+            self._index_objects.popitem(last=False)
+        return index_object
+
+    def _find_index_object(self, commit: Commit, path: str) -> Optional[IndexObjUnion]:
+        snapshot = self._snapshots.get(commit.hexsha)
+        path_part = [part for part in path.split("/") if len(part.strip()) != 0]
         if len(path_part) == 0:
+            return commit.tree
+        if snapshot is not None:
+            path = "/".join(path_part)
+            index_item = snapshot.tree_index.get(path, None)
+            if index_item is None:
+                return None
+            return self._make_index_object(path, index_item)
+        # Look each name up in its parent tree, without reading the other entries
+        entry = commit.tree
+        for part in path_part:
+            if entry.type != "tree":
+                return None
+            try:
+                entry = entry[part]
+            except KeyError:
+                return None
+        return entry
+
+    def _make_index_object(self, path: str, index_item: Tuple[bytes, int]) -> IndexObjUnion:
+        binsha, mode = index_item
+        if mode == TREE_MODE:
+            return Tree(self._git_repo, binsha, mode=mode, path=path)
+        return Blob(self._git_repo, binsha, mode=mode, path=path)
+
+    def get_path_index(self, commit_hash: str) -> Optional[TreeIndex]:
+        """
+        Maps every path of a commit to the sha and the mode of its object, from the
+        snapshot of the commit.
+        """
+        snapshot = self.get_snapshot(commit_hash)
+        if snapshot is None:
             return None
-        for i, part in enumerate(path_part):
-            if i != len(path_part) - 1:
-                if part not in [
-                    item["name"] for item in items if item["type"] == "directory"
-                ]:
-                    return None
+        return snapshot.tree_index
+
+    def get_snapshot(self, commit_hash: str) -> Optional[RepoSnapshot]:
+        """
+        Returns the snapshot of a commit, built on first use. If a recent ancestor has
+        a snapshot and the commits since only have one parent each, as after a fetch
+        into the mirror, the snapshot is derived from the one of the ancestor.
+        """
+        commit = self._get_commit(commit_hash)
+        if commit is None:
+            return None
+        future = self._snapshots.claim_build(commit.hexsha)
+        if future is not None:
+            # Built by another request, maybe through another handle
+            with self.lock.unlocked():
+                return future.result()
+
+        try:
+            new_commits = []
+            base = None
+            each_commit = commit
+            for _ in range(MIRROR_SNAPSHOT_MAX_DISTANCE):
+                if len(each_commit.parents) != 1:
+                    break
+                new_commits.append(each_commit)
+                each_commit = each_commit.parents[0]
+                base = self._snapshots.get(each_commit.hexsha)
+                if base is not None:
+                    break
+            if base is None:
+                snapshot = self._build_snapshot(commit)
             else:
-                if part not in [
-                    item["name"] for item in items
-                ]:
-                    return None
-            tree = tree[part]
-            if tree.type == "tree":
-                items = self._get_tree_files(tree=tree, recursive=False)
-        return tree
+                snapshot = self._update_snapshot(commit, base, new_commits)
+        except BaseException as e:
+            self._snapshots.finish_build(commit.hexsha, None, e)
+            raise
+        self._snapshots.finish_build(commit.hexsha, snapshot)
+        return snapshot
+
+    def _build_snapshot(self, commit: Commit) -> RepoSnapshot:
+        git_dir = self.git_dir
+        with self.lock.unlocked():
+            ls_tree = _run_git(git_dir, "ls-tree", "-r", "-t", "-z", commit.hexsha)
+            rev_list = _run_git(git_dir, "rev-list", "--timestamp", commit.hexsha)
+        tree_index = parse_ls_tree(ls_tree)
+        commit_shas = []
+        created = None
+        for line in rev_list.decode("ascii").splitlines():
+            timestamp, sha = line.split(" ")
+            commit_shas.append(bytes.fromhex(sha))
+            # The first of the earliest commits, like the previous full scan
+            if created is None or int(timestamp) < created[0]:
+                created = (int(timestamp), sha)
+        return self._make_snapshot(commit, tree_index, b"".join(commit_shas), created, None)
+
+    def _update_snapshot(
+        self, commit: Commit, base: RepoSnapshot, new_commits: List[Commit]
+    ) -> RepoSnapshot:
+        git_dir = self.git_dir
+        with self.lock.unlocked():
+            diff_tree = _run_git(
+                git_dir, "diff-tree", "-r", "-t", "-z", "--no-renames", base.commit, commit.hexsha
+            )
+        tree_index = apply_diff_tree(base.tree_index, diff_tree)
+        # The history of a commit with a single parent is the commit, then the history
+        # of the parent
+        commit_shas = b"".join(each_commit.binsha for each_commit in new_commits)
+        created = None
+        for each_commit in new_commits:
+            if created is None or each_commit.committed_date < created[0]:
+                created = (each_commit.committed_date, each_commit.hexsha)
+        if created is None or base.created[0] < created[0]:
+            created = base.created
+        return self._make_snapshot(
+            commit, tree_index, commit_shas + base.commit_shas, created, base
+        )
+
+    def _make_snapshot(
+        self,
+        commit: Commit,
+        tree_index: TreeIndex,
+        commit_shas: bytes,
+        created: Tuple[int, str],
+        base: Optional[RepoSnapshot],
+    ) -> RepoSnapshot:
+        readme_item = tree_index.get("README.md", None)
+        readme_sha = None
+        if readme_item is not None and readme_item[1] != TREE_MODE:
+            readme_sha = readme_item[0]
+        if base is not None and base.readme[0] == readme_sha:
+            readme = base.readme
+        else:
+            readme_text = ""
+            if readme_sha is not None:
+                readme_text = self._git_repo.odb.stream(readme_sha).read().decode()
+            readme = (
+                readme_sha,
+                self._remove_card(readme_text),
+                yaml.load(self._match_card(readme_text), Loader=yaml.CLoader),
+            )
+
+        snapshot = RepoSnapshot(commit.hexsha, tree_index, commit_shas, created, readme, b"")
+        meta = RepoMeta()
+        meta._id = self._sha256(f"{self._org}/{self._repo}/{commit.hexsha}")
+        meta.id = f"{self._org}/{self._repo}"
+        meta.author = self._org
+        meta.sha = commit.hexsha
+        meta.lastModified = self._format_date(commit)
+        meta.private = False
+        meta.gated = False
+        meta.disabled = False
+        meta.tags = []
+        meta.description = readme[1]
+        meta.paperswithcode_id = None
+        meta.downloads = 0
+        meta.likes = 0
+        meta.cardData = readme[2]
+        meta.siblings = [{"rfilename": p} for p in snapshot.get_file_paths()]
+        meta.createdAt = self._format_date(self._get_commit(created[1]))
+        snapshot.meta_json = json.dumps(
+            meta.to_dict(), ensure_ascii=False, allow_nan=False, separators=(",", ":")
+        ).encode("utf-8")
+        return snapshot
 
     def get_pathinfos(
         self, commit_hash: str, paths: List[str]
     ) -> Optional[List[Dict[str, Any]]]:
-        try:
-            commit = self._git_repo.commit(commit_hash)
-        except gitdb.exc.BadName:
+        commit = self._get_commit(commit_hash)
+        if commit is None:
             return None
 
+        if len(paths) > 1:
+            # Build the snapshot of the commit, whose index replaces the walks per path
+            self.get_path_index(commit.hexsha)
         results = []
         for path in paths:
             index_obj = self.get_index_object_by_path(
-                commit_hash=commit_hash, path=path
+                commit_hash=commit.hexsha, path=path
             )
-            if index_obj is not None:
+            # The root tree has no path info
+            if index_obj is not None and index_obj.path != "":
                 results.append(self._get_path_info(index_obj))
         
         for r in results:
@@ -226,150 +644,331 @@ class LocalMirrorRepo(object):
     def get_tree(
         self, commit_hash: str, path: str, recursive: bool = False, expand: bool = False
     ) -> Optional[Dict[str, Any]]:
-        try:
-            commit = self._git_repo.commit(commit_hash)
-        except gitdb.exc.BadName:
+        commit = self._get_commit(commit_hash)
+        if commit is None:
             return None
 
-        index_obj = self.get_index_object_by_path(commit_hash=commit_hash, path=path)
-        items = self._get_tree_files(tree=index_obj, recursive=recursive, expand=expand)
+        index_obj = self.get_index_object_by_path(commit_hash=commit.hexsha, path=path)
+        if index_obj is None or index_obj.type != "tree":
+            return None
+        items = self._get_tree_files(
+            tree=index_obj, recursive=recursive, expand=expand, commit=commit
+        )
         for r in items:
             r.pop("name")
         return items
-    
-    def get_commits(self, commit_hash: str) -> Optional[Dict[str, Any]]:
-        try:
-            commit = self._git_repo.commit(commit_hash)
-        except gitdb.exc.BadName:
+
+    def _get_tree_listing(self, snapshot: RepoSnapshot, prefix: str, recursive: bool) -> List[str]:
+        """
+        Returns the paths under the tree `prefix` of a snapshot, in the order of
+        `get_tree`. The listing is sorted once and shared by all its pages.
+        """
+        key = (snapshot.commit, prefix, recursive)
+        if key in self._tree_listings:
+            self._tree_listings.move_to_end(key)
+            return self._tree_listings[key]
+        paths = [
+            path
+            for path in snapshot.tree_index.keys()
+            if path.startswith(prefix) and (recursive or "/" not in path[len(prefix):])
+        ]
+        paths.sort(key=functools.partial(_tree_order_key, snapshot.tree_index, prefix))
+        self._tree_listings[key] = paths
+        if len(self._tree_listings) > MIRROR_SNAPSHOT_CACHE_SIZE:
+            self._tree_listings.popitem(last=False)
+        return paths
+
+    def get_tree_page(
+        self,
+        commit_hash: str,
+        path: str,
+        after: Optional[str],
+        limit: int,
+        recursive: bool = False,
+        expand: bool = False,
+    ) -> Optional["MirrorPage"]:
+        """
+        Lists up to `limit` entries of a tree, in the order of `get_tree`, starting
+        after the path `after` or at the first entry. The pages are cut from the sorted
+        paths of the snapshot of the commit, so a page costs a binary search wherever
+        it is in the listing, and only its own entries are described.
+        """
+        commit = self._get_commit(commit_hash)
+        if commit is None:
             return None
 
-        parent_commits = [commit] + [each_commit for each_commit in commit.iter_parents()]
-        items = []
-        for each_commit in parent_commits:
-            item = {
-                "id": each_commit.hexsha,
-                "title": each_commit.message,
-                "message": "",
-                "authors": [],
-                "date": each_commit.committed_datetime.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
-            }
-            item["authors"].append({
-                "name": each_commit.author.name,
-                "avatar": None
-            })
-            items.append(item)
-        return items
+        index_obj = self.get_index_object_by_path(commit_hash=commit.hexsha, path=path)
+        if index_obj is None or index_obj.type != "tree":
+            return None
+        snapshot = self.get_snapshot(commit.hexsha)
+        prefix = index_obj.path + "/" if index_obj.path != "" else ""
+        paths = self._get_tree_listing(snapshot, prefix, recursive)
+        start = 0
+        if after is not None and after.startswith(prefix):
+            order_key = functools.partial(_tree_order_key, snapshot.tree_index, prefix)
+            start = bisect.bisect_right(paths, order_key(after), key=order_key)
+        entries = [
+            self._make_index_object(each_path, snapshot.tree_index[each_path])
+            for each_path in paths[start:start + limit]
+        ]
+        next_after = None
+        if start + limit < len(paths):
+            next_after = entries[-1].path
+        items = self._get_entries_info(entries, expand=expand, commit=commit)
+        for r in items:
+            r.pop("name")
+        return MirrorPage(commit.hexsha, items, next_after)
+
+    def _get_commit_info(self, commit: Commit) -> Dict[str, Any]:
+        item = {
+            "id": commit.hexsha,
+            "title": commit.message,
+            "message": "",
+            "authors": [],
+            "date": commit.committed_datetime.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+        }
+        item["authors"].append({
+            "name": commit.author.name,
+            "avatar": None
+        })
+        return item
 
-    def get_meta(self, commit_hash: str) -> Optional[Dict[str, Any]]:
-        try:
-            commit = self._git_repo.commit(commit_hash)
-        except gitdb.exc.BadName:
+    def get_commits(self, commit_hash: str) -> Optional[Dict[str, Any]]:
+        snapshot = self.get_snapshot(commit_hash)
+        if snapshot is None:
             return None
-        meta = RepoMeta()
+        return [
+            self._get_commit_info(self._get_commit(sha))
+            for sha in snapshot.iter_commit_shas(0, snapshot.commit_count)
+        ]
 
-        meta._id = self._sha256(f"{self._org}/{self._repo}/{commit.hexsha}")
-        meta.id = f"{self._org}/{self._repo}"
-        meta.author = self._org
-        meta.sha = commit.hexsha
-        meta.lastModified = self._git_repo.head.commit.committed_datetime.strftime(
-            "%Y-%m-%dT%H:%M:%S.%fZ"
-        )
-        meta.private = False
-        meta.gated = False
-        meta.disabled = False
-        meta.tags = []
-        meta.description = self._get_description(commit)
-        meta.paperswithcode_id = None
-        meta.downloads = 0
-        meta.likes = 0
-        meta.cardData = yaml.load(
-            self._match_card(self._get_readme(commit)), Loader=yaml.CLoader
-        )
-        meta.siblings = [
-            {"rfilename": p} for p in self._get_commit_filepaths_recursive(commit)
+    def get_commits_page(self, commit_hash: str, offset: int, limit: int) -> Optional["MirrorPage"]:
+        """
+        Lists the commits `[offset, offset + limit)` of the history of a commit, in the
+        order of `get_commits`, from the snapshot of the commit.
+        """
+        commit = self._get_commit(commit_hash)
+        if commit is None:
+            return None
+        snapshot = self.get_snapshot(commit.hexsha)
+        items = [
+            self._get_commit_info(self._get_commit(sha))
+            for sha in snapshot.iter_commit_shas(offset, offset + limit)
         ]
-        meta.createdAt = self._get_earliest_commit().committed_datetime.strftime(
-            "%Y-%m-%dT%H:%M:%S.%fZ"
-        )
-        return meta.to_dict()
-
-    def _contain_path(self, path: str, tree: Tree) -> bool:
-        norm_p = os.path.normpath(path).replace("\\", "/")
-        parts = norm_p.split("/")
-        for part in parts:
-            if all([t.name != part for t in tree]):
-                return False
-            else:
-                entry = tree[part]
-                if entry.type == "tree":
-                    tree = entry
-                else:
-                    tree = {}
-        return True
+        next_offset = None
+        if offset + limit < snapshot.commit_count:
+            next_offset = offset + limit
+        return MirrorPage(commit.hexsha, items, next_offset)
 
-    def get_file_head(self, commit_hash: str, path: str) -> Optional[Dict[str, Any]]:
-        try:
-            commit = self._git_repo.commit(commit_hash)
-        except gitdb.exc.BadName:
+    def get_meta(self, commit_hash: str) -> Optional[Dict[str, Any]]:
+        meta_json = self.get_meta_json(commit_hash)
+        if meta_json is None:
+            return None
+        return json.loads(meta_json)
+
+    def get_meta_json(self, commit_hash: str) -> Optional[bytes]:
+        """
+        Returns the metadata of a commit, encoded once in its snapshot.
+        """
+        snapshot = self.get_snapshot(commit_hash)
+        if snapshot is None:
             return None
+        return snapshot.meta_json
 
-        if not self._contain_path(path, commit.tree):
+    def _get_lfs_pointer(self, entry: IndexObjUnion) -> Optional[Tuple[str, int]]:
+        """
+        Returns the oid and the size of the LFS object if the blob is an LFS pointer.
+        """
+        if not ((entry.size > 120) and (entry.size < 150)):
             return None
-        else:
-            header = {}
-            header["content-length"] = str(commit.tree[path].data_stream.size)
-            header["x-repo-commit"] = commit.hexsha
-            header["etag"] = commit.tree[path].binsha.hex()
-            if (commit.tree[path].data_stream.size > 120) and (commit.tree[path].data_stream.size < 150):
-                lfs_data = commit.tree[path].data_stream.read().decode("utf-8")
-                match_groups = re.match(
-                    r"version https://git-lfs\.github\.com/spec/v[0-9]\noid sha256:([0-9a-z]{64})\nsize ([0-9]+?)\n",
-                    lfs_data,
-                )
-                if match_groups is not None:
-                    oid_sha256 = match_groups.group(1)
-                    objects_dir = os.path.join(self._git_repo.working_dir, '.git', 'lfs', 'objects')
-                    oid_dir = os.path.join(objects_dir, oid_sha256[:2], oid_sha256[2:4], oid_sha256)
-                    header["content-length"] = str(os.path.getsize(oid_dir))
-                    with open(oid_dir, mode='rb') as lfs_file:
-                        header["etag"] = self._sha256(lfs_file.read())
+        # Blobs are addressed by their content, the parsed pointers never go stale
+        if entry.hexsha in self._lfs_pointers:
+            self._lfs_pointers.move_to_end(entry.hexsha)
+            return self._lfs_pointers[entry.hexsha]
+        match_groups = LFS_POINTER_PATTERN.match(entry.data_stream.read().decode("utf-8"))
+        lfs_pointer = None
+        if match_groups is not None:
+            lfs_pointer = (match_groups.group(1), int(match_groups.group(2)))
+        self._lfs_pointers[entry.hexsha] = lfs_pointer
+        if len(self._lfs_pointers) > MIRROR_TREE_CACHE_SIZE:
+            self._lfs_pointers.popitem(last=False)
+        return lfs_pointer
+
+    def _get_lfs_object_path(self, oid: str) -> str:
+        return os.path.join(self.git_dir, "lfs", "objects", oid[:2], oid[2:4], oid)
+
+    def _get_file_header(
+        self, commit: Commit, entry: IndexObjUnion
+    ) -> Optional[Tuple[int, Dict[str, str], Optional[str]]]:
+        """
+        Returns the size, the headers and the path of the LFS object, if any, of a file.
+        The etag of an LFS file is the oid in its pointer, which is the SHA256 of the
+        object, so the object is never read to compute it.
+        """
+        header = {}
+        header["x-repo-commit"] = commit.hexsha
+        header["etag"] = entry.hexsha
+        lfs_pointer = self._get_lfs_pointer(entry)
+        if lfs_pointer is None:
+            return entry.size, header, None
+        oid, _ = lfs_pointer
+        lfs_path = self._get_lfs_object_path(oid)
+        try:
+            size = os.path.getsize(lfs_path)
+        except FileNotFoundError:
+            # The LFS object was not fetched into the mirror
+            return None
+        header["etag"] = oid
+        return size, header, lfs_path
 
-            return header
+    def get_file_head(self, commit_hash: str, path: str) -> Optional[Dict[str, Any]]:
+        commit = self._get_commit(commit_hash)
+        if commit is None:
+            return None
 
-    def get_file(self, commit_hash: str, path: str) -> Optional[OStream]:
-        try:
-            commit = self._git_repo.commit(commit_hash)
-        except gitdb.exc.BadName:
+        entry = self.get_index_object_by_path(commit_hash=commit.hexsha, path=path)
+        if entry is None or entry.type == "tree":
             return None
+        file_header = self._get_file_header(commit, entry)
+        if file_header is None:
+            return None
+        size, header, _ = file_header
+        header["content-length"] = str(size)
+        return header
 
-        lfs = False
-        oid_dir = ""
-        if (commit.tree[path].size > 120) and (commit.tree[path].size < 150):
-            lfs_data = commit.tree[path].data_stream.read().decode("utf-8")
-            match_groups = re.match(
-                    r"version https://git-lfs\.github\.com/spec/v[0-9]\noid sha256:([0-9a-z]{64})\nsize ([0-9]+?)\n",
-                    lfs_data,
-            )
-            if match_groups is not None:
-                lfs = True
-                oid_sha256 = match_groups.group(1)
-                objects_dir = os.path.join(self._git_repo.working_dir, '.git', 'lfs', 'objects')
-                oid_dir = os.path.join(objects_dir, oid_sha256[:2], oid_sha256[2:4], oid_sha256)
-
-        def stream_wrapper(file_bytes: bytes):
-            file_stream = io.BytesIO(file_bytes)
-            while True:
-                chunk = file_stream.read(4096)
-                if len(chunk) == 0:
-                    break
-                else:
-                    yield chunk
+    def get_file(self, commit_hash: str, path: str) -> Optional["MirrorFile"]:
+        commit = self._get_commit(commit_hash)
+        if commit is None:
+            return None
 
-        if not self._contain_path(path, commit.tree):
+        entry = self.get_index_object_by_path(commit_hash=commit.hexsha, path=path)
+        if entry is None or entry.type == "tree":
             return None
-        else:
-            if lfs:
-                with open(oid_dir, mode='rb') as lfs_file:
-                    return stream_wrapper(lfs_file.read())
+        file_header = self._get_file_header(commit, entry)
+        if file_header is None:
+            return None
+        size, header, lfs_path = file_header
+        if lfs_path is not None:
+            return MirrorFile(size, header, lfs_path=lfs_path)
+        if entry.size <= MIRROR_BLOB_INLINE_SIZE:
+            return MirrorFile(entry.size, header, data=entry.data_stream.read())
+        return MirrorFile(entry.size, header, git_dir=self.git_dir, blob_sha=entry.hexsha)
+
+
+class MirrorFile(object):
+    """
+    A file of a mirror repository. It is resolved while holding the repository and
+    read after releasing it: small blobs are read with the lookup, the larger blobs
+    are streamed from a `git cat-file` process and the LFS objects from their file.
+    """
+
+    def __init__(
+        self,
+        size: int,
+        headers: Dict[str, str],
+        data: Optional[bytes] = None,
+        git_dir: Optional[str] = None,
+        blob_sha: Optional[str] = None,
+        lfs_path: Optional[str] = None,
+    ) -> None:
+        self.size = size
+        self.headers = headers
+        self.data = data
+        self.git_dir = git_dir
+        self.blob_sha = blob_sha
+        self.lfs_path = lfs_path
+
+
+class MirrorPage(object):
+    """
+    A page of a listing of a mirror repository. `commit` is the listed commit, so that
+    the next pages list the same commit even if its branch moves meanwhile.
+    `next_position` is where the next page starts, if any: the offset of the next commit
+    in a history, or the last listed path in a tree.
+    """
+
+    def __init__(
+        self,
+        commit: str,
+        items: List[Dict[str, Any]],
+        next_position: Optional[Union[int, str]],
+    ) -> None:
+        self.commit = commit
+        self.items = items
+        self.next_position = next_position
+
+
+class MirrorRepoRegistry(object):
+    """
+    The mirror repositories opened by the process, kept open across requests so that
+    they reuse the GitPython handle, its `git cat-file` processes and the memoized
+    lookups. Beyond `capacity`, the least recently used repositories are closed.
+
+    A repository whose refs changed since it was opened, e.g. by a fetch into the
+    mirror, is opened again, so that branches resolve to their new commits. The
+    snapshots of its commits are kept, to derive the snapshots of the new commits.
+    """
+
+    def __init__(self, capacity: int = MIRROR_REPO_CACHE_SIZE) -> None:
+        self.capacity = capacity
+        self._repos: "OrderedDict[str, LocalMirrorRepo]" = OrderedDict()
+        self._snapshots: Dict[str, SnapshotStore] = {}
+        self._lock = threading.Lock()
+
+    def get(self, path: str, repo_type: str, org: str, repo: str) -> LocalMirrorRepo:
+        key = os.path.abspath(path)
+        with self._lock:
+            local_repo = self._repos.get(key, None)
+            if local_repo is not None:
+                self._repos.move_to_end(key)
+            snapshots = self._snapshots.get(key, None)
+        if snapshots is None:
+            snapshots = SnapshotStore(MIRROR_SNAPSHOT_CACHE_SIZE)
+        if local_repo is not None:
+            if local_repo.refs_signature == get_refs_signature(local_repo.git_dir):
+                return local_repo
+            self._discard(key, local_repo)
+
+        local_repo = LocalMirrorRepo(path, repo_type, org, repo, snapshots=snapshots)
+        evicted: List[LocalMirrorRepo] = []
+        with self._lock:
+            replaced = self._repos.pop(key, None)
+            if replaced is not None:
+                evicted.append(replaced)
+            self._repos[key] = local_repo
+            self._snapshots[key] = snapshots
+            while len(self._repos) > self.capacity:
+                evicted_key, evicted_repo = self._repos.popitem(last=False)
+                self._snapshots.pop(evicted_key, None)
+                evicted.append(evicted_repo)
+        for each_repo in evicted:
+            self._close(each_repo)
+        return local_repo
+
+    def _discard(self, key: str, local_repo: LocalMirrorRepo) -> None:
+        with self._lock:
+            if self._repos.get(key, None) is local_repo:
+                del self._repos[key]
             else:
-                return stream_wrapper(commit.tree[path].data_stream.read())
+                return
+        self._close(local_repo)
+
+    def _close(self, local_repo: LocalMirrorRepo) -> None:
+        # Waits for the requests using the repository
+        with local_repo.lock:
+            local_repo.close()
+
+    def clear(self) -> None:
+        with self._lock:
+            repos = list(self._repos.values())
+            self._repos.clear()
+            self._snapshots.clear()
+        for local_repo in repos:
+            self._close(local_repo)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._repos)
+
+
+MIRROR_REPO_REGISTRY = MirrorRepoRegistry()
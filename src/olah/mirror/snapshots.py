@@ -0,0 +1,192 @@
+# coding=utf-8
+# Copyright 2024 XiaHan
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+"""
+Snapshots of the commits of mirror repositories: what the routers serve for a commit,
+computed once per commit sha.
+
+A commit never changes, so its snapshot never goes stale. When the refs move to a
+descendant of a commit with a snapshot, e.g. after a fetch into the mirror, the new
+snapshot is derived from the old one with a diff of their trees instead of being
+built from scratch.
+"""
+
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# The mode of the tree entries, and of the submodules, which are not indexed
+TREE_MODE = 0o040000
+GITLINK_MODE = 0o160000
+
+BINSHA_SIZE = 20
+
+# path -> (binsha, mode) of every blob and tree of a commit
+TreeIndex = Dict[str, Tuple[bytes, int]]
+
+
+class RepoSnapshot(object):
+    """
+    The metadata of a commit of a mirror repository.
+
+    It is kept compact: the tree index holds the sha and the mode of each path
+    instead of GitPython objects, the history is the concatenation of the binary
+    shas of the commits, and the metadata is stored as the JSON sent to clients.
+    """
+
+    __slots__ = ["commit", "tree_index", "commit_shas", "created", "readme", "meta_json"]
+
+    def __init__(
+        self,
+        commit: str,
+        tree_index: TreeIndex,
+        commit_shas: bytes,
+        created: Tuple[int, str],
+        readme: Tuple[Optional[bytes], str, Any],
+        meta_json: bytes,
+    ) -> None:
+        self.commit = commit
+        self.tree_index = tree_index
+        # The history of the commit, in the order of `git rev-list`
+        self.commit_shas = commit_shas
+        # The timestamp and the sha of the earliest commit of the history
+        self.created = created
+        # The blob sha, the description and the card data of the README
+        self.readme = readme
+        self.meta_json = meta_json
+
+    @property
+    def commit_count(self) -> int:
+        return len(self.commit_shas) // BINSHA_SIZE
+
+    def iter_commit_shas(self, start: int, end: int) -> Iterator[str]:
+        for i in range(start, min(end, self.commit_count)):
+            yield self.commit_shas[i * BINSHA_SIZE:(i + 1) * BINSHA_SIZE].hex()
+
+    def get_file_paths(self) -> List[str]:
+        """
+        Returns the paths of the files, in the order of a depth-first walk of the
+        trees: git sorts the entries of a tree like their paths.
+        """
+        return sorted(
+            path for path, (_, mode) in self.tree_index.items() if mode != TREE_MODE
+        )
+
+
+def parse_ls_tree(output: bytes) -> TreeIndex:
+    """
+    Parses the output of `git ls-tree -r -t -z`.
+    """
+    tree_index: TreeIndex = {}
+    for line in output.split(b"\0"):
+        if len(line) == 0:
+            continue
+        info, path = line.split(b"\t", 1)
+        mode, _, sha = info.split(b" ")
+        mode = int(mode, 8)
+        if mode == GITLINK_MODE:
+            continue
+        tree_index[path.decode("utf-8")] = (bytes.fromhex(sha.decode("ascii")), mode)
+    return tree_index
+
+
+def apply_diff_tree(tree_index: TreeIndex, output: bytes) -> TreeIndex:
+    """
+    Returns a copy of `tree_index` with the changes in the output of
+    `git diff-tree -r -t -z --no-renames` applied.
+    """
+    tokens = output.split(b"\0")
+    changes = []
+    for i in range(0, len(tokens) - 1, 2):
+        info, path = tokens[i], tokens[i + 1]
+        if not info.startswith(b":"):
+            continue
+        _, new_mode, _, new_sha, status = info[1:].split(b" ")
+        changes.append((status, path.decode("utf-8"), int(new_mode, 8), new_sha))
+
+    tree_index = dict(tree_index)
+    # A path can be deleted as a file and added as a directory in the same diff
+    for status, path, _, _ in changes:
+        if status == b"D":
+            tree_index.pop(path, None)
+    for status, path, mode, sha in changes:
+        if status == b"D":
+            continue
+        if mode == GITLINK_MODE:
+            tree_index.pop(path, None)
+        else:
+            tree_index[path] = (bytes.fromhex(sha.decode("ascii")), mode)
+    return tree_index
+
+
+class SnapshotStore(object):
+    """
+    The snapshots of the most recently used commits of a repository. The store
+    outlives the handles of the repository, which are opened again when its refs
+    move, so that the new snapshots can be derived from the previous ones.
+
+    A snapshot is built once: the requests asking for a snapshot being built wait for
+    the future of the build.
+    """
+
+    def __init__(self, capacity: int) -> None:
+        self.capacity = capacity
+        self._snapshots: "OrderedDict[str, RepoSnapshot]" = OrderedDict()
+        self._builds: Dict[str, "Future[RepoSnapshot]"] = {}
+        self._lock = threading.Lock()
+
+    def get(self, commit: str) -> Optional[RepoSnapshot]:
+        with self._lock:
+            snapshot = self._snapshots.get(commit, None)
+            if snapshot is not None:
+                self._snapshots.move_to_end(commit)
+            return snapshot
+
+    def _put(self, snapshot: RepoSnapshot) -> None:
+        self._snapshots[snapshot.commit] = snapshot
+        self._snapshots.move_to_end(snapshot.commit)
+        while len(self._snapshots) > self.capacity:
+            self._snapshots.popitem(last=False)
+
+    def claim_build(self, commit: str) -> "Optional[Future[RepoSnapshot]]":
+        """
+        Returns a future of the snapshot of `commit` if it is stored or being built.
+        Otherwise the caller becomes its builder, which must call `finish_build`, and
+        None is returned.
+        """
+        with self._lock:
+            snapshot = self._snapshots.get(commit, None)
+            if snapshot is not None:
+                self._snapshots.move_to_end(commit)
+                future: "Future[RepoSnapshot]" = Future()
+                future.set_result(snapshot)
+                return future
+            future = self._builds.get(commit, None)
+            if future is not None:
+                return future
+            self._builds[commit] = Future()
+            return None
+
+    def finish_build(
+        self,
+        commit: str,
+        snapshot: Optional[RepoSnapshot],
+        error: Optional[BaseException] = None,
+    ) -> None:
+        with self._lock:
+            future = self._builds.pop(commit)
+            if snapshot is not None:
+                self._put(snapshot)
+        if snapshot is not None:
+            future.set_result(snapshot)
+        else:
+            future.set_exception(error)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._snapshots)
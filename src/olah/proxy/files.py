@@ -9,7 +9,8 @@ import hashlib
 import json
 import os
 import logging
-from typing import Dict, List, Literal, Optional, Tuple
+import time
+from typing import AsyncIterator, Callable, Dict, List, Literal, Optional, Set, Tuple
 from fastapi import Request
 import httpx
 from urllib.parse import urlparse, urljoin
@@ -21,33 +22,58 @@ from olah.constants import (
     HUGGINGFACE_HEADER_X_LINKED_ETAG,
     HUGGINGFACE_HEADER_X_LINKED_SIZE,
     ORIGINAL_LOC,
+    REPO_TYPES_MAPPING,
 )
+from olah.cache.index import CacheAccessIndex
+from olah.cache.ledger import CacheSizeLedger
 from olah.cache.olah_cache import OlahCache
+from olah.cache.tiers import TieredCache
+from olah.cache.uploader import S3BlockUploader
+from olah.cluster.membership import ClusterMembership
 from olah.errors import error_entry_not_found, error_proxy_invalid_data, error_proxy_timeout
+from olah.metrics.collectors import (
+    DOWNLOADS_IN_FLIGHT,
+    UPSTREAM_REQUESTS,
+    UPSTREAM_REQUESTS_IN_FLIGHT,
+)
 from olah.proxy.pathsinfo import pathsinfo_generator
+from olah.utils.access_log import AccessLog, RequestTrace
 from olah.utils.cache_utils import read_cache_request, write_cache_request
-from olah.utils.disk_utils import touch_file_access_time
 from olah.utils.url_utils import (
     RemoteInfo,
     add_query_param,
     check_url_has_param_name,
     get_all_ranges,
+    get_ssl_context,
     get_url_param_name,
     get_url_tail,
     parse_range_params,
     remove_query_param,
 )
 from olah.utils.repo_utils import get_org_repo
-from olah.utils.rule_utils import check_cache_rules_hf
-from olah.utils.file_utils import make_dirs
+from olah.utils.rule_utils import (
+    check_cache_admission_hf,
+    check_cache_rules_hf,
+    check_proxy_rules_hf,
+)
+from olah.utils.executors import FS_EXECUTOR, run_in_executor, submit
+from olah.utils.file_utils import make_dirs_async
 from olah.constants import CHUNK_SIZE, LFS_FILE_BLOCK, WORKER_API_TIMEOUT
 from olah.utils.zip_utils import Decompressor, decompress_data
 from olah.utils.s3_client import S3Client
+from olah.utils.worker_utils import BlockFetchLocks
 
 
 logger = logging.getLogger(__name__)
 
 
+def get_s3_object_key(repo_type: str, org_repo: str, commit: str, file_path: str) -> str:
+    # Older releases stored the files of models at "{org_repo}/{file_path}". Those
+    # objects are not looked up: the revision they hold is unknown, so they may be
+    # stale. See the s3 section of the README to delete them.
+    return f"{repo_type}/{org_repo}/resolve/{commit}/{file_path}"
+
+
 def get_block_info(pos: int, block_size: int, file_size: int) -> Tuple[int, int, int]:
     cur_block = pos // block_size
     block_start_pos = cur_block * block_size
@@ -90,7 +116,11 @@ def get_contiguous_ranges(
 
 
 async def _get_file_range_from_cache(
-    cache_file: OlahCache, start_pos: int, end_pos: int
+    cache_file: OlahCache,
+    start_pos: int,
+    end_pos: int,
+    tiers: Optional[TieredCache] = None,
+    trace: Optional[RequestTrace] = None,
 ):
     start_block = start_pos // cache_file._get_block_size()
     end_block = (end_pos - 1) // cache_file._get_block_size()
@@ -99,14 +129,31 @@ async def _get_file_range_from_cache(
         _, block_start_pos, block_end_pos = get_block_info(
             cur_pos, cache_file._get_block_size(), cache_file._get_file_size()
         )
-        if not cache_file.has_block(cur_block):
-            raise Exception("Unknown exception: read block which has not been cached.")
-        raw_block = await cache_file.read_block(cur_block)
+        raw_block = None
+        tier = "disk"
+        if tiers is not None and tiers.memory is not None:
+            raw_block = tiers.memory.get(cache_file.path, cur_block)
+        if raw_block is not None:
+            tier = "memory"
+            tiers.record_hit("memory", len(raw_block))
+        else:
+            read_start = time.perf_counter()
+            raw_block = await cache_file.read_block(cur_block)
+            if trace is not None:
+                trace.add_time("cache_read", time.perf_counter() - read_start)
+            if raw_block is None:
+                raise Exception("The cached block has been evicted while reading.")
+            if tiers is not None:
+                tiers.record_hit("disk", len(raw_block))
+                if tiers.memory is not None:
+                    tiers.memory.put(cache_file.path, cur_block, raw_block)
         chunk = raw_block[
             max(start_pos, block_start_pos)
             - block_start_pos : min(end_pos, block_end_pos)
             - block_start_pos
         ]
+        if trace is not None:
+            trace.record_bytes(tier, len(chunk))
         yield chunk
         cur_pos += len(chunk)
 
@@ -114,12 +161,158 @@ async def _get_file_range_from_cache(
         raise Exception("The cache range from {} to {} is incomplete.")
 
 
+async def _get_file_range_from_s3(
+    s3_client: S3Client,
+    s3_key: str,
+    start_pos: int,
+    end_pos: int,
+):
+    chunk_bytes = 0
+    async for chunk in s3_client.get_object(s3_key, start_pos, end_pos):
+        yield chunk
+        chunk_bytes += len(chunk)
+
+    if end_pos - start_pos != chunk_bytes:
+        raise Exception(
+            f"The content of the S3 object is incomplete. Key: {s3_key}. Start-end: {start_pos}-{end_pos}. Expected-{end_pos - start_pos}. Accepted-{chunk_bytes}"
+        )
+
+
+async def _get_file_range_from_peers(
+    cluster: ClusterMembership,
+    tiers: Optional[TieredCache],
+    cache_key: str,
+    cache_file: OlahCache,
+    start_pos: int,
+    end_pos: int,
+    fallback: Callable[[int, int], AsyncIterator[bytes]],
+    trace: Optional[RequestTrace] = None,
+    read_through: bool = False,
+    authorization: Optional[str] = None,
+):
+    """
+    Streams a range block by block from the peers owning the blocks. The blocks this
+    node owns, and those the owner cannot provide, are read from `fallback` in
+    contiguous ranges. With `read_through`, the owners fetch and cache their missing
+    blocks, so that each block is fetched upstream once per cluster.
+    """
+    block_size = cache_file._get_block_size()
+    file_size = cache_file._get_file_size()
+    start_block = start_pos // block_size
+    end_block = (end_pos - 1) // block_size
+    fallback_start_pos: Optional[int] = None
+    for cur_block in range(start_block, end_block + 1):
+        _, block_start_pos, block_end_pos = get_block_info(
+            cur_block * block_size, block_size, file_size
+        )
+        segment_start_pos = max(start_pos, block_start_pos)
+        segment_end_pos = min(end_pos, block_end_pos)
+
+        block_bytes = None
+        peer = cluster.owner(cache_key, cur_block)
+        if peer is not None:
+            block_bytes = await cluster.fetch_block(
+                peer,
+                cache_key,
+                cur_block,
+                file_size,
+                block_end_pos - block_start_pos,
+                read_through=read_through,
+                authorization=authorization,
+            )
+        if block_bytes is None:
+            if fallback_start_pos is None:
+                fallback_start_pos = segment_start_pos
+            continue
+
+        if fallback_start_pos is not None:
+            async for chunk in fallback(fallback_start_pos, segment_start_pos):
+                yield chunk
+            fallback_start_pos = None
+        if tiers is not None:
+            tiers.record_hit("peer", segment_end_pos - segment_start_pos)
+        if trace is not None:
+            trace.record_bytes("peer", segment_end_pos - segment_start_pos)
+        yield block_bytes[
+            segment_start_pos - block_start_pos : segment_end_pos - block_start_pos
+        ]
+
+    if fallback_start_pos is not None:
+        async for chunk in fallback(fallback_start_pos, end_pos):
+            yield chunk
+
+
+async def _get_file_range_coordinated(
+    fetch_locks: BlockFetchLocks,
+    held_blocks: Set[int],
+    tiers: Optional[TieredCache],
+    cache_path: str,
+    cache_file: OlahCache,
+    start_pos: int,
+    end_pos: int,
+    fetch: Callable[[int, int], AsyncIterator[bytes]],
+    trace: Optional[RequestTrace] = None,
+):
+    """
+    Streams a missing range, fetching each block only once across the requests and
+    worker processes sharing the cache. Only the blocks the range covers in full are
+    cached, so only those are locked: the fetch locks of the fetched blocks are added
+    to `held_blocks`, and stay held until the blocks are written to the cache. Blocks
+    written by another request in the meantime are read from the cache. The partial
+    blocks at the ends of the range are fetched without a lock, so that they do not
+    wait for, or hold up, the requests caching them.
+    """
+    block_size = cache_file._get_block_size()
+    file_size = cache_file._get_file_size()
+
+    def is_covered(block_index: int) -> bool:
+        return (
+            block_index * block_size >= start_pos
+            and min((block_index + 1) * block_size, file_size) <= end_pos
+        )
+
+    cur_pos = start_pos
+    while cur_pos < end_pos:
+        cur_block = cur_pos // block_size
+        covered = is_covered(cur_block)
+        if covered:
+            await fetch_locks.acquire(cache_path, cur_block)
+        if await run_in_executor(FS_EXECUTOR, cache_file.has_block, cur_block):
+            if covered:
+                fetch_locks.release(cache_path, cur_block)
+            segment_end_pos = min(end_pos, (cur_block + 1) * block_size)
+            async for chunk in _get_file_range_from_cache(
+                cache_file, cur_pos, segment_end_pos, tiers=tiers, trace=trace
+            ):
+                yield chunk
+            cur_pos = segment_end_pos
+            continue
+
+        # Extend the fetch over the following blocks nobody else is fetching
+        if covered:
+            held_blocks.add(cur_block)
+        next_block = cur_block + 1
+        while next_block * block_size < end_pos and not await run_in_executor(
+            FS_EXECUTOR, cache_file.has_block, next_block
+        ):
+            if is_covered(next_block):
+                if not await fetch_locks.acquire(cache_path, next_block, wait=False):
+                    break
+                held_blocks.add(next_block)
+            next_block += 1
+        segment_end_pos = min(end_pos, next_block * block_size)
+        async for chunk in fetch(cur_pos, segment_end_pos):
+            yield chunk
+        cur_pos = segment_end_pos
+
+
 async def _get_file_range_from_remote(
     client: httpx.AsyncClient,
     remote_info: RemoteInfo,
     cache_file: OlahCache,
     start_pos: int,
     end_pos: int,
+    trace: Optional[RequestTrace] = None,
 ):
     headers = {}
     if remote_info.headers.get("authorization", None) is not None:
@@ -128,37 +321,52 @@ async def _get_file_range_from_remote(
 
     chunk_bytes = 0
     decompressor: Optional[Decompressor] = None
-    async with client.stream(
-        method=remote_info.method,
-        url=remote_info.url,
-        headers=headers,
-        timeout=WORKER_API_TIMEOUT,
-        follow_redirects=True,
-    ) as response:
-        status_code = response.status_code
-    
-        if status_code == 429:
-            raise Exception("Too many requests in a given amount of time.")
-        
-        is_compressed = "content-encoding" in response.headers
-        if is_compressed:
-            decompressor = Decompressor(response.headers["content-encoding"].split(","))
-        
-        async for raw_chunk in response.aiter_raw():
-            if not raw_chunk:
-                continue
-            if is_compressed and decompressor is not None:
-                real_chunk = decompressor.decompress(raw_chunk)
-                yield real_chunk
-                chunk_bytes += len(real_chunk)
-            else:
-                yield raw_chunk
-                chunk_bytes += len(raw_chunk)
+    request_start = time.perf_counter()
+    if trace is not None:
+        trace.upstream_calls += 1
+    UPSTREAM_REQUESTS_IN_FLIGHT.inc()
+    try:
+        async with client.stream(
+            method=remote_info.method,
+            url=remote_info.url,
+            headers=headers,
+            timeout=WORKER_API_TIMEOUT,
+            follow_redirects=True,
+        ) as response:
+            status_code = response.status_code
+            UPSTREAM_REQUESTS.inc(status=str(status_code))
 
-        if is_compressed:
-            response_content_length = chunk_bytes
-        else:
-            response_content_length = int(response.headers["content-length"])
+            if status_code == 429:
+                raise Exception("Too many requests in a given amount of time.")
+
+            is_compressed = "content-encoding" in response.headers
+            if is_compressed:
+                decompressor = Decompressor(response.headers["content-encoding"].split(","))
+
+            async for raw_chunk in response.aiter_raw():
+                if not raw_chunk:
+                    continue
+                if trace is not None and request_start is not None:
+                    trace.add_time("upstream_ttfb", time.perf_counter() - request_start)
+                    request_start = None
+                if is_compressed and decompressor is not None:
+                    if trace is not None:
+                        with trace.timer("decompress"):
+                            real_chunk = decompressor.decompress(raw_chunk)
+                    else:
+                        real_chunk = decompressor.decompress(raw_chunk)
+                    yield real_chunk
+                    chunk_bytes += len(real_chunk)
+                else:
+                    yield raw_chunk
+                    chunk_bytes += len(raw_chunk)
+
+            if is_compressed:
+                response_content_length = chunk_bytes
+            else:
+                response_content_length = int(response.headers["content-length"])
+    finally:
+        UPSTREAM_REQUESTS_IN_FLIGHT.dec()
 
     # Post check
     if end_pos - start_pos != response_content_length:
@@ -167,6 +375,19 @@ async def _get_file_range_from_remote(
         )
 
 
+def _open_cache_file(
+    save_path: str,
+    file_size: int,
+    ledger: Optional[CacheSizeLedger],
+    index: Optional[CacheAccessIndex],
+) -> OlahCache:
+    if os.path.exists(save_path):
+        return OlahCache(save_path, ledger=ledger, index=index)
+    cache_file = OlahCache.create(save_path, ledger=ledger, index=index)
+    cache_file.resize(file_size=file_size)
+    return cache_file
+
+
 async def _file_chunk_get(
     app,
     save_path: str,
@@ -177,42 +398,122 @@ async def _file_chunk_get(
     headers: Dict[str, str],
     allow_cache: bool,
     file_size: int,
-    s3_client: Optional[S3Client] = None,
     s3_key: Optional[str] = None,
+    trace: Optional[RequestTrace] = None,
+    use_peers: bool = True,
 ):
     # Redirect Chunks
-    if os.path.exists(save_path):
-        cache_file = OlahCache(save_path)
-    else:
-        cache_file = OlahCache.create(save_path)
-        cache_file.resize(file_size=file_size)
-    
-    # Refresh access time
-    touch_file_access_time(save_path)
-    
+    ledger = getattr(app.state, "cache_ledger", None)
+    index = getattr(app.state, "cache_index", None)
+    tiers: Optional[TieredCache] = getattr(app.state, "cache_tiers", None)
+    uploader: Optional[S3BlockUploader] = getattr(app.state, "s3_uploader", None)
+    cluster: Optional[ClusterMembership] = getattr(app.state, "cluster", None)
+    fetch_locks: Optional[BlockFetchLocks] = getattr(app.state, "fetch_locks", None)
+    held_blocks: Set[int] = set()
+    cache_key = os.path.relpath(
+        save_path, os.path.join(app.state.app_settings.config.repos_path, "files")
+    ).replace(os.sep, "/")
+    cache_file = await run_in_executor(
+        FS_EXECUTOR, _open_cache_file, save_path, file_size, ledger, index
+    )
+
+    upload_to_s3 = uploader is not None and s3_key is not None and allow_cache
+    if upload_to_s3 and tiers is not None and await tiers.s3_has_object(s3_key, file_size):
+        upload_to_s3 = False
+
+    async def persist_block(block_index: int, block: bytes) -> None:
+        try:
+            if not allow_cache or await run_in_executor(
+                FS_EXECUTOR, cache_file.has_block, block_index
+            ):
+                return
+            await cache_file.write_block(block_index, block)
+        finally:
+            if block_index in held_blocks:
+                held_blocks.discard(block_index)
+                fetch_locks.release(save_path, block_index)
+        if upload_to_s3:
+            await uploader.submit_block(s3_key, cache_file, block_index, block)
+
+    DOWNLOADS_IN_FLIGHT.inc()
     try:
         unit, ranges, suffix = parse_range_params(headers.get("range", f"bytes={0}-{file_size-1}"))
         all_ranges = get_all_ranges(file_size, unit, ranges, suffix)
 
-        full_file_requested = len(all_ranges) == 1 and all_ranges[0][0] == 0 and all_ranges[0][1] == file_size
         for start_pos, end_pos in all_ranges:
-            ranges_and_cache_list = get_contiguous_ranges(cache_file, start_pos, end_pos)
+            ranges_and_cache_list = await run_in_executor(
+                FS_EXECUTOR, get_contiguous_ranges, cache_file, start_pos, end_pos
+            )
             # Stream ranges
             for (range_start_pos, range_end_pos), is_remote in ranges_and_cache_list:
                 # range_start_pos is zero-index and range_end_pos is exclusive
                 if is_remote:
-                    generator = _get_file_range_from_remote(
-                        client,
-                        RemoteInfo(method, url, headers),
-                        cache_file,
-                        range_start_pos,
-                        range_end_pos,
+                    from_s3 = (
+                        tiers is not None
+                        and tiers.s3_read_through
+                        and s3_key is not None
+                        and await tiers.s3_has_object(s3_key, file_size)
                     )
+
+                    def remote_generator(remote_start_pos: int, remote_end_pos: int):
+                        if from_s3:
+                            source_tier = "s3"
+                            remote = _get_file_range_from_s3(
+                                tiers.s3_client, s3_key, remote_start_pos, remote_end_pos
+                            )
+                        else:
+                            source_tier = "upstream"
+                            remote = _get_file_range_from_remote(
+                                client,
+                                RemoteInfo(method, url, headers),
+                                cache_file,
+                                remote_start_pos,
+                                remote_end_pos,
+                                trace=trace,
+                            )
+                        if tiers is not None:
+                            tiers.record_hit(source_tier, remote_end_pos - remote_start_pos)
+                        if trace is not None:
+                            trace.record_bytes(source_tier, remote_end_pos - remote_start_pos)
+                        return remote
+
+                    def fetch_generator(fetch_start_pos: int, fetch_end_pos: int):
+                        if cluster is not None and use_peers:
+                            return _get_file_range_from_peers(
+                                cluster,
+                                tiers,
+                                cache_key,
+                                cache_file,
+                                fetch_start_pos,
+                                fetch_end_pos,
+                                remote_generator,
+                                trace=trace,
+                                read_through=allow_cache,
+                                authorization=headers.get("authorization", None),
+                            )
+                        return remote_generator(fetch_start_pos, fetch_end_pos)
+
+                    if fetch_locks is not None and allow_cache:
+                        generator = _get_file_range_coordinated(
+                            fetch_locks,
+                            held_blocks,
+                            tiers,
+                            save_path,
+                            cache_file,
+                            range_start_pos,
+                            range_end_pos,
+                            fetch_generator,
+                            trace=trace,
+                        )
+                    else:
+                        generator = fetch_generator(range_start_pos, range_end_pos)
                 else:
                     generator = _get_file_range_from_cache(
                         cache_file,
                         range_start_pos,
                         range_end_pos,
+                        tiers=tiers,
+                        trace=trace,
                     )
 
                 cur_pos = range_start_pos
@@ -222,8 +523,17 @@ async def _file_chunk_get(
                 )
                 async for chunk in generator:
                     if len(chunk) != 0:
-                        yield bytes(chunk)
-                        stream_cache += chunk
+                        if trace is not None:
+                            # Time until the client side asks for the next chunk
+                            send_start = time.perf_counter()
+                            yield bytes(chunk)
+                            trace.add_time("send", time.perf_counter() - send_start)
+                            trace.bytes_sent += len(chunk)
+                        else:
+                            yield bytes(chunk)
+                        if is_remote:
+                            # Only the fetched blocks are written to the cache
+                            stream_cache += chunk
                         cur_pos += len(chunk)
 
                     cur_block = cur_pos // cache_file._get_block_size()
@@ -236,14 +546,13 @@ async def _file_chunk_get(
                     raw_block = stream_cache[:split_pos]
                     stream_cache = stream_cache[split_pos:]
                     if len(raw_block) == cache_file._get_block_size():
-                        if not cache_file.has_block(last_block) and allow_cache:
-                            await cache_file.write_block(last_block, raw_block)
+                        await persist_block(last_block, raw_block)
                     last_block, last_block_start_pos, last_block_end_pos = get_block_info(
                         cur_pos, cache_file._get_block_size(), cache_file._get_file_size()
                     )
 
                 raw_block = stream_cache
-                if cur_block == cache_file._get_block_number() - 1:
+                if is_remote and cur_block == cache_file._get_block_number() - 1:
                     if (
                         len(raw_block)
                         == cache_file._get_file_size() % cache_file._get_block_size()
@@ -253,8 +562,11 @@ async def _file_chunk_get(
                         )
                     last_block = cur_block
                 if len(raw_block) == cache_file._get_block_size():
-                    if not cache_file.has_block(last_block) and allow_cache:
-                        await cache_file.write_block(last_block, raw_block)
+                    await persist_block(last_block, raw_block)
+
+                if len(held_blocks) != 0:
+                    # The blocks which could not be written, e.g. on a short read
+                    fetch_locks.release_all(save_path, held_blocks)
 
                 if cur_pos != range_end_pos:
                     if is_remote:
@@ -266,13 +578,87 @@ async def _file_chunk_get(
                             f"The size of cached range ({range_end_pos - range_start_pos}) is different from sent size ({cur_pos - range_start_pos})."
                         )
     finally:
-        cache_file.close()
+        DOWNLOADS_IN_FLIGHT.dec()
+        if len(held_blocks) != 0:
+            fetch_locks.release_all(save_path, held_blocks)
+        # Not awaited, so that the header is flushed even if the request is cancelled
+        submit(FS_EXECUTOR, cache_file.close)
 
-    if s3_client is not None and s3_key is not None and full_file_requested:
-        try:
-            await s3_client.upload_file(s3_key, save_path)
-        except Exception as exc:  # pragma: no cover - best effort logging
-            logger.warning("Failed to upload %s to S3: %s", s3_key, exc)
+    if upload_to_s3:
+        # Blocks cached before this request are uploaded in the background
+        uploader.schedule_fill_missing_blocks(s3_key, save_path)
+
+
+async def read_block_through(
+    app,
+    cache_key: str,
+    block_index: int,
+    file_size: int,
+    authorization: Optional[str] = None,
+) -> Optional[bytes]:
+    """
+    Reads a block of a resolved file for a peer of the cluster, fetching it from S3 or
+    the upstream site and caching it on a miss. The other peers are never asked, so
+    that requests cannot loop between nodes with different views of the ring.
+
+    Returns:
+        Optional[bytes]: The block without padding, or None if it cannot be fetched.
+    """
+    config = app.state.app_settings.config
+    repo_type, _, repo_path = cache_key.partition("/")
+    org_repo, sep, _ = repo_path.partition("/resolve/")
+    if config.offline or repo_type not in REPO_TYPES_MAPPING or len(sep) == 0:
+        return None
+    org, _, repo = org_repo.rpartition("/")
+    org = org if len(org) != 0 else None
+    if not await check_proxy_rules_hf(app, repo_type, org, repo):
+        return None
+    if not await check_cache_rules_hf(app, repo_type, org, repo):
+        return None
+
+    save_path = os.path.join(config.repos_path, "files", cache_key)
+    await make_dirs_async(save_path)
+    cache_file = await run_in_executor(
+        FS_EXECUTOR,
+        _open_cache_file,
+        save_path,
+        file_size,
+        getattr(app.state, "cache_ledger", None),
+        getattr(app.state, "cache_index", None),
+    )
+    block_size = cache_file._get_block_size()
+    cached_file_size = cache_file._get_file_size()
+    await run_in_executor(FS_EXECUTOR, cache_file.close)
+    start_pos = block_index * block_size
+    end_pos = min(start_pos + block_size, file_size)
+    if cached_file_size != file_size or start_pos >= end_pos:
+        return None
+    url_path = repo_path if repo_type == "models" else cache_key
+    headers = {"range": f"bytes={start_pos}-{end_pos - 1}"}
+    if authorization is not None:
+        headers["authorization"] = authorization
+    chunks = []
+    try:
+        async with httpx.AsyncClient(verify=get_ssl_context()) as client:
+            async for chunk in _file_chunk_get(
+                app=app,
+                save_path=save_path,
+                head_path=os.path.join(config.repos_path, "heads", cache_key),
+                client=client,
+                method="GET",
+                url=urljoin(config.hf_url_base(), f"/{url_path}"),
+                headers=headers,
+                allow_cache=True,
+                file_size=file_size,
+                # The object keys of resolved files are their cache keys
+                s3_key=cache_key,
+                use_peers=False,
+            ):
+                chunks.append(chunk)
+    except Exception as e:
+        logger.warning("Failed to read block %d of %s for a peer: %s", block_index, cache_key, e)
+        return None
+    return b"".join(chunks)
 
 
 async def _file_chunk_head(
@@ -313,7 +699,7 @@ async def _resource_etag(hf_url: str, authorization: Optional[str]=None, offline
         if authorization is not None:
             etag_headers["authorization"] = authorization
         try:
-            async with httpx.AsyncClient() as client:
+            async with httpx.AsyncClient(verify=get_ssl_context()) as client:
                 response = await client.request(
                     method="head",
                     url=hf_url,
@@ -343,6 +729,7 @@ async def _file_realtime_stream(
     commit: Optional[str] = None,
     s3_client: Optional[S3Client] = None,
     s3_key: Optional[str] = None,
+    trace: Optional[RequestTrace] = None,
 ):
     if check_url_has_param_name(url, ORIGINAL_LOC):
         clean_url = remove_query_param(url, ORIGINAL_LOC)
@@ -383,9 +770,12 @@ async def _file_realtime_stream(
         method="post",
         authorization=request.headers.get("authorization", None),
     )
+    pathsinfo_start = time.perf_counter()
     status_code = await generator.__anext__()
     headers = await generator.__anext__()
     content = await generator.__anext__()
+    if trace is not None:
+        trace.add_time("pathsinfo", time.perf_counter() - pathsinfo_start)
     try:
         pathsinfo = json.loads(content)
     except json.JSONDecodeError:
@@ -422,7 +812,45 @@ async def _file_realtime_stream(
     # Create content-length
     unit, ranges, suffix = parse_range_params(request_headers.get("range", f"bytes={0}-{file_size-1}"))
     all_ranges = get_all_ranges(file_size, unit, ranges, suffix)
+
+    if allow_cache and method.lower() == "get":
+        # One-off pulls are still streamed, just not persisted. The chunks of a
+        # download after the first one are not counted as new requests.
+        range_start = all_ranges[0][0] if len(all_ranges) > 0 else 0
+        allow_cache = await check_cache_admission_hf(
+            app, repo_type, org, repo, save_path, file_size, range_start
+        )
+    if trace is not None:
+        trace.file_size = file_size
+        trace.ranges = all_ranges
     
+    tiers: Optional[TieredCache] = getattr(app.state, "cache_tiers", None)
+    if (
+        method.lower() == "get"
+        and app.state.app_settings.config.s3_redirect
+        and tiers is not None
+        and tiers.s3_client is not None
+        and s3_key is not None
+        and await tiers.s3_has_object(s3_key, file_size)
+    ):
+        # Let the object store serve the bytes, the client follows the redirect
+        # with its range header
+        tiers.record_hit("s3", sum(r[1] - r[0] for r in all_ranges))
+        if trace is not None:
+            trace.record_bytes("s3", sum(r[1] - r[0] for r in all_ranges))
+        redirect_headers = {
+            "location": tiers.s3_client.get_presigned_url(
+                s3_key, expires=app.state.app_settings.config.s3_redirect_expires
+            ),
+            "content-length": "0",
+        }
+        if commit is not None:
+            redirect_headers[HUGGINGFACE_HEADER_X_REPO_COMMIT.lower()] = commit
+        yield 302
+        yield redirect_headers
+        yield b""
+        return
+
     response_headers["content-length"] = str(sum(r[1] - r[0] for r in all_ranges))
     if suffix is not None:
         response_headers["content-range"] = f"bytes -{suffix}/{file_size}"
@@ -432,11 +860,14 @@ async def _file_realtime_stream(
     if commit is not None:
         response_headers[HUGGINGFACE_HEADER_X_REPO_COMMIT.lower()] = commit
     # Create fake headers when offline mode
+    etag_start = time.perf_counter()
     etag = await _resource_etag(
         hf_url=hf_url,
         authorization=request.headers.get("authorization", None),
         offline=app.state.app_settings.config.offline,
     )
+    if trace is not None:
+        trace.add_time("etag", time.perf_counter() - etag_start)
     response_headers["etag"] = etag
     
     if etag is None:
@@ -449,7 +880,7 @@ async def _file_realtime_stream(
         yield 200
         yield response_headers
 
-    async with httpx.AsyncClient() as client:
+    async with httpx.AsyncClient(verify=get_ssl_context()) as client:
         if method.lower() == "get":
             async for each_chunk in _file_chunk_get(
                 app=app,
@@ -461,8 +892,8 @@ async def _file_realtime_stream(
                 headers=request_headers,
                 allow_cache=allow_cache,
                 file_size=file_size,
-                s3_client=s3_client,
                 s3_key=s3_key,
+                trace=trace,
             ):
                 yield each_chunk
         elif method.lower() == "head":
@@ -482,6 +913,19 @@ async def _file_realtime_stream(
             raise Exception(f"Unsupported method: {method}")
 
 
+async def _traced_stream(access_log: AccessLog, trace: RequestTrace, stream):
+    """
+    Passes the stream through and writes the trace once it is finished or closed.
+    """
+    try:
+        trace.status = await stream.__anext__()
+        yield trace.status
+        async for item in stream:
+            yield item
+    finally:
+        access_log.write(trace)
+
+
 async def file_get_generator(
     app,
     repo_type: Literal["models", "datasets", "spaces"],
@@ -491,6 +935,7 @@ async def file_get_generator(
     file_path: str,
     method: Literal["HEAD", "GET"],
     request: Request,
+    trace: Optional[RequestTrace] = None,
 ):
     org_repo = get_org_repo(org, repo)
     # save
@@ -501,8 +946,7 @@ async def file_get_generator(
     save_path = os.path.join(
         repos_path, f"files/{repo_type}/{org_repo}/resolve/{commit}/{file_path}"
     )
-    make_dirs(head_path)
-    make_dirs(save_path)
+    await make_dirs_async(head_path, save_path)
 
     # use_cache = os.path.exists(head_path) and os.path.exists(save_path)
     allow_cache = await check_cache_rules_hf(app, repo_type, org, repo)
@@ -513,16 +957,15 @@ async def file_get_generator(
             app.state.app_settings.config.hf_url_base(),
             f"/{org_repo}/resolve/{commit}/{file_path}",
         )
-        s3_client: Optional[S3Client] = getattr(app.state, "s3_client", None)
-        s3_key = f"{org_repo}/{file_path}"
     else:
         url = urljoin(
             app.state.app_settings.config.hf_url_base(),
             f"/{repo_type}/{org_repo}/resolve/{commit}/{file_path}",
         )
-        s3_client = None
-        s3_key = None
-    return _file_realtime_stream(
+    s3_client: Optional[S3Client] = getattr(app.state, "s3_client", None)
+    # The commit is part of the key, so objects in the bucket are immutable
+    s3_key = get_s3_object_key(repo_type, org_repo, commit, file_path)
+    stream = _file_realtime_stream(
         app=app,
         repo_type=repo_type,
         org=org,
@@ -537,7 +980,12 @@ async def file_get_generator(
         commit=commit,
         s3_client=s3_client,
         s3_key=s3_key,
+        trace=trace,
     )
+    access_log: Optional[AccessLog] = getattr(app.state, "access_log", None)
+    if trace is not None and access_log is not None:
+        stream = _traced_stream(access_log, trace, stream)
+    return stream
 
 
 async def cdn_file_get_generator(
@@ -548,6 +996,7 @@ async def cdn_file_get_generator(
     file_hash: str,
     method: Literal["HEAD", "GET"],
     request: Request,
+    trace: Optional[RequestTrace] = None,
 ):
     headers = {k: v for k, v in request.headers.items()}
     headers.pop("host")
@@ -561,8 +1010,7 @@ async def cdn_file_get_generator(
     save_path = os.path.join(
         repos_path, f"files/{repo_type}/{org_repo}/cdn/{file_hash}"
     )
-    make_dirs(head_path)
-    make_dirs(save_path)
+    await make_dirs_async(head_path, save_path)
 
     # use_cache = os.path.exists(head_path) and os.path.exists(save_path)
     allow_cache = await check_cache_rules_hf(app, repo_type, org, repo)
@@ -574,7 +1022,7 @@ async def cdn_file_get_generator(
     # else:
     #     redirected_url = urljoin(app.state.app_settings.config.mirror_url_base(), get_url_tail(request_url))
 
-    return _file_realtime_stream(
+    stream = _file_realtime_stream(
         app=app,
         save_path=save_path,
         head_path=head_path,
@@ -582,4 +1030,9 @@ async def cdn_file_get_generator(
         request=request,
         method=method,
         allow_cache=allow_cache,
+        trace=trace,
     )
+    access_log: Optional[AccessLog] = getattr(app.state, "access_log", None)
+    if trace is not None and access_log is not None:
+        stream = _traced_stream(access_log, trace, stream)
+    return stream
@@ -10,7 +10,7 @@ from typing import Literal
 from fastapi import FastAPI, Header, Request
 
 from olah.proxy.files import _file_realtime_stream
-from olah.utils.file_utils import make_dirs
+from olah.utils.file_utils import make_dirs_async
 
 
 async def lfs_head_generator(
@@ -24,8 +24,7 @@ async def lfs_head_generator(
     save_path = os.path.join(
         repos_path, f"lfs/files/{dir1}/{dir2}/{hash_repo}/{hash_file}"
     )
-    make_dirs(head_path)
-    make_dirs(save_path)
+    await make_dirs_async(head_path, save_path)
 
     # use_cache = os.path.exists(head_path) and os.path.exists(save_path)
     allow_cache = True
@@ -54,8 +53,7 @@ async def lfs_get_generator(
     save_path = os.path.join(
         repos_path, f"lfs/files/{dir1}/{dir2}/{hash_repo}/{hash_file}"
     )
-    make_dirs(head_path)
-    make_dirs(save_path)
+    await make_dirs_async(head_path, save_path)
 
     # use_cache = os.path.exists(head_path) and os.path.exists(save_path)
     allow_cache = True
@@ -18,7 +18,8 @@ from olah.constants import CHUNK_SIZE, WORKER_API_TIMEOUT
 from olah.utils.cache_utils import read_cache_request, write_cache_request
 from olah.utils.rule_utils import check_cache_rules_hf
 from olah.utils.repo_utils import get_org_repo
-from olah.utils.file_utils import make_dirs
+from olah.utils.file_utils import make_dirs_async, path_exists
+from olah.utils.url_utils import get_ssl_context
 
 async def _meta_cache_generator(save_path: str) -> AsyncGenerator[Union[int, Dict[str, str], bytes], None]:
     cache_rq = await read_cache_request(save_path)
@@ -34,7 +35,7 @@ async def _meta_proxy_generator(
     allow_cache: bool,
     save_path: str,
 ) -> AsyncGenerator[Union[int, Dict[str, str], bytes], None]:
-    async with httpx.AsyncClient(follow_redirects=True) as client:
+    async with httpx.AsyncClient(follow_redirects=True, verify=get_ssl_context()) as client:
         content_chunks = []
         async with client.stream(
             method=method,
@@ -83,9 +84,9 @@ async def meta_generator(
         repos_path, f"api/{repo_type}/{org_repo}/revision/{commit}"
     )
     save_path = os.path.join(save_dir, f"meta_{method}.json")
-    make_dirs(save_path)
+    await make_dirs_async(save_path)
 
-    use_cache = os.path.exists(save_path)
+    use_cache = await path_exists(save_path)
     allow_cache = await check_cache_rules_hf(app, repo_type, org, repo)
 
     org_repo = get_org_repo(org, repo)
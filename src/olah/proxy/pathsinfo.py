@@ -17,7 +17,8 @@ from olah.constants import CHUNK_SIZE, WORKER_API_TIMEOUT
 from olah.utils.cache_utils import read_cache_request, write_cache_request
 from olah.utils.rule_utils import check_cache_rules_hf
 from olah.utils.repo_utils import get_org_repo
-from olah.utils.file_utils import make_dirs
+from olah.utils.file_utils import make_dirs_async, path_exists
+from olah.utils.url_utils import get_ssl_context
 
 
 async def _pathsinfo_cache(save_path: str) -> Tuple[int, Dict[str, str], bytes]:
@@ -37,7 +38,7 @@ async def _pathsinfo_proxy(
     headers = {k: v for k, v in headers.items()}
     if "content-length" in headers:
         headers.pop("content-length")
-    async with httpx.AsyncClient(follow_redirects=True) as client:
+    async with httpx.AsyncClient(follow_redirects=True, verify=get_ssl_context()) as client:
         response = await client.request(
             method=method,
             url=pathsinfo_url,
@@ -47,7 +48,7 @@ async def _pathsinfo_proxy(
         )
 
         if allow_cache and response.status_code == 200:
-            make_dirs(save_path)
+            await make_dirs_async(save_path)
             await write_cache_request(
                 save_path,
                 response.status_code,
@@ -84,7 +85,7 @@ async def pathsinfo_generator(
 
         save_path = os.path.join(save_dir, f"paths-info_{method}.json")
 
-        use_cache = os.path.exists(save_path)
+        use_cache = await path_exists(save_path)
         allow_cache = await check_cache_rules_hf(app, repo_type, org, repo)
 
         org_repo = get_org_repo(org, repo)
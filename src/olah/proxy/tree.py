@@ -16,7 +16,8 @@ from olah.constants import CHUNK_SIZE, WORKER_API_TIMEOUT
 from olah.utils.cache_utils import read_cache_request, write_cache_request
 from olah.utils.rule_utils import check_cache_rules_hf
 from olah.utils.repo_utils import get_org_repo
-from olah.utils.file_utils import make_dirs
+from olah.utils.file_utils import make_dirs_async, path_exists
+from olah.utils.url_utils import get_ssl_context
 
 
 async def _tree_cache_generator(save_path: str) -> AsyncGenerator[Union[int, Dict[str, str], bytes], None]:
@@ -34,7 +35,7 @@ async def _tree_proxy_generator(
     allow_cache: bool,
     save_path: str,
 ) -> AsyncGenerator[Union[int, Dict[str, str], bytes], None]:
-    async with httpx.AsyncClient(follow_redirects=True) as client:
+    async with httpx.AsyncClient(follow_redirects=True, verify=get_ssl_context()) as client:
         content_chunks = []
         async with client.stream(
             method=method,
@@ -59,7 +60,7 @@ async def _tree_proxy_generator(
             content += chunk
 
         if allow_cache and response_status_code == 200:
-            make_dirs(save_path)
+            await make_dirs_async(save_path)
             await write_cache_request(
                 save_path, response_status_code, response_headers, bytes(content)
             )
@@ -90,7 +91,7 @@ async def tree_generator(
     )
     save_path = os.path.join(save_dir, f"tree_{method}_recursive_{recursive}_expand_{expand}.json")
 
-    use_cache = os.path.exists(save_path)
+    use_cache = await path_exists(save_path)
     allow_cache = await check_cache_rules_hf(app, repo_type, org, repo)
 
     org_repo = get_org_repo(org, repo)
@@ -21,11 +21,18 @@ from olah.router.files import router as files_router
 from olah.router.lfs import router as lfs_router
 from olah.router.pages import router as pages_router
 from olah.router.auth import router as auth_router
+from olah.router.cluster import router as cluster_router
+from olah.router.metrics import router as metrics_router
+from olah.router.debug import router as debug_router
 
 # Main router that includes all sub-routers
 router = APIRouter()
 
 # Include all sub-routers
+# The fixed internal paths go first, the file routes would match them otherwise
+router.include_router(metrics_router)
+router.include_router(cluster_router)
+router.include_router(debug_router)
 router.include_router(meta_router)
 router.include_router(tree_router)
 router.include_router(pathsinfo_router)
@@ -11,6 +11,8 @@ import httpx
 from fastapi import APIRouter, Request
 from fastapi.responses import Response
 
+from olah.utils.url_utils import get_ssl_context
+
 router = APIRouter()
 
 
@@ -22,7 +24,7 @@ async def whoami_v2(request: Request):
     app = request.app
     new_headers = {k.lower(): v for k, v in request.headers.items()}
     new_headers["host"] = app.state.app_settings.config.hf_netloc
-    async with httpx.AsyncClient() as client:
+    async with httpx.AsyncClient(verify=get_ssl_context()) as client:
         response = await client.request(
             method="GET",
             url=urljoin(app.state.app_settings.config.hf_url_base(), "/api/whoami-v2"),
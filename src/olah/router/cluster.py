@@ -0,0 +1,142 @@
+# coding=utf-8
+# Copyright 2024 XiaHan
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+import os
+from typing import Optional, Tuple
+
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse, Response
+
+from olah.cache.index import CacheAccessIndex
+from olah.cache.ledger import CacheSizeLedger
+from olah.cache.olah_cache import OlahCache
+from olah.cluster.membership import (
+    CLUSTER_BLOCK_DIGEST_HEADER,
+    CLUSTER_FILE_SIZE_HEADER,
+    CLUSTER_SECRET_HEADER,
+    ClusterMembership,
+)
+from olah.proxy.files import read_block_through
+from olah.utils.executors import FS_EXECUTOR, run_in_executor
+
+router = APIRouter()
+
+
+async def _get_cluster(request: Request) -> Optional[ClusterMembership]:
+    cluster: Optional[ClusterMembership] = getattr(request.app.state, "cluster", None)
+    if cluster is None:
+        return None
+    client_host = request.client.host if request.client is not None else None
+    if not await cluster.check_caller(request.headers.get(CLUSTER_SECRET_HEADER, None), client_host):
+        return None
+    return cluster
+
+
+@router.get("/internal/cluster/members")
+async def cluster_members(request: Request):
+    cluster = await _get_cluster(request)
+    if cluster is None:
+        return Response(status_code=404)
+    return JSONResponse({"node": cluster.node_url, "members": cluster.members})
+
+
+@router.post("/internal/cluster/members")
+async def cluster_gossip(request: Request):
+    cluster = await _get_cluster(request)
+    if cluster is None:
+        return Response(status_code=404)
+    body = await request.json()
+    # Only the allowed peers are added
+    cluster.merge(body.get("members", []))
+    if "node" in body and cluster.is_allowed(body["node"]):
+        cluster.mark_up(body["node"])
+    return JSONResponse({"node": cluster.node_url, "members": cluster.members})
+
+
+def _open_cache_file(
+    cache_path: str,
+    ledger: Optional[CacheSizeLedger],
+    index: Optional[CacheAccessIndex],
+) -> Optional[OlahCache]:
+    if not os.path.isdir(cache_path):
+        return None
+    try:
+        return OlahCache(cache_path, ledger=ledger, index=index)
+    except Exception:
+        return None
+
+
+async def _read_local_block(app, cache_path: str, block: int) -> Optional[Tuple[bytes, int]]:
+    cache_file = await run_in_executor(
+        FS_EXECUTOR,
+        _open_cache_file,
+        cache_path,
+        getattr(app.state, "cache_ledger", None),
+        getattr(app.state, "cache_index", None),
+    )
+    if cache_file is None:
+        return None
+    try:
+        if block < 0 or block >= cache_file._get_block_number():
+            return None
+        raw_block = await cache_file.read_block(block)
+        if raw_block is None:
+            return None
+        block_size = cache_file._get_block_size()
+        file_size = cache_file._get_file_size()
+    finally:
+        await run_in_executor(FS_EXECUTOR, cache_file.close)
+    block_length = min(block_size, file_size - block * block_size)
+    return bytes(raw_block[:block_length]), file_size
+
+
+@router.get("/internal/cluster/block")
+async def cluster_block(key: str, block: int, request: Request, size: Optional[int] = None):
+    """
+    Serves one block of the cache to a peer. When the peer sends the file `size`, a
+    missing block is fetched from S3 or the upstream site with the authorization of
+    the peer, and cached, so that each block is downloaded once per cluster. A miss
+    is never forwarded to another peer, so requests cannot loop between nodes.
+    """
+    app = request.app
+    cluster = await _get_cluster(request)
+    if cluster is None:
+        return Response(status_code=404)
+
+    files_path = os.path.abspath(os.path.join(app.state.app_settings.config.repos_path, "files"))
+    cache_path = os.path.abspath(os.path.join(files_path, key))
+    if not cache_path.startswith(files_path + os.sep) or block < 0:
+        return Response(status_code=404)
+
+    local_block = await _read_local_block(app, cache_path, block)
+    if local_block is not None:
+        content, file_size = local_block
+    elif size is not None and size > 0:
+        file_size = size
+        content = await read_block_through(
+            app,
+            os.path.relpath(cache_path, files_path).replace(os.sep, "/"),
+            block,
+            file_size,
+            authorization=request.headers.get("authorization", None),
+        )
+        if content is None:
+            return Response(status_code=404)
+    else:
+        return Response(status_code=404)
+
+    headers = {CLUSTER_FILE_SIZE_HEADER: str(file_size)}
+    digest = await run_in_executor(
+        FS_EXECUTOR, cluster.block_digest, key, block, file_size, content
+    )
+    if digest is not None:
+        headers[CLUSTER_BLOCK_DIGEST_HEADER] = digest
+    return Response(
+        content=content,
+        media_type="application/octet-stream",
+        headers=headers,
+    )
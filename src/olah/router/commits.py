@@ -5,20 +5,24 @@
 # license that can be found in the LICENSE file or at
 # https://opensource.org/licenses/MIT.
 
+import logging
 import os
 import traceback
 from typing import Optional
 
-import git
 import httpx
 from fastapi import APIRouter, Request
-from fastapi.responses import StreamingResponse, Response, JSONResponse
+from fastapi.responses import StreamingResponse, Response
 
-from olah.constants import REPO_TYPES_MAPPING
-from olah.errors import error_repo_not_found, error_page_not_found, error_revision_not_found
-from olah.mirror.repos import LocalMirrorRepo
+from olah.constants import MIRROR_COMMITS_PAGE_SIZE, REPO_TYPES_MAPPING
+from olah.errors import (
+    error_invalid_cursor,
+    error_repo_not_found,
+    error_page_not_found,
+    error_revision_not_found,
+)
 from olah.proxy.commits import commits_generator
-from olah.utils.logging import build_logger
+from olah.utils.mirror_utils import decode_cursor, mirror_page_response, query_mirrors
 from olah.utils.repo_utils import (
     check_commit_hf,
     get_commit_hf,
@@ -26,7 +30,7 @@ from olah.utils.repo_utils import (
 )
 from olah.utils.rule_utils import check_proxy_rules_hf
 
-logger = build_logger("olah.router.commits", "olah_router_commits.log")
+logger = logging.getLogger("olah.router.commits")
 
 router = APIRouter()
 
@@ -38,7 +42,10 @@ async def commits_proxy_common(
     repo: str,
     commit: str,
     method: str,
-    authorization: Optional[str]
+    authorization: Optional[str],
+    request: Request,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
 ) -> Response:
     # FIXME: do not show the private repos to other user besides owner, even though the repo was cached
     if repo_type not in REPO_TYPES_MAPPING.keys():
@@ -46,18 +53,24 @@ async def commits_proxy_common(
     if not await check_proxy_rules_hf(app, repo_type, org, repo):
         return error_repo_not_found()
     # Check Mirror Path
-    for mirror_path in app.state.app_settings.config.mirrors_path:
+    mirror_commit, offset = commit, 0
+    if cursor is not None:
         try:
-            git_path = os.path.join(mirror_path, repo_type, org or '', repo)
-            if os.path.exists(git_path):
-                local_repo = LocalMirrorRepo(git_path, repo_type, org, repo)
-                commits_data = local_repo.get_commits(commit)
-                if commits_data is None:
-                    continue
-                return JSONResponse(content=commits_data)
-        except git.exc.InvalidGitRepositoryError:
-            logger.warning(f"Local repository {git_path} is not a valid git reposity.")
-            continue
+            mirror_commit, offset = decode_cursor(cursor)
+        except ValueError:
+            return error_invalid_cursor()
+    page_size = MIRROR_COMMITS_PAGE_SIZE
+    if limit is not None:
+        page_size = max(1, min(limit, page_size))
+    commits_page = await query_mirrors(
+        app,
+        repo_type,
+        org,
+        repo,
+        lambda local_repo: local_repo.get_commits_page(mirror_commit, offset, page_size),
+    )
+    if commits_page is not None:
+        return mirror_page_response(app, request, commits_page)
 
     # Proxy the HF File Commits
     try:
@@ -121,7 +134,13 @@ async def commits_proxy_common(
 @router.head("/api/{repo_type}/{org}/{repo}/commits/{commit}")
 @router.get("/api/{repo_type}/{org}/{repo}/commits/{commit}")
 async def commits_proxy_commit2(
-    repo_type: str, org: str, repo: str, commit: str, request: Request
+    repo_type: str,
+    org: str,
+    repo: str,
+    commit: str,
+    request: Request,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
 ):
     app = request.app
     return await commits_proxy_common(
@@ -132,13 +151,21 @@ async def commits_proxy_commit2(
         commit=commit,
         method=request.method.lower(),
         authorization=request.headers.get("authorization", None),
+        request=request,
+        cursor=cursor,
+        limit=limit,
     )
 
 
 @router.head("/api/{repo_type}/{org_repo}/commits/{commit}")
 @router.get("/api/{repo_type}/{org_repo}/commits/{commit}")
 async def commits_proxy_commit(
-    repo_type: str, org_repo: str, commit: str, request: Request
+    repo_type: str,
+    org_repo: str,
+    commit: str,
+    request: Request,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
 ):
     app = request.app
     org, repo = parse_org_repo(org_repo)
@@ -153,4 +180,7 @@ async def commits_proxy_commit(
         commit=commit,
         method=request.method.lower(),
         authorization=request.headers.get("authorization", None),
+        request=request,
+        cursor=cursor,
+        limit=limit,
     )
@@ -0,0 +1,95 @@
+# coding=utf-8
+# Copyright 2024 XiaHan
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+import asyncio
+import marshal
+import threading
+
+from fastapi import APIRouter, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
+
+from olah.utils.profiling import dump_tasks, format_stats, profile_loop, sample_stacks
+
+router = APIRouter()
+
+DEBUG_SECRET_HEADER = "x-olah-debug-secret"
+LOOPBACK_HOSTS = ["127.0.0.1", "::1", "localhost"]
+
+
+def _check_admin(request: Request) -> bool:
+    """
+    The debug endpoints are served when enabled, to the holders of the secret, or to
+    local clients when no secret is set.
+    """
+    debug = request.app.state.app_settings.config.debug
+    if not debug.enable:
+        return False
+    if debug.secret is not None:
+        return request.headers.get(DEBUG_SECRET_HEADER, None) == debug.secret
+    return request.client is not None and request.client.host in LOOPBACK_HOSTS
+
+
+@router.get("/internal/debug/profile")
+async def debug_profile(
+    request: Request,
+    seconds: float = 10,
+    mode: str = "cprofile",
+    format: str = "text",
+    sort: str = "cumulative",
+    limit: int = 50,
+):
+    """
+    Profiles the event loop for `seconds`.
+
+    `mode=cprofile` returns the cProfile statistics, as text or, with `format=pstats`,
+    as a file for `pstats`, snakeviz or gprof2dot. `mode=sample` samples the stack of
+    the loop thread and returns collapsed stacks for flamegraph.pl or speedscope.
+    """
+    if not _check_admin(request):
+        return Response(status_code=404)
+    if mode not in ["cprofile", "sample"] or format not in ["text", "pstats"]:
+        return Response(status_code=400)
+    session = request.app.state.profiling_session
+    if not session.try_start():
+        return PlainTextResponse("A profiling session is already running.", status_code=409)
+    try:
+        if mode == "sample":
+            # Sampled from a worker thread while the loop keeps serving
+            content = await run_in_threadpool(sample_stacks, threading.get_ident(), seconds)
+            return PlainTextResponse(content)
+        stats = await profile_loop(seconds, sort=sort)
+    finally:
+        session.finish()
+    if format == "pstats":
+        return Response(
+            content=marshal.dumps(stats.stats),
+            media_type="application/octet-stream",
+            headers={"content-disposition": 'attachment; filename="olah.pstats"'},
+        )
+    return PlainTextResponse(format_stats(stats, limit=limit))
+
+
+@router.get("/internal/debug/tasks")
+async def debug_tasks(request: Request):
+    if not _check_admin(request):
+        return Response(status_code=404)
+    return PlainTextResponse(dump_tasks())
+
+
+@router.get("/internal/debug/loop")
+async def debug_loop(request: Request):
+    if not _check_admin(request):
+        return Response(status_code=404)
+    loop = asyncio.get_running_loop()
+    monitor = getattr(request.app.state, "loop_lag_monitor", None)
+    return JSONResponse({
+        "lag": monitor.stats() if monitor is not None else None,
+        "debug": loop.get_debug(),
+        "slow_callback_duration": loop.slow_callback_duration,
+        "tasks": len(asyncio.all_tasks()),
+    })
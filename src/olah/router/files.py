@@ -5,11 +5,12 @@
 # license that can be found in the LICENSE file or at
 # https://opensource.org/licenses/MIT.
 
+import logging
 import os
+import time
 import traceback
 from typing import List, Optional, Tuple
 
-import git
 import httpx
 import aiofiles
 from fastapi import APIRouter, Request
@@ -17,18 +18,20 @@ from fastapi.responses import StreamingResponse, Response
 
 from olah.constants import CHUNK_SIZE, HUGGINGFACE_HEADER_X_REPO_COMMIT, REPO_TYPES_MAPPING
 from olah.errors import error_repo_not_found, error_page_not_found
-from olah.mirror.repos import LocalMirrorRepo
 from olah.proxy.files import cdn_file_get_generator, file_get_generator
-from olah.utils.logging import build_logger
+from olah.utils.access_log import AccessLog, RequestTrace
+from olah.utils.executors import FS_EXECUTOR, run_in_executor
+from olah.utils.mirror_utils import query_mirrors, stream_mirror_file
 from olah.utils.repo_utils import (
     check_commit_hf,
     get_commit_hf,
+    get_org_repo,
     parse_org_repo,
 )
 from olah.utils.rule_utils import check_proxy_rules_hf
 from olah.utils.url_utils import get_all_ranges, parse_range_params
 
-logger = build_logger("olah.router.files", "olah_router_files.log")
+logger = logging.getLogger("olah.router.files")
 
 router = APIRouter()
 
@@ -82,6 +85,62 @@ async def _model_bin_stream_response(path: str, ranges: List[Tuple[int, int]]):
                 yield chunk
 
 
+def _mirror_file_response(mirror_file, request_range: Optional[str]) -> Response:
+    headers = dict(mirror_file.headers)
+    headers["accept-ranges"] = "bytes"
+    file_size = mirror_file.size
+    all_ranges = [(0, file_size)]
+    status_code = 200
+    if request_range:
+        try:
+            unit, ranges, suffix = parse_range_params(request_range)
+        except ValueError:
+            # An invalid Range header is ignored
+            unit = None
+        if unit == "bytes":
+            requested = [
+                (max(0, start), end)
+                for start, end in get_all_ranges(file_size, unit, ranges, suffix)
+                if end > max(0, start)
+            ]
+            if len(requested) == 0:
+                return Response(
+                    status_code=416, headers={"content-range": f"bytes */{file_size}"}
+                )
+            # Several ranges would need a multipart response, the whole file is sent instead
+            if len(requested) == 1:
+                all_ranges = requested
+                status_code = 206
+                headers["content-range"] = (
+                    f"bytes {requested[0][0]}-{requested[0][1] - 1}/{file_size}"
+                )
+    start, end = all_ranges[0]
+    headers["content-length"] = str(end - start)
+    return StreamingResponse(
+        stream_mirror_file(mirror_file, start, end),
+        headers=headers,
+        status_code=status_code,
+    )
+
+
+def _start_trace(
+    app,
+    method: str,
+    repo_type: str,
+    org: Optional[str],
+    repo: str,
+    file_path: str,
+    revision: Optional[str] = None,
+) -> Optional[RequestTrace]:
+    access_log: Optional[AccessLog] = getattr(app.state, "access_log", None)
+    if access_log is None:
+        return None
+    org_repo = get_org_repo(org, repo)
+    if repo_type != "models":
+        org_repo = f"{repo_type}/{org_repo}"
+    return access_log.start_trace(method, org_repo, file_path, revision=revision)
+
+
 # ======================
 # File Head Hooks
 # ======================
@@ -100,31 +159,32 @@ async def file_head_common(
         return error_repo_not_found()
 
     # Check Mirror Path
-    for mirror_path in app.state.app_settings.config.mirrors_path:
-        git_path = os.path.join(mirror_path, repo_type, org, repo)
-        try:
-            git_path = os.path.join(mirror_path, repo_type, org or '', repo)
-            if os.path.exists(git_path):
-                local_repo = LocalMirrorRepo(git_path, repo_type, org, repo)
-                head = local_repo.get_file_head(commit_hash=commit, path=file_path)
-                if head is None:
-                    continue
-                return Response(headers=head)
-        except git.exc.InvalidGitRepositoryError:
-            logger.warning(f"Local repository {git_path} is not a valid git reposity.")
-            continue
+    head = await query_mirrors(
+        app,
+        repo_type,
+        org,
+        repo,
+        lambda local_repo: local_repo.get_file_head(commit_hash=commit, path=file_path),
+    )
+    if head is not None:
+        return Response(headers=head)
 
     if (
         repo_type == "models"
         and app.state.app_settings.config.model_bin_enable
         and app.state.app_settings.config.model_bin_path is not None
     ):
-        local_path = _get_model_bin_file_path(
-            app.state.app_settings.config.model_bin_path, org, repo, file_path
+        local_path = await run_in_executor(
+            FS_EXECUTOR,
+            _get_model_bin_file_path,
+            app.state.app_settings.config.model_bin_path,
+            org,
+            repo,
+            file_path,
         )
         if local_path:
-            headers, _ = _model_bin_headers(
-                local_path, request.headers.get("range"), commit
+            headers, _ = await run_in_executor(
+                FS_EXECUTOR, _model_bin_headers, local_path, request.headers.get("range"), commit
             )
             return Response(headers=headers)
 
@@ -263,37 +323,41 @@ async def file_get_common(
     if not await check_proxy_rules_hf(app, repo_type, org, repo):
         return error_repo_not_found()
     # Check Mirror Path
-    for mirror_path in app.state.app_settings.config.mirrors_path:
-        try:
-            git_path = os.path.join(mirror_path, repo_type, org or '', repo)
-            if os.path.exists(git_path):
-                local_repo = LocalMirrorRepo(git_path, repo_type, org, repo)
-                content_stream = local_repo.get_file(commit_hash=commit, path=file_path)
-                if content_stream is None:
-                    continue
-                return StreamingResponse(content_stream)
-        except git.exc.InvalidGitRepositoryError:
-            logger.warning(f"Local repository {git_path} is not a valid git reposity.")
-            continue
+    mirror_file = await query_mirrors(
+        app,
+        repo_type,
+        org,
+        repo,
+        lambda local_repo: local_repo.get_file(commit_hash=commit, path=file_path),
+    )
+    if mirror_file is not None:
+        return _mirror_file_response(mirror_file, request.headers.get("range", None))
 
     if (
         repo_type == "models"
         and app.state.app_settings.config.model_bin_enable
         and app.state.app_settings.config.model_bin_path is not None
     ):
-        local_path = _get_model_bin_file_path(
-            app.state.app_settings.config.model_bin_path, org, repo, file_path
+        local_path = await run_in_executor(
+            FS_EXECUTOR,
+            _get_model_bin_file_path,
+            app.state.app_settings.config.model_bin_path,
+            org,
+            repo,
+            file_path,
         )
         if local_path:
-            headers, ranges = _model_bin_headers(
-                local_path, request.headers.get("range"), commit
+            headers, ranges = await run_in_executor(
+                FS_EXECUTOR, _model_bin_headers, local_path, request.headers.get("range"), commit
             )
             return StreamingResponse(
                 _model_bin_stream_response(local_path, ranges),
                 headers=headers,
                 status_code=200,
             )
+    trace = _start_trace(app, "GET", repo_type, org, repo, file_path, commit)
     try:
+        revision_start = time.perf_counter()
         if not app.state.app_settings.config.offline and not await check_commit_hf(
             app,
             repo_type,
@@ -313,6 +377,9 @@ async def file_get_common(
         )
         if commit_sha is None:
             return error_repo_not_found()
+        if trace is not None:
+            trace.add_time("revision", time.perf_counter() - revision_start)
+            trace.revision = commit_sha
         generator = await file_get_generator(
             app,
             repo_type,
@@ -322,6 +389,7 @@ async def file_get_common(
             file_path=file_path,
             method="GET",
             request=request,
+            trace=trace,
         )
         status_code = await generator.__anext__()
         headers = await generator.__anext__()
@@ -404,8 +472,9 @@ async def cdn_file_get(
     if not await check_proxy_rules_hf(app, repo_type, org, repo):
         return error_repo_not_found()
     try:
+        trace = _start_trace(app, "GET", repo_type, org, repo, hash_file)
         generator = await cdn_file_get_generator(
-            app, repo_type, org, repo, hash_file, method="GET", request=request
+            app, repo_type, org, repo, hash_file, method="GET", request=request, trace=trace
         )
         status_code = await generator.__anext__()
         headers = await generator.__anext__()
@@ -5,20 +5,19 @@
 # license that can be found in the LICENSE file or at
 # https://opensource.org/licenses/MIT.
 
+import logging
 import os
 import traceback
 from typing import Literal, Optional
 
-import git
 import httpx
 from fastapi import APIRouter, Request
-from fastapi.responses import StreamingResponse, Response, JSONResponse
+from fastapi.responses import StreamingResponse, Response
 
 from olah.constants import REPO_TYPES_MAPPING
 from olah.errors import error_repo_not_found, error_page_not_found, error_revision_not_found
-from olah.mirror.repos import LocalMirrorRepo
 from olah.proxy.meta import meta_generator
-from olah.utils.logging import build_logger
+from olah.utils.mirror_utils import query_mirrors
 from olah.utils.repo_utils import (
     check_commit_hf,
     get_commit_hf,
@@ -27,7 +26,7 @@ from olah.utils.repo_utils import (
 )
 from olah.utils.rule_utils import check_proxy_rules_hf
 
-logger = build_logger("olah.router.meta", "olah_router_meta.log")
+logger = logging.getLogger("olah.router.meta")
 
 router = APIRouter()
 
@@ -47,19 +46,11 @@ async def meta_proxy_common(
     if not await check_proxy_rules_hf(app, repo_type, org, repo):
         return error_repo_not_found()
     # Check Mirror Path
-    for mirror_path in app.state.app_settings.config.mirrors_path:
-        git_path = os.path.join(mirror_path, repo_type, org, repo)
-        try:
-            git_path = os.path.join(mirror_path, repo_type, org or '', repo)
-            if os.path.exists(git_path):
-                local_repo = LocalMirrorRepo(git_path, repo_type, org, repo)
-                meta_data = local_repo.get_meta(commit)
-                if meta_data is None:
-                    continue
-                return JSONResponse(content=meta_data)
-        except git.exc.InvalidGitRepositoryError:
-            logger.warning(f"Local repository {git_path} is not a valid git reposity.")
-            continue
+    meta_json = await query_mirrors(
+        app, repo_type, org, repo, lambda local_repo: local_repo.get_meta_json(commit)
+    )
+    if meta_json is not None:
+        return Response(content=meta_json, media_type="application/json")
 
     # Proxy the HF File Meta
     try:
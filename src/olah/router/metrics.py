@@ -0,0 +1,24 @@
+# coding=utf-8
+# Copyright 2024 XiaHan
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+from fastapi import APIRouter, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import Response
+
+router = APIRouter()
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+@router.get("/metrics")
+async def metrics(request: Request):
+    registry = getattr(request.app.state, "metrics", None)
+    if registry is None:
+        return Response(status_code=404)
+    # The collectors take the locks shared with the worker threads
+    content = await run_in_threadpool(registry.render)
+    return Response(content=content, media_type=PROMETHEUS_CONTENT_TYPE)
@@ -5,26 +5,30 @@
 # license that can be found in the LICENSE file or at
 # https://opensource.org/licenses/MIT.
 
+import functools
 import glob
 import os
 
 from fastapi import APIRouter, Request
 from fastapi.responses import HTMLResponse
-from fastapi.templating import Jinja2Templates
 
 from olah.constants import OLAH_CODE_DIR
 from olah.utils.rule_utils import get_org_repo
 
 router = APIRouter()
 
-# Templates
-templates = Jinja2Templates(directory=os.path.join(OLAH_CODE_DIR, "static"))
+@functools.lru_cache(maxsize=None)
+def get_templates():
+    # Jinja2 is only loaded when a page is rendered
+    from fastapi.templating import Jinja2Templates
+
+    return Jinja2Templates(directory=os.path.join(OLAH_CODE_DIR, "static"))
 
 
 @router.get("/", response_class=HTMLResponse)
 async def index(request: Request):
     app = request.app
-    return templates.TemplateResponse(
+    return get_templates().TemplateResponse(
         "index.html",
         {
             "request": request,
@@ -44,7 +48,7 @@ async def repos(request: Request):
     models_repos = [get_org_repo(*repo.split("/")[-2:]) for repo in models_repos]
     spaces_repos = [get_org_repo(*repo.split("/")[-2:]) for repo in spaces_repos]
 
-    return templates.TemplateResponse(
+    return get_templates().TemplateResponse(
         "repos.html",
         {
             "request": request,
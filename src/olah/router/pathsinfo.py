@@ -5,20 +5,19 @@
 # license that can be found in the LICENSE file or at
 # https://opensource.org/licenses/MIT.
 
+import logging
 import os
 import traceback
 from typing import Annotated, List, Optional
 
-import git
 import httpx
 from fastapi import APIRouter, Request, Form
 from fastapi.responses import StreamingResponse, Response, JSONResponse
 
 from olah.constants import REPO_TYPES_MAPPING
 from olah.errors import error_repo_not_found, error_page_not_found, error_revision_not_found
-from olah.mirror.repos import LocalMirrorRepo
 from olah.proxy.pathsinfo import pathsinfo_generator
-from olah.utils.logging import build_logger
+from olah.utils.mirror_utils import query_mirrors
 from olah.utils.repo_utils import (
     check_commit_hf,
     get_commit_hf,
@@ -27,7 +26,7 @@ from olah.utils.repo_utils import (
 from olah.utils.rule_utils import check_proxy_rules_hf
 from olah.utils.url_utils import clean_path
 
-logger = build_logger("olah.router.pathsinfo", "olah_router_pathsinfo.log")
+logger = logging.getLogger("olah.router.pathsinfo")
 
 router = APIRouter()
 
@@ -50,19 +49,11 @@ async def pathsinfo_proxy_common(
     if not await check_proxy_rules_hf(app, repo_type, org, repo):
         return error_repo_not_found()
     # Check Mirror Path
-    for mirror_path in app.state.app_settings.config.mirrors_path:
-        git_path = os.path.join(mirror_path, repo_type, org, repo)
-        try:
-            git_path = os.path.join(mirror_path, repo_type, org or '', repo)
-            if os.path.exists(git_path):
-                local_repo = LocalMirrorRepo(git_path, repo_type, org, repo)
-                pathsinfo_data = local_repo.get_pathinfos(commit, paths)
-                if pathsinfo_data is None:
-                    continue
-                return JSONResponse(content=pathsinfo_data)
-        except git.exc.InvalidGitRepositoryError:
-            logger.warning(f"Local repository {git_path} is not a valid git reposity.")
-            continue
+    pathsinfo_data = await query_mirrors(
+        app, repo_type, org, repo, lambda local_repo: local_repo.get_pathinfos(commit, paths)
+    )
+    if pathsinfo_data is not None:
+        return JSONResponse(content=pathsinfo_data)
 
     # Proxy the HF File pathsinfo
     try:
@@ -5,20 +5,24 @@
 # license that can be found in the LICENSE file or at
 # https://opensource.org/licenses/MIT.
 
+import logging
 import os
 import traceback
 from typing import Optional
 
-import git
 import httpx
 from fastapi import APIRouter, Request
-from fastapi.responses import StreamingResponse, Response, JSONResponse
+from fastapi.responses import StreamingResponse, Response
 
-from olah.constants import REPO_TYPES_MAPPING
-from olah.errors import error_repo_not_found, error_page_not_found, error_revision_not_found
-from olah.mirror.repos import LocalMirrorRepo
+from olah.constants import MIRROR_TREE_EXPAND_PAGE_SIZE, MIRROR_TREE_PAGE_SIZE, REPO_TYPES_MAPPING
+from olah.errors import (
+    error_invalid_cursor,
+    error_repo_not_found,
+    error_page_not_found,
+    error_revision_not_found,
+)
 from olah.proxy.tree import tree_generator
-from olah.utils.logging import build_logger
+from olah.utils.mirror_utils import decode_cursor, mirror_page_response, query_mirrors
 from olah.utils.repo_utils import (
     check_commit_hf,
     get_commit_hf,
@@ -27,7 +31,7 @@ from olah.utils.repo_utils import (
 from olah.utils.rule_utils import check_proxy_rules_hf
 from olah.utils.url_utils import clean_path
 
-logger = build_logger("olah.router.tree", "olah_router_tree.log")
+logger = logging.getLogger("olah.router.tree")
 
 router = APIRouter()
 
@@ -42,7 +46,10 @@ async def tree_proxy_common(
     recursive: bool,
     expand: bool,
     method: str,
-    authorization: Optional[str]
+    authorization: Optional[str],
+    request: Request,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
 ) -> Response:
     # FIXME: do not show the private repos to other user besides owner, even though the repo was cached
     path = clean_path(path)
@@ -51,19 +58,26 @@ async def tree_proxy_common(
     if not await check_proxy_rules_hf(app, repo_type, org, repo):
         return error_repo_not_found()
     # Check Mirror Path
-    for mirror_path in app.state.app_settings.config.mirrors_path:
-        git_path = os.path.join(mirror_path, repo_type, org, repo)
+    mirror_commit, after = commit, None
+    if cursor is not None:
         try:
-            git_path = os.path.join(mirror_path, repo_type, org or '', repo)
-            if os.path.exists(git_path):
-                local_repo = LocalMirrorRepo(git_path, repo_type, org, repo)
-                tree_data = local_repo.get_tree(commit, path, recursive=recursive, expand=expand)
-                if tree_data is None:
-                    continue
-                return JSONResponse(content=tree_data)
-        except git.exc.InvalidGitRepositoryError:
-            logger.warning(f"Local repository {git_path} is not a valid git reposity.")
-            continue
+            mirror_commit, after = decode_cursor(cursor, position_type=str)
+        except ValueError:
+            return error_invalid_cursor()
+    page_size = MIRROR_TREE_EXPAND_PAGE_SIZE if expand else MIRROR_TREE_PAGE_SIZE
+    if limit is not None:
+        page_size = max(1, min(limit, page_size))
+    tree_page = await query_mirrors(
+        app,
+        repo_type,
+        org,
+        repo,
+        lambda local_repo: local_repo.get_tree_page(
+            mirror_commit, path, after, page_size, recursive=recursive, expand=expand
+        ),
+    )
+    if tree_page is not None:
+        return mirror_page_response(app, request, tree_page)
 
     # Proxy the HF File Meta
     try:
@@ -145,6 +159,8 @@ async def tree_proxy_commit2(
     request: Request,
     recursive: bool = False,
     expand: bool = False,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
 ):
     app = request.app
     return await tree_proxy_common(
@@ -158,6 +174,9 @@ async def tree_proxy_commit2(
         expand=expand,
         method=request.method.lower(),
         authorization=request.headers.get("authorization", None),
+        request=request,
+        cursor=cursor,
+        limit=limit,
     )
 
 
@@ -171,6 +190,8 @@ async def tree_proxy_commit(
     request: Request,
     recursive: bool = False,
     expand: bool = False,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
 ):
     app = request.app
     org, repo = parse_org_repo(org_repo)
@@ -188,4 +209,7 @@ async def tree_proxy_commit(
         expand=expand,
         method=request.method.lower(),
         authorization=request.headers.get("authorization", None),
+        request=request,
+        cursor=cursor,
+        limit=limit,
     )
@@ -5,24 +5,40 @@
 # license that can be found in the LICENSE file or at
 # https://opensource.org/licenses/MIT.
 
+import asyncio
 from contextlib import asynccontextmanager
-import datetime
+import faulthandler
+import importlib
 import os
+import signal
 import sys
-from typing import Sequence, Tuple, Union
+import time
+from typing import Optional
 
 from fastapi import FastAPI
+from fastapi.concurrency import run_in_threadpool
 from fastapi_utils.tasks import repeat_every
 
 import httpx
 
-from olah.utils.disk_utils import (
-    convert_bytes_to_human_readable,
-    get_folder_size,
-    sort_files_by_access_time,
-    sort_files_by_modify_time,
-    sort_files_by_size,
-)
+from olah.cache.admission import CacheAdmissionFilter
+from olah.cache.eviction import CacheEvictionDaemon, CacheEvictor
+from olah.cache.index import CacheAccessIndex
+from olah.cache.ledger import CacheSizeLedger, get_state_dir
+from olah.cache.policies import create_eviction_policy
+from olah.cache.tiers import MemoryBlockCache, TieredCache
+from olah.cache.uploader import S3BlockUploader
+from olah.cluster.membership import ClusterMembership
+from olah.constants import CACHE_LEDGER_RECONCILE_INTERVAL, CACHE_STATE_SAVE_INTERVAL
+from olah.utils.disk_utils import convert_bytes_to_human_readable
+from olah.utils.access_log import AccessLog
+from olah.utils.executors import GIT_EXECUTOR, run_in_executor, shutdown_executors
+from olah.utils.logging import build_logger
+from olah.utils.mirror_utils import close_mirror_repos
+from olah.utils.profiling import EventLoopLagMonitor, ProfilingSession
+from olah.utils.s3_client import create_s3_client
+from olah.utils.url_utils import get_ssl_context
+from olah.utils.worker_utils import BlockFetchLocks, WorkerLeader, import_worker_config
 
 BASE_SETTINGS = False
 if not BASE_SETTINGS:
@@ -44,6 +60,9 @@ if not BASE_SETTINGS:
 
 from olah.configs import OlahConfig
 from olah.errors import error_page_not_found
+from olah.metrics.collectors import create_app_collector
+from olah.metrics.middleware import MetricsMiddleware
+from olah.metrics.registry import REGISTRY
 from olah.router import router
 
 
@@ -52,7 +71,7 @@ from olah.router import router
 # ======================
 async def check_connection(url: str) -> bool:
     try:
-        async with httpx.AsyncClient() as client:
+        async with httpx.AsyncClient(verify=get_ssl_context()) as client:
             response = await client.request(
                 method="HEAD",
                 url=url,
@@ -79,68 +98,202 @@ async def check_hf_connection() -> None:
         print("Failed to reach Huggingface Site.", file=sys.stderr)
 
 
-@repeat_every(seconds=60 * 60)
-async def check_disk_usage() -> None:
-    if app.state.app_settings.config.offline:
-        return
+@repeat_every(seconds=CACHE_STATE_SAVE_INTERVAL)
+async def save_cache_state() -> None:
+    await app.state.cache_ledger.asave()
+    index: CacheAccessIndex = app.state.cache_index
+    if app.state.worker_leader.is_leader:
+        await index.aingest_journals()
+        await index.asave()
+    else:
+        await run_in_threadpool(index.flush_journal)
+
+
+@repeat_every(seconds=10 * 60)
+async def reconcile_cache_state() -> None:
     if app.state.app_settings.config.cache_size_limit is None:
         return
+    index: CacheAccessIndex = app.state.cache_index
+    if not index.ready:
+        block_number = await index.arebuild()
+        print(f"Cache access index rebuilt. Blocks: {block_number}.")
 
-    limit_size = app.state.app_settings.config.cache_size_limit
-    current_size = get_folder_size(app.state.app_settings.config.repos_path)
+    ledger: CacheSizeLedger = app.state.cache_ledger
+    reconciled_at = ledger.reconciled_at
+    if reconciled_at is None or time.time() - reconciled_at >= CACHE_LEDGER_RECONCILE_INTERVAL:
+        before_size = ledger.size
+        current_size = await ledger.reconcile()
+        print(
+            f"Cache size reconciled. Ledger: {convert_bytes_to_human_readable(before_size)}, "
+            f"Disk: {convert_bytes_to_human_readable(current_size)}."
+        )
 
-    limit_size_h = convert_bytes_to_human_readable(limit_size)
-    current_size_h = convert_bytes_to_human_readable(current_size)
+    daemon: Optional[CacheEvictionDaemon] = app.state.cache_eviction_daemon
+    if daemon is not None:
+        daemon.wake()
 
-    if current_size < limit_size:
-        return
-    print(
-        f"Cache size exceeded! Limit: {limit_size_h}, Current: {current_size_h}."
-    )
-    print("Cleaning...")
-    files_path = os.path.join(app.state.app_settings.config.repos_path, "files")
-    lfs_path = os.path.join(app.state.app_settings.config.repos_path, "lfs")
-
-    files: Sequence[Tuple[str, Union[int, datetime.datetime]]] = []
-    if app.state.app_settings.config.cache_clean_strategy == "LRU":
-        files = sort_files_by_access_time(files_path) + sort_files_by_access_time(
-            lfs_path
-        )
-        files = sorted(files, key=lambda x: x[1])
-    elif app.state.app_settings.config.cache_clean_strategy == "FIFO":
-        files = sort_files_by_modify_time(files_path) + sort_files_by_modify_time(
-            lfs_path
-        )
-        files = sorted(files, key=lambda x: x[1])
-    elif app.state.app_settings.config.cache_clean_strategy == "LARGE_FIRST":
-        files = sort_files_by_size(files_path) + sort_files_by_size(lfs_path)
-        files = sorted(files, key=lambda x: x[1], reverse=True)
 
-    for filepath, index in files:
-        if current_size < limit_size:
-            break
-        filesize = os.path.getsize(filepath)
-        os.remove(filepath)
-        current_size -= filesize
-        print(f"Remove file: {filepath}. File Size: {convert_bytes_to_human_readable(filesize)}")
+async def start_leader_tasks() -> None:
+    """
+    Starts the tasks run by a single worker: the periodic checks, the index upkeep and
+    the eviction.
+    """
+    index: CacheAccessIndex = app.state.cache_index
+    if index.journaling:
+        # Take over the index persisted by the previous leader
+        await run_in_threadpool(index.stop_journal)
+        await run_in_threadpool(index.load, False)
+    await index.aingest_journals()
+    await check_hf_connection()
+    await reconcile_cache_state()
+    if app.state.cache_eviction_daemon is not None:
+        app.state.cache_eviction_daemon.start()
+
 
-    current_size = get_folder_size(app.state.app_settings.config.repos_path)
-    current_size_h = convert_bytes_to_human_readable(current_size)
-    print(f"Cleaning finished. Limit: {limit_size_h}, Current: {current_size_h}.")
+async def warm_up(config: OlahConfig) -> None:
+    """
+    Runs the slow one-time initializations in worker threads, rather than on the event
+    loop with the first requests.
+    """
+    await run_in_threadpool(get_ssl_context)
+    # Imported by httpx with its first client
+    await run_in_threadpool(importlib.import_module, "httpcore")
+    if len(config.mirrors_path) != 0:
+        # GitPython is only loaded when mirrors are configured
+        await run_in_executor(GIT_EXECUTOR, importlib.import_module, "olah.mirror.repos")
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    if not hasattr(app.state, "app_settings"):
+        # A uvicorn worker process, configured by the parent process
+        worker_config = import_worker_config()
+        if worker_config is None:
+            raise Exception("The Olah config is neither set on the app nor exported to the workers.")
+        app.state.app_settings = AppSettings(config=worker_config)
+        app.state.s3_client = create_s3_client(worker_config)
     # TODO: Check repo cache path
-    await check_hf_connection()
-    await check_disk_usage()
+    config = app.state.app_settings.config
+    # Log files and the stdout/stderr redirection are set up at startup, not on import
+    build_logger(
+        "olah",
+        "olah.log",
+        queue_size=config.logging.queue_size,
+        drop_policy=config.logging.drop_policy,
+    )
+    app.state.cache_ledger = CacheSizeLedger(config.repos_path)
+    app.state.cache_index = CacheAccessIndex(
+        config.repos_path,
+        policy=create_eviction_policy(
+            config.cache_clean_strategy, capacity=config.cache_size_limit
+        ),
+    )
+    app.state.fetch_locks = BlockFetchLocks()
+    app.state.cache_evictor = CacheEvictor(
+        app.state.cache_ledger, app.state.cache_index, fetch_locks=app.state.fetch_locks
+    )
+    app.state.cache_admission = CacheAdmissionFilter(app.state.cache_index)
+    app.state.cache_tiers = TieredCache(
+        memory=MemoryBlockCache(config.memory_cache_size) if config.memory_cache_size else None,
+        s3_client=getattr(app.state, "s3_client", None),
+        s3_read_through=config.s3_read_through,
+    )
+    app.state.s3_uploader = None
+    if getattr(app.state, "s3_client", None) is not None:
+        app.state.s3_uploader = S3BlockUploader(
+            app.state.s3_client, on_complete=app.state.cache_tiers.remember_s3_object
+        )
+    app.state.cache_eviction_daemon = None
+    if config.cache_size_limit is not None:
+        app.state.cache_eviction_daemon = CacheEvictionDaemon(
+            app.state.cache_ledger,
+            app.state.cache_index,
+            app.state.cache_evictor,
+            config.cache_size_limit,
+            high_watermark=config.cache_high_watermark,
+            low_watermark=config.cache_low_watermark,
+        )
+    app.state.access_log = None
+    if config.logging.access_log is not None:
+        app.state.access_log = AccessLog(
+            config.logging.access_log,
+            sample_rate=config.logging.access_log_sample_rate,
+            queue_size=config.logging.queue_size,
+            drop_policy=config.logging.drop_policy,
+        )
+        app.state.access_log.start()
+    app.state.metrics = None
+    if config.metrics.enable:
+        app.state.metrics = REGISTRY
+        app_collector = create_app_collector(app)
+        REGISTRY.add_collector(app_collector)
+    app.state.profiling_session = ProfilingSession()
+    app.state.loop_lag_monitor = None
+    if config.debug.enable or config.metrics.enable:
+        app.state.loop_lag_monitor = EventLoopLagMonitor(config.debug.loop_lag_interval)
+        app.state.loop_lag_monitor.start()
+    if config.debug.slow_callback_threshold is not None:
+        # asyncio logs the steps of the tasks taking longer, with their coroutine
+        loop = asyncio.get_running_loop()
+        loop.set_debug(True)
+        loop.slow_callback_duration = config.debug.slow_callback_threshold
+    if config.debug.enable and hasattr(signal, "SIGUSR1"):
+        # `kill -USR1 <pid>` dumps the stacks of all threads, even when the loop is stuck
+        faulthandler.register(signal.SIGUSR1, file=sys.__stderr__, all_threads=True)
+    app.state.worker_leader = WorkerLeader(
+        os.path.join(get_state_dir(config.repos_path), "leader.lock"),
+        retry_interval=CACHE_STATE_SAVE_INTERVAL,
+    )
+    app.state.cluster = None
+    if config.cluster.enable:
+        app.state.cluster = ClusterMembership(
+            config.cluster.node or config.mirror_url_base(),
+            peers=config.cluster.peers,
+            virtual_nodes=config.cluster.virtual_nodes,
+            secret=config.cluster.secret,
+            allowed_peers=config.cluster.allowed_peers,
+            gossip_interval=config.cluster.gossip_interval,
+            peer_timeout=config.cluster.peer_timeout,
+        )
+        app.state.cluster.start()
+    await warm_up(config)
+    await run_in_threadpool(app.state.cache_ledger.load)
+    await run_in_threadpool(app.state.cache_index.load)
+    await app.state.worker_leader.start(start_leader_tasks)
+    if not app.state.worker_leader.is_leader:
+        # Hand the index changes of this worker over to the leader
+        app.state.cache_index.start_journal()
+    await save_cache_state()
     yield
+    if app.state.cluster is not None:
+        await app.state.cluster.stop()
+    if app.state.s3_uploader is not None:
+        await app.state.s3_uploader.close()
+    if getattr(app.state, "s3_client", None) is not None:
+        await app.state.s3_client.aclose()
+    if app.state.cache_eviction_daemon is not None:
+        await app.state.cache_eviction_daemon.stop()
+    await app.state.cache_ledger.asave()
+    if app.state.worker_leader.is_leader:
+        await app.state.cache_index.asave()
+    else:
+        await run_in_threadpool(app.state.cache_index.flush_journal)
+    await app.state.worker_leader.stop()
+    if app.state.access_log is not None:
+        app.state.access_log.stop()
+    if app.state.metrics is not None:
+        REGISTRY.remove_collector(app_collector)
+    if app.state.loop_lag_monitor is not None:
+        await app.state.loop_lag_monitor.stop()
+    await run_in_executor(GIT_EXECUTOR, close_mirror_repos)
+    await run_in_threadpool(shutdown_executors)
 
 
 # ======================
 # Application
 # ======================
 app = FastAPI(lifespan=lifespan, debug=False)
+app.add_middleware(MetricsMiddleware)
 
 # Include router
 app.include_router(router)
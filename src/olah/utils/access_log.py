@@ -0,0 +1,167 @@
+# coding=utf-8
+# Copyright 2024 XiaHan
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+"""
+Structured access log of the file downloads.
+
+Each sampled request is written as one JSON line, in the format read by
+`olah.cache.simulator`, with the bytes served by each source and the time spent in
+each step of the request:
+
+    {"time": 1700000000.0, "method": "GET", "status": 200, "repo": "org/repo",
+     "revision": "<sha>", "path": "model.safetensors", "file_size": 1000000,
+     "range_start": 0, "range_end": 1000000, "bytes_sent": 1000000,
+     "cache_bytes": 600000, "upstream_bytes": 400000,
+     "tier_bytes": {"disk": 600000, "upstream": 400000}, "upstream_calls": 1,
+     "timings": {"revision": 0.01, "pathsinfo": 0.002, "etag": 0.05, "cache_read": 0.1,
+                 "upstream_ttfb": 0.2, "decompress": 0.0, "send": 0.4},
+     "duration": 0.9}
+
+`range_end` is exclusive. The times are in seconds; `timings` are summed over the
+cache blocks and the upstream calls of the request.
+"""
+
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from olah.utils.logging import BoundedQueueHandler
+
+ACCESS_LOG_TIMINGS = [
+    "revision",
+    "pathsinfo",
+    "etag",
+    "cache_read",
+    "upstream_ttfb",
+    "decompress",
+    "send",
+]
+
+
+class RequestTrace(object):
+    """
+    Collects the bytes and the timings of a single file request.
+    """
+
+    def __init__(self, method: str, repo: str, path: str, revision: Optional[str] = None) -> None:
+        self.method = method
+        self.repo = repo
+        self.path = path
+        self.revision = revision
+        self.status: Optional[int] = None
+        self.file_size: Optional[int] = None
+        self.ranges: List[Tuple[int, int]] = []
+        self.bytes_sent = 0
+        self.tier_bytes: Dict[str, int] = {}
+        self.upstream_calls = 0
+        self.timings: Dict[str, float] = {name: 0.0 for name in ACCESS_LOG_TIMINGS}
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def timer(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name: str, seconds: float) -> None:
+        self.timings[name] = self.timings.get(name, 0.0) + seconds
+
+    def record_bytes(self, tier: str, nbytes: int) -> None:
+        self.tier_bytes[tier] = self.tier_bytes.get(tier, 0) + nbytes
+
+    def to_dict(self) -> Dict:
+        file_size = self.file_size or 0
+        if len(self.ranges) != 0:
+            range_start = min(r[0] for r in self.ranges)
+            range_end = max(r[1] for r in self.ranges)
+        else:
+            range_start, range_end = 0, file_size
+        upstream_bytes = self.tier_bytes.get("upstream", 0)
+        return {
+            "time": round(self.started_at, 3),
+            "method": self.method,
+            "status": self.status,
+            "repo": self.repo,
+            "revision": self.revision,
+            "path": self.path,
+            "file_size": file_size,
+            "range_start": range_start,
+            "range_end": range_end,
+            "bytes_sent": self.bytes_sent,
+            "cache_bytes": sum(self.tier_bytes.values()) - upstream_bytes,
+            "upstream_bytes": upstream_bytes,
+            "tier_bytes": self.tier_bytes,
+            "upstream_calls": self.upstream_calls,
+            "timings": {name: round(value, 6) for name, value in self.timings.items()},
+            "duration": round(time.perf_counter() - self._start, 6),
+        }
+
+
+class AccessLog(object):
+    """
+    Writes sampled request traces as JSON lines from a background thread.
+
+    Like the other log records, the lines go through a bounded queue and are dropped
+    rather than blocking a request when the writer falls behind. The dropped lines
+    are reported in the server log.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        sample_rate: float = 1.0,
+        queue_size: int = 10000,
+        drop_policy: str = "oldest",
+    ) -> None:
+        self.path = path
+        self.sample_rate = sample_rate
+        self._queue = queue.Queue(maxsize=queue_size)
+        # Not registered with the logging manager, so none of the olah handlers apply
+        self._logger = logging.Logger("olah.access", logging.INFO)
+        self._logger.addHandler(
+            BoundedQueueHandler(self._queue, drop_policy=drop_policy, report_drops=False)
+        )
+        self._listener: Optional[logging.handlers.QueueListener] = None
+
+    def start(self) -> None:
+        if self._listener is not None:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        handler = logging.FileHandler(self.path, encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        self._listener = logging.handlers.QueueListener(self._queue, handler)
+        self._listener.start()
+
+    def stop(self) -> None:
+        if self._listener is None:
+            return
+        self._listener.stop()
+        for handler in self._listener.handlers:
+            handler.close()
+        self._listener = None
+
+    def start_trace(
+        self, method: str, repo: str, path: str, revision: Optional[str] = None
+    ) -> Optional[RequestTrace]:
+        """
+        Returns a trace for the request, or None if the request is not sampled.
+        """
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return None
+        return RequestTrace(method, repo, path, revision=revision)
+
+    def write(self, trace: RequestTrace) -> None:
+        self._logger.info(json.dumps(trace.to_dict(), ensure_ascii=False))
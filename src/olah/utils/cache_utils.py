@@ -9,6 +9,26 @@
 import json
 from typing import Dict, Mapping, Union
 
+from olah.cache.ledger import atomic_write_json
+from olah.utils.executors import FS_EXECUTOR, run_in_executor
+
+
+def _write_cache_request(save_path: str, status_code: int, headers: Dict[str, str], content: bytes) -> None:
+    rq = {
+        "status_code": status_code,
+        "headers": headers,
+        "content": content.hex(),
+    }
+    atomic_write_json(save_path, rq)
+
+
+def _read_cache_request(save_path: str) -> Dict[str, str]:
+    with open(save_path, "r", encoding="utf-8") as f:
+        rq = json.loads(f.read())
+
+    rq["content"] = bytes.fromhex(rq["content"])
+    return rq
+
 
 async def write_cache_request(
     save_path: str,
@@ -17,7 +37,9 @@ async def write_cache_request(
     content: bytes,
 ) -> None:
     """
-    Write the request's status code, headers, and content to a cache file.
+    Write the request's status code, headers, and content to a cache file. The file is
+    replaced atomically, so that other workers never read a partial file. The encoding
+    and the write run in the file system executor.
 
     Args:
         head_path (str): The path to the cache file.
@@ -30,18 +52,15 @@ async def write_cache_request(
     """
     if not isinstance(headers, dict):
         headers = {k.lower(): v for k, v in headers.items()}
-    rq = {
-        "status_code": status_code,
-        "headers": headers,
-        "content": content.hex(),
-    }
-    with open(save_path, "w", encoding="utf-8") as f:
-        f.write(json.dumps(rq, ensure_ascii=False))
+    await run_in_executor(
+        FS_EXECUTOR, _write_cache_request, save_path, status_code, headers, content
+    )
 
 
 async def read_cache_request(save_path: str) -> Dict[str, str]:
     """
-    Read the request's status code, headers, and content from a cache file.
+    Read the request's status code, headers, and content from a cache file, in the
+    file system executor.
 
     Args:
         save_path (str): The path to the cache file.
@@ -49,8 +68,4 @@ async def read_cache_request(save_path: str) -> Dict[str, str]:
     Returns:
         Dict[str, str]: A dictionary containing the status code, headers, and content of the request.
     """
-    with open(save_path, "r", encoding="utf-8") as f:
-        rq = json.loads(f.read())
-
-    rq["content"] = bytes.fromhex(rq["content"])
-    return rq
+    return await run_in_executor(FS_EXECUTOR, _read_cache_request, save_path)
@@ -17,7 +17,11 @@ def get_folder_size(folder_path: str) -> int:
     for dirpath, dirnames, filenames in os.walk(folder_path):
         for f in filenames:
             fp = os.path.join(dirpath, f)
-            total_size += os.path.getsize(fp)
+            try:
+                total_size += os.path.getsize(fp)
+            except OSError:
+                # The file was removed during the walk
+                continue
     return total_size
 
 def sort_files_by_access_time(folder_path: str) -> List[Tuple[str, datetime.datetime]]:
@@ -0,0 +1,91 @@
+# coding=utf-8
+# Copyright 2024 XiaHan
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+"""
+Dedicated thread pools for the blocking work of the request handlers, which must not
+run on the event loop:
+
+- `git`: GitPython calls on the mirror repositories. They spawn git processes and
+  read packed objects, and can take hundreds of milliseconds.
+- `fs`: file system calls, i.e. stats, directory creation, file locks and the reads
+  and writes of the cached requests and blocks.
+
+A slow git call cannot hold up the file system calls of the cache, and neither takes
+threads from the default pool that Starlette and the block compression use.
+"""
+
+import asyncio
+import concurrent.futures
+import functools
+import threading
+from typing import Any, Callable, Dict, TypeVar
+
+from olah.constants import FS_EXECUTOR_WORKERS, GIT_EXECUTOR_WORKERS
+
+GIT_EXECUTOR = "git"
+FS_EXECUTOR = "fs"
+
+EXECUTOR_WORKERS: Dict[str, int] = {
+    GIT_EXECUTOR: GIT_EXECUTOR_WORKERS,
+    FS_EXECUTOR: FS_EXECUTOR_WORKERS,
+}
+
+T = TypeVar("T")
+
+_executors: Dict[str, concurrent.futures.ThreadPoolExecutor] = {}
+_executors_lock = threading.Lock()
+
+
+def get_executor(name: str) -> concurrent.futures.ThreadPoolExecutor:
+    """
+    Returns the executor of the given name, created on first use.
+    """
+    executor = _executors.get(name, None)
+    if executor is not None:
+        return executor
+    with _executors_lock:
+        executor = _executors.get(name, None)
+        if executor is None:
+            if name not in EXECUTOR_WORKERS:
+                raise Exception(f"Unknown executor {name}.")
+            executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=EXECUTOR_WORKERS[name],
+                thread_name_prefix=f"olah-{name}",
+            )
+            _executors[name] = executor
+    return executor
+
+
+async def run_in_executor(name: str, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    Runs `func(*args, **kwargs)` in the executor of the given name and waits for it
+    without blocking the event loop.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        get_executor(name), functools.partial(func, *args, **kwargs)
+    )
+
+
+def submit(name: str, func: Callable[..., T], *args: Any, **kwargs: Any) -> concurrent.futures.Future:
+    """
+    Runs `func(*args, **kwargs)` in the executor of the given name without waiting
+    for it. Used for clean-ups in `finally` blocks, which still have to run when the
+    request is cancelled.
+    """
+    return get_executor(name).submit(func, *args, **kwargs)
+
+
+def shutdown_executors(wait: bool = True) -> None:
+    """
+    Shuts the executors down. They are created again if used afterwards.
+    """
+    with _executors_lock:
+        executors = list(_executors.values())
+        _executors.clear()
+    for executor in executors:
+        executor.shutdown(wait=wait)
@@ -6,6 +6,9 @@
 # https://opensource.org/licenses/MIT.
 
 import os
+from typing import Sequence
+
+from olah.utils.executors import FS_EXECUTOR, run_in_executor
 
 
 def make_dirs(path: str):
@@ -15,3 +18,22 @@ def make_dirs(path: str):
         save_dir = os.path.dirname(path)
     if not os.path.exists(save_dir):
         os.makedirs(save_dir, exist_ok=True)
+
+
+def _make_dirs_all(paths: Sequence[str]) -> None:
+    for path in paths:
+        make_dirs(path)
+
+
+async def make_dirs_async(*paths: str) -> None:
+    """
+    `make_dirs` of each path, in the file system executor.
+    """
+    await run_in_executor(FS_EXECUTOR, _make_dirs_all, paths)
+
+
+async def path_exists(path: str) -> bool:
+    """
+    `os.path.exists` in the file system executor.
+    """
+    return await run_in_executor(FS_EXECUTOR, os.path.exists, path)
@@ -6,18 +6,21 @@
 # https://opensource.org/licenses/MIT.
 
 from asyncio import AbstractEventLoop
+import atexit
 import json
 import logging
 import logging.handlers
 import os
 import platform
+import queue
 import re
 import sys
 from typing import AsyncGenerator, Generator
 import warnings
-from olah.constants import DEFAULT_LOGGER_DIR
+from olah.constants import DEFAULT_LOGGER_DIR, LOG_QUEUE_SIZE
 
 handler = None
+listener = None
 
 
 # Define a custom formatter without color codes
@@ -32,9 +35,19 @@ class NoColorFormatter(logging.Formatter):
 
 
 def build_logger(
-    logger_name, logger_filename, logger_dir=DEFAULT_LOGGER_DIR
+    logger_name,
+    logger_filename,
+    logger_dir=DEFAULT_LOGGER_DIR,
+    queue_size: int = LOG_QUEUE_SIZE,
+    drop_policy: str = "oldest",
 ) -> logging.Logger:
-    global handler
+    global handler, listener
+
+    # Get logger
+    logger = logging.getLogger(logger_name)
+    logger.setLevel(logging.DEBUG)
+    if listener is not None:
+        return logger
 
     formatter = logging.Formatter(
         fmt="%(asctime)s | %(levelname)s | %(name)s | %(message)s",
@@ -46,19 +59,39 @@ def build_logger(
         datefmt="%Y-%m-%d %H:%M:%S",
     )
 
-    # Set the format of root handlers
-    if logging.getLogger().handlers is None or len(logging.getLogger().handlers) == 0:
-        if sys.version_info[1] >= 9:
-            # This is for windows
-            logging.basicConfig(level=logging.INFO, encoding="utf-8")
-        else:
-            if platform.system() == "Windows":
-                warnings.warn(
-                    "If you are running on Windows, "
-                    "we recommend you use Python >= 3.9 for UTF-8 encoding."
-                )
-            logging.basicConfig(level=logging.INFO)
-    logging.getLogger().handlers[0].setFormatter(formatter)
+    if sys.version_info[1] < 9 and platform.system() == "Windows":
+        warnings.warn(
+            "If you are running on Windows, "
+            "we recommend you use Python >= 3.9 for UTF-8 encoding."
+        )
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    # The handlers of the root logger now write from the listener thread
+    console_handler = logging.StreamHandler(sys.__stderr__)
+    console_handler.setFormatter(formatter)
+    console_handler.addFilter(lambda record: not getattr(record, "olah_file_only", False))
+    for item in list(root.handlers):
+        root.removeHandler(item)
+
+    # Add a file handler for all loggers
+    os.makedirs(logger_dir, exist_ok=True)
+    filename = os.path.join(logger_dir, logger_filename)
+    handler = logging.handlers.TimedRotatingFileHandler(
+        filename, when="H", utc=True, encoding="utf-8"
+    )
+    handler.setFormatter(nocolor_formatter)
+    handler.namer = lambda name: name.replace(".log", "") + ".log"
+
+    log_queue = queue.Queue(maxsize=queue_size)
+    root.addHandler(BoundedQueueHandler(log_queue, drop_policy=drop_policy))
+    # Loggers that do not propagate, like the ones of uvicorn, keep their own console
+    # handlers and only send their records to the log file
+    for name, item in logging.root.manager.loggerDict.items():
+        if isinstance(item, logging.Logger) and not item.propagate:
+            item.addHandler(BoundedQueueHandler(log_queue, drop_policy=drop_policy, file_only=True))
+    listener = logging.handlers.QueueListener(log_queue, console_handler, handler)
+    listener.start()
+    atexit.register(stop_logging)
 
     # Redirect stdout and stderr to loggers
     stdout_logger = logging.getLogger("stdout")
@@ -71,25 +104,76 @@ def build_logger(
     sl = StreamToLogger(stderr_logger, logging.ERROR)
     sys.stderr = sl
 
-    # Get logger
-    logger = logging.getLogger(logger_name)
-    logger.setLevel(logging.DEBUG)
+    return logger
 
-    # Add a file handler for all loggers
-    if handler is None:
-        os.makedirs(logger_dir, exist_ok=True)
-        filename = os.path.join(logger_dir, logger_filename)
-        handler = logging.handlers.TimedRotatingFileHandler(
-            filename, when="H", utc=True, encoding="utf-8"
-        )
-        handler.setFormatter(nocolor_formatter)
-        handler.namer = lambda name: name.replace(".log", "") + ".log"
 
-        for name, item in logging.root.manager.loggerDict.items():
-            if isinstance(item, logging.Logger):
-                item.addHandler(handler)
+def stop_logging() -> None:
+    """
+    Writes the queued records and stops the listener thread.
+    """
+    global listener
+    if listener is not None:
+        listener.stop()
+        listener = None
 
-    return logger
+
+def get_dropped_records() -> int:
+    """
+    Returns the number of log records dropped because the queue was full.
+    """
+    return BoundedQueueHandler.dropped
+
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queues records for the listener thread without ever blocking the caller.
+
+    When the queue is full, the `oldest` policy discards the record at the head of the
+    queue and the `newest` policy discards the record being logged. The number of
+    dropped records is reported with the next record that gets through, unless
+    `report_drops` is off.
+    """
+
+    dropped = 0
+    _reported = 0
+
+    def __init__(
+        self,
+        queue,
+        drop_policy: str = "oldest",
+        file_only: bool = False,
+        report_drops: bool = True,
+    ):
+        if drop_policy not in ("oldest", "newest"):
+            raise Exception(f"Unknown log drop policy: {drop_policy}.")
+        super().__init__(queue)
+        self.drop_policy = drop_policy
+        self.file_only = file_only
+        self.report_drops = report_drops
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = super().prepare(record)
+        if self.file_only:
+            record.olah_file_only = True
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        unreported = BoundedQueueHandler.dropped - BoundedQueueHandler._reported
+        if unreported > 0 and self.report_drops:
+            BoundedQueueHandler._reported += unreported
+            record.msg = f"{record.msg} ({unreported} log records dropped, the log queue is full)"
+        while True:
+            try:
+                self.queue.put_nowait(record)
+                return
+            except queue.Full:
+                BoundedQueueHandler.dropped += 1
+                if self.drop_policy == "newest":
+                    return
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    pass
 
 
 class StreamToLogger(object):
@@ -111,6 +195,9 @@ class StreamToLogger(object):
         return attr_value
 
     def write(self, buf):
+        if "\n" not in buf:
+            self.linebuf += buf
+            return
         temp_linebuf = self.linebuf + buf
         self.linebuf = ""
         for line in temp_linebuf.splitlines(True):
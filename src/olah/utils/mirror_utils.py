@@ -0,0 +1,238 @@
+# coding=utf-8
+# Copyright 2024 XiaHan
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+import base64
+import json
+import logging
+import os
+import subprocess
+import sys
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    AsyncGenerator,
+    BinaryIO,
+    Callable,
+    Iterable,
+    Optional,
+    Tuple,
+    TypeVar,
+    Union,
+)
+from urllib.parse import urljoin
+
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+
+from olah.constants import JSON_STREAM_CHUNK_SIZE, MIRROR_STREAM_CHUNK_SIZE
+from olah.utils.executors import FS_EXECUTOR, GIT_EXECUTOR, run_in_executor, submit
+from olah.utils.url_utils import add_query_param, get_url_tail
+
+if TYPE_CHECKING:
+    from olah.mirror.repos import LocalMirrorRepo, MirrorFile, MirrorPage
+
+logger = logging.getLogger("olah.mirror")
+
+T = TypeVar("T")
+
+
+def _query_mirror(
+    git_path: str,
+    repo_type: str,
+    org: Optional[str],
+    repo: str,
+    query: Callable[["LocalMirrorRepo"], Optional[T]],
+) -> Optional[T]:
+    # GitPython is only loaded when mirrors are configured
+    import git
+    from olah.mirror.repos import MIRROR_REPO_REGISTRY
+
+    if not os.path.exists(git_path):
+        return None
+    try:
+        local_repo = MIRROR_REPO_REGISTRY.get(git_path, repo_type, org, repo)
+    except git.exc.InvalidGitRepositoryError:
+        logger.warning(f"Local repository {git_path} is not a valid git reposity.")
+        return None
+    with local_repo.lock:
+        return query(local_repo)
+
+
+async def query_mirrors(
+    app,
+    repo_type: str,
+    org: Optional[str],
+    repo: str,
+    query: Callable[["LocalMirrorRepo"], Optional[T]],
+) -> Optional[T]:
+    """
+    Runs `query` on the local mirror of the repository in each mirror path and
+    returns the first result which is not None.
+
+    GitPython spawns git processes and reads packed objects, so the whole query runs
+    in the git executor instead of the event loop. The repositories stay open in the
+    registry of the process between the queries.
+    """
+    for mirror_path in app.state.app_settings.config.mirrors_path:
+        git_path = os.path.join(mirror_path, repo_type, org or "", repo)
+        result = await run_in_executor(
+            GIT_EXECUTOR, _query_mirror, git_path, repo_type, org, repo, query
+        )
+        if result is not None:
+            return result
+    return None
+
+
+def close_mirror_repos() -> None:
+    """
+    Closes the mirror repositories opened by the process, if any.
+    """
+    if "olah.mirror.repos" not in sys.modules:
+        return
+    from olah.mirror.repos import MIRROR_REPO_REGISTRY
+
+    MIRROR_REPO_REGISTRY.clear()
+
+
+def _open_blob(git_dir: str, blob_sha: str) -> subprocess.Popen:
+    import git
+
+    return subprocess.Popen(
+        [git.Git.GIT_PYTHON_GIT_EXECUTABLE, "--git-dir", git_dir, "cat-file", "blob", blob_sha],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+def _close_blob(process: subprocess.Popen) -> None:
+    process.stdout.close()
+    if process.poll() is None:
+        process.kill()
+    process.wait()
+
+
+def _skip(stream: BinaryIO, size: int) -> int:
+    skipped = 0
+    while skipped < size:
+        chunk = stream.read(min(MIRROR_STREAM_CHUNK_SIZE, size - skipped))
+        if len(chunk) == 0:
+            break
+        skipped += len(chunk)
+    return skipped
+
+
+async def _read_chunks(stream: BinaryIO, size: int) -> AsyncGenerator[bytes, None]:
+    remaining = size
+    while remaining > 0:
+        chunk = await run_in_executor(
+            FS_EXECUTOR, stream.read, min(MIRROR_STREAM_CHUNK_SIZE, remaining)
+        )
+        if len(chunk) == 0:
+            break
+        remaining -= len(chunk)
+        yield chunk
+
+
+async def stream_mirror_file(
+    mirror_file: "MirrorFile", start: int, end: int
+) -> AsyncGenerator[bytes, None]:
+    """
+    Streams the bytes `[start, end)` of a file of a mirror repository, in chunks of
+    `MIRROR_STREAM_CHUNK_SIZE`, without reading the whole file into memory.
+
+    LFS objects are read from their file at `start`. Git blobs are written out by
+    their own `git cat-file` process, which does not hold the repository, and the
+    bytes before `start` are skipped.
+    """
+    if mirror_file.data is not None:
+        yield mirror_file.data[start:end]
+        return
+
+    if mirror_file.lfs_path is not None:
+        stream = await run_in_executor(FS_EXECUTOR, open, mirror_file.lfs_path, "rb")
+        try:
+            await run_in_executor(FS_EXECUTOR, stream.seek, start)
+            async for chunk in _read_chunks(stream, end - start):
+                yield chunk
+        finally:
+            submit(FS_EXECUTOR, stream.close)
+        return
+
+    process = await run_in_executor(
+        FS_EXECUTOR, _open_blob, mirror_file.git_dir, mirror_file.blob_sha
+    )
+    try:
+        if start > 0:
+            await run_in_executor(FS_EXECUTOR, _skip, process.stdout, start)
+        async for chunk in _read_chunks(process.stdout, end - start):
+            yield chunk
+    finally:
+        submit(FS_EXECUTOR, _close_blob, process)
+
+
+def encode_cursor(commit: str, position: Union[int, str]) -> str:
+    """
+    Encodes the position of the next page of a listing into an opaque cursor.
+    """
+    data = json.dumps(
+        {"commit": commit, "position": position}, ensure_ascii=False, separators=(",", ":")
+    )
+    return base64.urlsafe_b64encode(data.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str, position_type: type = int) -> Tuple[str, Union[int, str]]:
+    """
+    Returns the commit and the position of a cursor: an offset, or with `position_type`
+    set to `str`, the path the page starts after. Raises ValueError if it is invalid.
+    """
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        commit, position = data["commit"], data["position"]
+    except (ValueError, TypeError, KeyError, UnicodeEncodeError) as e:
+        raise ValueError(f"Invalid cursor {cursor}.") from e
+    if not isinstance(commit, str) or type(position) is not position_type:
+        raise ValueError(f"Invalid cursor {cursor}.")
+    if isinstance(position, int) and position < 0:
+        raise ValueError(f"Invalid cursor {cursor}.")
+    return commit, position
+
+
+async def stream_json_array(items: Iterable[Any]) -> AsyncGenerator[bytes, None]:
+    """
+    Serializes the items into a JSON array, like `JSONResponse`, and yields it in
+    chunks of about `JSON_STREAM_CHUNK_SIZE` bytes as the items come.
+    """
+    buffer = bytearray(b"[")
+    first = True
+    for item in items:
+        if not first:
+            buffer += b","
+        first = False
+        buffer += json.dumps(
+            item, ensure_ascii=False, allow_nan=False, separators=(",", ":")
+        ).encode("utf-8")
+        if len(buffer) >= JSON_STREAM_CHUNK_SIZE:
+            yield bytes(buffer)
+            buffer.clear()
+    buffer += b"]"
+    yield bytes(buffer)
+
+
+def mirror_page_response(app, request: Request, page: "MirrorPage") -> StreamingResponse:
+    """
+    Streams a page of a mirror listing. As on the Hub, the URL of the next page, if
+    any, is sent in a `Link` header with `rel="next"`.
+    """
+    headers = {"content-type": "application/json"}
+    if page.next_position is not None:
+        next_url = add_query_param(
+            str(request.url), "cursor", encode_cursor(page.commit, page.next_position)
+        )
+        next_url = urljoin(app.state.app_settings.config.mirror_url_base(), get_url_tail(next_url))
+        headers["link"] = f'<{next_url}>; rel="next"'
+    return StreamingResponse(stream_json_array(page.items), headers=headers)
@@ -0,0 +1,207 @@
+# coding=utf-8
+# Copyright 2024 XiaHan
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+"""
+On-demand diagnostics of a running server: profiling sessions, dumps of the asyncio
+tasks and the lag of the event loop.
+"""
+
+import asyncio
+import cProfile
+import io
+import logging
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+# Longest profiling session, so that a forgotten request cannot slow the server for long
+MAX_PROFILE_SECONDS = 120
+
+
+class EventLoopLagMonitor(object):
+    """
+    Measures how late the event loop runs a callback scheduled `interval` seconds
+    ahead. A lag well above zero means something blocks the loop.
+    """
+
+    def __init__(self, interval: float = 0.5) -> None:
+        self.interval = interval
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self._total_lag = 0.0
+        self._samples = 0
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "interval": self.interval,
+            "last_lag": self.last_lag,
+            "max_lag": self.max_lag,
+            "mean_lag": self._total_lag / self._samples if self._samples else 0.0,
+            "samples": self._samples,
+        }
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            self._total_lag += lag
+            self._samples += 1
+
+
+class LoopBlockDetector(object):
+    """
+    Records the steps of the running event loop taking longer than `threshold`
+    seconds, with the callback or the coroutine that ran them.
+
+    It relies on the debug mode of asyncio, which times every step of the loop, so it
+    is meant for tests and short diagnostics:
+
+        with LoopBlockDetector(0.1) as detector:
+            await handle_requests()
+        assert detector.blocks == []
+    """
+
+    def __init__(self, threshold: float = 0.1) -> None:
+        self.threshold = threshold
+        self.blocks: List[Tuple[str, float]] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._saved: Tuple[bool, float] = (False, 0.1)
+        self._handler = _LoopBlockHandler(self.blocks)
+
+    def __enter__(self) -> "LoopBlockDetector":
+        self._loop = asyncio.get_running_loop()
+        self._saved = (self._loop.get_debug(), self._loop.slow_callback_duration)
+        self._loop.set_debug(True)
+        self._loop.slow_callback_duration = self.threshold
+        logging.getLogger("asyncio").addHandler(self._handler)
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        logging.getLogger("asyncio").removeHandler(self._handler)
+        if self._loop is not None:
+            self._loop.set_debug(self._saved[0])
+            self._loop.slow_callback_duration = self._saved[1]
+            self._loop = None
+
+    def format_blocks(self) -> str:
+        return "\n".join(f"{seconds:.3f}s: {handle}" for handle, seconds in self.blocks)
+
+
+class _LoopBlockHandler(logging.Handler):
+    def __init__(self, blocks: List[Tuple[str, float]]) -> None:
+        super().__init__(logging.WARNING)
+        self._blocks = blocks
+
+    def emit(self, record: logging.LogRecord) -> None:
+        # asyncio logs "Executing %s took %.3f seconds" with the handle and the time
+        if (
+            isinstance(record.msg, str)
+            and record.msg.startswith("Executing ")
+            and isinstance(record.args, tuple)
+            and len(record.args) == 2
+        ):
+            self._blocks.append((str(record.args[0]), float(record.args[1])))
+
+
+def dump_tasks() -> str:
+    """
+    Formats every asyncio task of the running loop with its stack.
+    """
+    out = io.StringIO()
+    tasks = sorted(asyncio.all_tasks(), key=lambda task: task.get_name())
+    out.write(f"{len(tasks)} tasks\n")
+    for task in tasks:
+        out.write(f"\n{task!r}\n")
+        task.print_stack(file=out)
+    return out.getvalue()
+
+
+async def profile_loop(seconds: float, sort: str = "cumulative") -> pstats.Stats:
+    """
+    Profiles the event loop thread with cProfile for `seconds`. Every task running
+    on the loop meanwhile is profiled, the worker threads are not.
+    """
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        await asyncio.sleep(min(seconds, MAX_PROFILE_SECONDS))
+    finally:
+        profiler.disable()
+    return pstats.Stats(profiler).sort_stats(sort)
+
+
+def format_stats(stats: pstats.Stats, limit: int = 50) -> str:
+    out = io.StringIO()
+    stats.stream = out
+    stats.print_stats(limit)
+    return out.getvalue()
+
+
+def sample_stacks(thread_id: int, seconds: float, interval: float = 0.005) -> str:
+    """
+    Samples the stack of a thread every `interval` seconds, like py-spy, and returns
+    them in the collapsed format read by flamegraph.pl and speedscope: one line per
+    distinct stack, `outer;...;inner count`.
+
+    This blocks, run it in a worker thread.
+    """
+    stacks: Counter = Counter()
+    deadline = time.monotonic() + min(seconds, MAX_PROFILE_SECONDS)
+    while time.monotonic() < deadline:
+        frame = sys._current_frames().get(thread_id, None)
+        if frame is None:
+            break
+        names: List[str] = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})")
+            frame = frame.f_back
+        stacks[";".join(reversed(names))] += 1
+        time.sleep(interval)
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+class ProfilingSession(object):
+    """
+    Lets a single profiling session run at a time.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+
+    def try_start(self) -> bool:
+        return self._lock.acquire(blocking=False)
+
+    def finish(self) -> None:
+        self._lock.release()
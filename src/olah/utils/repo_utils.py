@@ -15,6 +15,8 @@ from urllib.parse import urljoin
 import httpx
 from olah.constants import WORKER_API_TIMEOUT
 from olah.utils.cache_utils import read_cache_request
+from olah.utils.file_utils import path_exists
+from olah.utils.url_utils import get_ssl_context
 
 
 def get_org_repo(org: Optional[str], repo: str) -> str:
@@ -193,7 +195,7 @@ async def get_newest_commit_hf(
     if app.state.app_settings.config.offline:
         return await get_newest_commit_hf_offline(app, repo_type, org, repo)
     try:
-        async with httpx.AsyncClient() as client:
+        async with httpx.AsyncClient(verify=get_ssl_context()) as client:
             headers = {}
             if authorization is not None:
                 headers["authorization"] = authorization
@@ -230,7 +232,7 @@ async def get_commit_hf_offline(
     """
     repos_path = app.state.app_settings.config.repos_path
     save_path = get_meta_save_path(repos_path, repo_type, org, repo, commit)
-    if os.path.exists(save_path):
+    if await path_exists(save_path):
         request_cache = await read_cache_request(save_path)
         request_cache_json = json.loads(request_cache["content"])
         return request_cache_json["sha"]
@@ -274,7 +276,7 @@ async def get_commit_hf(
         headers = {}
         if authorization is not None:
             headers["authorization"] = authorization
-        async with httpx.AsyncClient() as client:
+        async with httpx.AsyncClient(verify=get_ssl_context()) as client:
             response = await client.get(
                 url, headers=headers, timeout=WORKER_API_TIMEOUT, follow_redirects=True
             )
@@ -324,7 +326,7 @@ async def check_commit_hf(
     headers = {}
     if authorization is not None:
         headers["authorization"] = authorization
-    async with httpx.AsyncClient() as client:
+    async with httpx.AsyncClient(verify=get_ssl_context()) as client:
         response = await client.request(method="HEAD", url=url, headers=headers, timeout=WORKER_API_TIMEOUT)
         status_code = response.status_code
     return status_code in [200, 307]
@@ -33,3 +33,27 @@ async def check_cache_rules_hf(
     config: OlahConfig = app.state.app_settings.config
     org_repo = get_org_repo(org, repo)
     return config.cache.allow(org_repo)
+
+
+async def check_cache_admission_hf(
+    app: FastAPI,
+    repo_type: Optional[Literal["models", "datasets", "spaces"]],
+    org: Optional[str],
+    repo: str,
+    cache_path: str,
+    file_size: int,
+    range_start: int = 0,
+) -> bool:
+    """
+    Counts a request of the file cached at `cache_path` and checks whether it should
+    be persisted, according to the admission settings of the matching cache rule.
+    Only the requests starting at the first byte count as a download.
+    """
+    admission = getattr(app.state, "cache_admission", None)
+    if admission is None:
+        return True
+    config: OlahConfig = app.state.app_settings.config
+    org_repo = get_org_repo(org, repo)
+    return admission.admit(
+        config.cache.match_rule(org_repo), cache_path, file_size, range_start
+    )
@@ -8,12 +8,19 @@
 import datetime
 import hashlib
 import hmac
-import os
-from typing import AsyncIterator, Dict
+import time
+import xml.etree.ElementTree as ET
+from typing import TYPE_CHECKING, AsyncIterator, Dict, List, Optional, Tuple
 
-import aiofiles
 import httpx
-from urllib.parse import urlparse
+from urllib.parse import quote, urlparse
+
+if TYPE_CHECKING:
+    from olah.configs import OlahConfig
+
+S3_MAX_CONNECTIONS = 64
+S3_TIMEOUT = 30
+PRESIGNED_URL_EXPIRES = 15 * 60
 
 
 class S3Client:
@@ -26,25 +33,56 @@ class S3Client:
         access_key: str,
         secret_key: str,
         bucket: str,
+        max_connections: int = S3_MAX_CONNECTIONS,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
     ) -> None:
         self._endpoint = endpoint.rstrip("/")
         self._region = region
         self._access_key = access_key
         self._secret_key = secret_key
         self._bucket = bucket
+        self._max_connections = max_connections
+        self._transport = transport
+
+        self._client: Optional[httpx.AsyncClient] = None
+        self._signing_key: Optional[Tuple[str, bytes]] = None
+        self._presigned_urls: Dict[Tuple[str, str, int], Tuple[str, float]] = {}
 
     @property
     def bucket(self) -> str:
         return self._bucket
 
+    def _get_client(self) -> httpx.AsyncClient:
+        """The pooled HTTP client shared by all requests, created on first use."""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=self._max_connections,
+                    max_keepalive_connections=self._max_connections,
+                ),
+                timeout=S3_TIMEOUT,
+                transport=self._transport,
+            )
+        return self._client
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
     def _sign(self, key: bytes, msg: str) -> bytes:
         return hmac.new(key, msg.encode("utf-8"), hashlib.sha256).digest()
 
     def _signature_key(self, date_stamp: str) -> bytes:
+        # The signing key only depends on the date, derive it once per day
+        cached = self._signing_key
+        if cached is not None and cached[0] == date_stamp:
+            return cached[1]
         k_date = self._sign(("AWS4" + self._secret_key).encode("utf-8"), date_stamp)
         k_region = self._sign(k_date, self._region)
         k_service = self._sign(k_region, "s3")
         k_signing = self._sign(k_service, "aws4_request")
+        self._signing_key = (date_stamp, k_signing)
         return k_signing
 
     def _build_auth_headers(
@@ -100,36 +138,238 @@ class S3Client:
         signed.update(headers)
         return signed
 
-    async def _file_body(self, path: str) -> AsyncIterator[bytes]:
-        async with aiofiles.open(path, "rb") as f:
-            while True:
-                chunk = await f.read(1024 * 1024)
-                if not chunk:
-                    break
-                yield chunk
+    def _object_url(self, key: str, query: Optional[Dict[str, str]] = None) -> str:
+        object_key = quote(key.lstrip("/"), safe="/-_.~")
+        url = f"{self._endpoint}/{self._bucket}/{object_key}"
+        if query:
+            # Sorted and encoded, so that the query string is also the canonical one
+            url += "?" + "&".join(
+                f"{quote(k, safe='-_.~')}={quote(v, safe='-_.~')}"
+                for k, v in sorted(query.items())
+            )
+        return url
 
-    async def upload_file(self, key: str, file_path: str) -> None:
-        """Upload a single file to the configured bucket using streaming."""
+    @staticmethod
+    def _find_xml_text(content: bytes, tag: str) -> Optional[str]:
+        root = ET.fromstring(content)
+        for element in root.iter():
+            # Ignore the namespace
+            if element.tag.rsplit("}", 1)[-1] == tag:
+                return element.text
+        return None
 
-        object_key = key.lstrip("/")
-        url = f"{self._endpoint}/{self._bucket}/{object_key}"
+    def _signed_request_headers(
+        self, method: str, url: str, headers: Optional[Dict[str, str]] = None
+    ) -> Dict[str, str]:
         parsed = urlparse(url)
-        headers = {
-            "host": parsed.netloc,
-            "content-length": str(os.path.getsize(file_path)),
-        }
-        payload_hash = "UNSIGNED-PAYLOAD"
-        signed_headers = self._build_auth_headers(
-            method="PUT",
+        request_headers = {"host": parsed.netloc}
+        if headers is not None:
+            request_headers.update(headers)
+        return self._build_auth_headers(
+            method=method,
             canonical_uri=parsed.path,
             canonical_querystring=parsed.query,
-            headers=headers,
-            payload_hash=payload_hash,
+            headers=request_headers,
+            payload_hash="UNSIGNED-PAYLOAD",
         )
 
-        async with httpx.AsyncClient() as client:
-            async with client.stream(
-                "PUT", url, headers=signed_headers, content=self._file_body(file_path)
-            ) as response:
+    async def head_object(self, key: str) -> Optional[Dict[str, str]]:
+        """Return the headers of an object, or None if it does not exist."""
+
+        url = self._object_url(key)
+        signed_headers = self._signed_request_headers("HEAD", url)
+        client = self._get_client()
+        response = await client.head(url, headers=signed_headers)
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return {k.lower(): v for k, v in response.headers.items()}
+
+    async def get_object(
+        self, key: str, start: Optional[int] = None, end: Optional[int] = None
+    ) -> AsyncIterator[bytes]:
+        """Stream an object, or the byte range [start, end) of it."""
+
+        url = self._object_url(key)
+        headers = {}
+        if start is not None or end is not None:
+            range_start = 0 if start is None else start
+            range_end = "" if end is None else str(end - 1)
+            headers["range"] = f"bytes={range_start}-{range_end}"
+        signed_headers = self._signed_request_headers("GET", url, headers)
+        client = self._get_client()
+        async with client.stream("GET", url, headers=signed_headers) as response:
+            if response.status_code not in (200, 206):
                 await response.aread()
                 response.raise_for_status()
+                raise Exception(f"Unexpected S3 response status: {response.status_code}")
+            async for chunk in response.aiter_bytes():
+                if chunk:
+                    yield chunk
+
+    async def create_multipart_upload(self, key: str) -> str:
+        """Start a multipart upload and return its upload id."""
+
+        url = self._object_url(key, {"uploads": ""})
+        signed_headers = self._signed_request_headers("POST", url)
+        client = self._get_client()
+        response = await client.post(url, headers=signed_headers)
+        response.raise_for_status()
+        upload_id = self._find_xml_text(response.content, "UploadId")
+        if not upload_id:
+            raise Exception(f"No upload id in the multipart upload response of {key}.")
+        return upload_id
+
+    async def upload_part(self, key: str, upload_id: str, part_number: int, data: bytes) -> str:
+        """Upload one part of a multipart upload and return its etag."""
+
+        url = self._object_url(key, {"partNumber": str(part_number), "uploadId": upload_id})
+        signed_headers = self._signed_request_headers(
+            "PUT", url, {"content-length": str(len(data))}
+        )
+        client = self._get_client()
+        response = await client.put(url, headers=signed_headers, content=data)
+        response.raise_for_status()
+        etag = response.headers.get("etag", None)
+        if etag is None:
+            raise Exception(f"No etag in the upload part response of {key}, part {part_number}.")
+        return etag
+
+    async def complete_multipart_upload(
+        self, key: str, upload_id: str, parts: List[Tuple[int, str]]
+    ) -> None:
+        """Complete a multipart upload from its (part number, etag) pairs."""
+
+        body = "<CompleteMultipartUpload>" + "".join(
+            f"<Part><PartNumber>{part_number}</PartNumber><ETag>{etag}</ETag></Part>"
+            for part_number, etag in sorted(parts)
+        ) + "</CompleteMultipartUpload>"
+        content = body.encode("utf-8")
+        url = self._object_url(key, {"uploadId": upload_id})
+        signed_headers = self._signed_request_headers(
+            "POST", url, {"content-length": str(len(content))}
+        )
+        client = self._get_client()
+        response = await client.post(url, headers=signed_headers, content=content)
+        response.raise_for_status()
+        # S3 may report a failed completion with a 200 status and an error body
+        if b"<Error>" in response.content:
+            code = self._find_xml_text(response.content, "Code")
+            raise Exception(f"Failed to complete the multipart upload of {key}: {code}")
+
+    async def abort_multipart_upload(self, key: str, upload_id: str) -> None:
+        url = self._object_url(key, {"uploadId": upload_id})
+        signed_headers = self._signed_request_headers("DELETE", url)
+        client = self._get_client()
+        response = await client.delete(url, headers=signed_headers)
+        if response.status_code != 404:
+            response.raise_for_status()
+
+    def presign_url(self, key: str, method: str = "GET", expires: int = PRESIGNED_URL_EXPIRES) -> str:
+        """Create a SigV4 query-string signed URL, valid for `expires` seconds."""
+
+        time_now = datetime.datetime.utcnow()
+        amz_date = time_now.strftime("%Y%m%dT%H%M%SZ")
+        date_stamp = time_now.strftime("%Y%m%d")
+        credential_scope = f"{date_stamp}/{self._region}/s3/aws4_request"
+        query = {
+            "X-Amz-Algorithm": "AWS4-HMAC-SHA256",
+            "X-Amz-Credential": f"{self._access_key}/{credential_scope}",
+            "X-Amz-Date": amz_date,
+            "X-Amz-Expires": str(expires),
+            "X-Amz-SignedHeaders": "host",
+        }
+        url = self._object_url(key, query)
+        parsed = urlparse(url)
+        canonical_request = "\n".join(
+            [
+                method,
+                parsed.path,
+                parsed.query,
+                f"host:{parsed.netloc}\n",
+                "host",
+                "UNSIGNED-PAYLOAD",
+            ]
+        )
+        string_to_sign = "\n".join(
+            [
+                "AWS4-HMAC-SHA256",
+                amz_date,
+                credential_scope,
+                hashlib.sha256(canonical_request.encode("utf-8")).hexdigest(),
+            ]
+        )
+        signature = hmac.new(
+            self._signature_key(date_stamp), string_to_sign.encode("utf-8"), hashlib.sha256
+        ).hexdigest()
+        return f"{url}&X-Amz-Signature={signature}"
+
+    def get_presigned_url(self, key: str, method: str = "GET", expires: int = PRESIGNED_URL_EXPIRES) -> str:
+        """
+        Like `presign_url`, but reuses a cached URL while more than half of its
+        lifetime is left, so that repeated requests do not sign again.
+        """
+        now = time.time()
+        cache_key = (key, method, expires)
+        cached = self._presigned_urls.get(cache_key, None)
+        if cached is not None and cached[1] - now > expires / 2:
+            return cached[0]
+        url = self.presign_url(key, method, expires)
+        if len(self._presigned_urls) >= 4096:
+            self._presigned_urls = {
+                k: v for k, v in self._presigned_urls.items() if v[1] - now > expires / 2
+            }
+        self._presigned_urls[cache_key] = (url, now + expires)
+        return url
+
+    async def list_objects(
+        self, prefix: str = "", max_keys: int = 1000
+    ) -> AsyncIterator[Dict[str, str]]:
+        """List the objects under `prefix`, following continuation tokens."""
+
+        continuation_token: Optional[str] = None
+        client = self._get_client()
+        while True:
+            query = {"list-type": "2", "max-keys": str(max_keys), "prefix": prefix}
+            if continuation_token is not None:
+                query["continuation-token"] = continuation_token
+            url = f"{self._endpoint}/{self._bucket}?" + "&".join(
+                f"{quote(k, safe='-_.~')}={quote(v, safe='-_.~')}"
+                for k, v in sorted(query.items())
+            )
+            signed_headers = self._signed_request_headers("GET", url)
+            response = await client.get(url, headers=signed_headers)
+            response.raise_for_status()
+
+            root = ET.fromstring(response.content)
+            is_truncated = False
+            continuation_token = None
+            for element in root:
+                tag = element.tag.rsplit("}", 1)[-1]
+                if tag == "Contents":
+                    yield {child.tag.rsplit("}", 1)[-1]: (child.text or "") for child in element}
+                elif tag == "IsTruncated":
+                    is_truncated = element.text == "true"
+                elif tag == "NextContinuationToken":
+                    continuation_token = element.text
+            if not is_truncated or continuation_token is None:
+                break
+
+
+def create_s3_client(config: "OlahConfig") -> Optional[S3Client]:
+    """Creates the S3 client of a config, or None if S3 is disabled or incomplete."""
+    if (
+        config.s3.enable
+        and config.s3.endpoint
+        and config.s3.access_key
+        and config.s3.secret_key
+        and config.s3.bucket
+    ):
+        return S3Client(
+            endpoint=config.s3.endpoint,
+            region=config.s3.region,
+            access_key=config.s3.access_key,
+            secret_key=config.s3.secret_key,
+            bucket=config.s3.bucket,
+        )
+    return None
@@ -6,8 +6,10 @@
 # https://opensource.org/licenses/MIT.
 
 import datetime
+import functools
 import os
 import glob
+import ssl
 from typing import Dict, List, Literal, Optional, Tuple, Union
 import json
 from urllib.parse import ParseResult, urlencode, urljoin, urlparse, parse_qs, urlunparse
@@ -16,6 +18,14 @@ from olah.configs import OlahConfig
 from olah.constants import WORKER_API_TIMEOUT
 
 
+@functools.lru_cache(maxsize=None)
+def get_ssl_context() -> ssl.SSLContext:
+    """
+    The SSL context shared by the HTTP clients. Loading the CA certificates takes tens
+    of milliseconds, too long to do on the event loop for every new client.
+    """
+    return httpx.create_ssl_context()
+
 def get_url_tail(parsed_url: Union[str, ParseResult]) -> str:
     """
     Extracts the tail of a URL, including path, parameters, query, and fragment.
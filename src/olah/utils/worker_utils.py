@@ -0,0 +1,266 @@
+# coding=utf-8
+# Copyright 2024 XiaHan
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+import asyncio
+import atexit
+import json
+import os
+import tempfile
+import threading
+from typing import Awaitable, Callable, Dict, IO, Optional, Set, Tuple
+
+import portalocker
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from olah.configs import OlahConfig
+
+# The path of the config of the parent process, handed to the uvicorn worker processes
+WORKER_CONFIG_ENV = "OLAH_WORKER_CONFIG"
+
+FETCH_LOCK_FILE = "fetch.lock"
+FETCH_LOCK_POLL_INTERVAL = 0.05
+FETCH_LOCK_MAX_POLL_INTERVAL = 1.0
+
+
+def _remove_file(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def export_worker_config(config: OlahConfig) -> None:
+    """
+    Writes the config to a JSON file only readable by the current user, and passes its
+    path to the worker processes. The environment is inherited by every child process,
+    e.g. git, and shows in `/proc/<pid>/environ`, while the config holds the S3, debug
+    and cluster secrets. The file is removed when the parent process exits.
+    """
+    fd, path = tempfile.mkstemp(prefix="olah-config-", suffix=".json")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(config.to_dict(), f)
+    atexit.register(_remove_file, path)
+    os.environ[WORKER_CONFIG_ENV] = path
+
+
+def import_worker_config() -> Optional[OlahConfig]:
+    path = os.environ.get(WORKER_CONFIG_ENV, None)
+    if path is None:
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return OlahConfig.from_dict(json.load(f))
+
+
+class WorkerLeader(object):
+    """
+    Elects one worker process out of the processes sharing `repos_path`, with an
+    exclusive lock on `lock_path`. The lock is released by the OS when the leader
+    exits, and the other workers keep trying to take it over every `retry_interval`
+    seconds.
+    """
+
+    def __init__(self, lock_path: str, retry_interval: float = 60) -> None:
+        self._lock_path = lock_path
+        self._retry_interval = retry_interval
+        self._lock_file: Optional[IO] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def is_leader(self) -> bool:
+        return self._lock_file is not None
+
+    def try_acquire(self) -> bool:
+        if self._lock_file is not None:
+            return True
+        os.makedirs(os.path.dirname(self._lock_path), exist_ok=True)
+        lock_file = open(self._lock_path, "a")
+        try:
+            portalocker.lock(lock_file, portalocker.LOCK_EX | portalocker.LOCK_NB)
+        except portalocker.exceptions.LockException:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    def release(self) -> None:
+        if self._lock_file is None:
+            return
+        portalocker.unlock(self._lock_file)
+        self._lock_file.close()
+        self._lock_file = None
+
+    async def _run(self, on_elected: Callable[[], Awaitable[None]]) -> None:
+        while not self.try_acquire():
+            await asyncio.sleep(self._retry_interval)
+        await on_elected()
+
+    async def start(self, on_elected: Callable[[], Awaitable[None]]) -> None:
+        """
+        Calls `on_elected` once this worker becomes the leader, right away if the lock
+        is free.
+        """
+        if self.try_acquire():
+            await on_elected()
+        elif self._task is None:
+            self._task = asyncio.create_task(self._run(on_elected))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.release()
+
+
+class BlockFetchLocks(object):
+    """
+    Registry of the cache blocks being fetched from a remote, shared by the requests of
+    a worker and, through byte-range locks on `<cache path>/fetch.lock`, by all worker
+    processes on the same cache. The owner of a block lock fetches the block, the other
+    requests wait and read the block from the cache once it is written.
+
+    Without `fcntl` (Windows), fetches are only deduplicated within a process.
+    """
+
+    def __init__(self) -> None:
+        self._held: Dict[Tuple[str, int], asyncio.Event] = {}
+        # POSIX record locks belong to the process and are all dropped when any
+        # descriptor of the file is closed, so one descriptor is shared per file.
+        self._lock_files: Dict[str, Tuple[int, int]] = {}
+        # Cache files locked as a whole by `lock_file`. Both are also used by the cache
+        # evictor from a worker thread.
+        self._removing: Set[str] = set()
+        self._files_lock = threading.Lock()
+
+    def _open_lock_file(self, cache_path: str) -> Optional[int]:
+        # Must hold `self._files_lock`.
+        if fcntl is None:
+            return None
+        entry = self._lock_files.get(cache_path, None)
+        if entry is not None:
+            self._lock_files[cache_path] = (entry[0], entry[1] + 1)
+            return entry[0]
+        try:
+            fd = os.open(os.path.join(cache_path, FETCH_LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+        except OSError:
+            return None
+        self._lock_files[cache_path] = (fd, 1)
+        return fd
+
+    def _close_lock_file(self, cache_path: str) -> None:
+        # Must hold `self._files_lock`.
+        entry = self._lock_files.get(cache_path, None)
+        if entry is None:
+            return
+        fd, refs = entry
+        if refs > 1:
+            self._lock_files[cache_path] = (fd, refs - 1)
+            return
+        del self._lock_files[cache_path]
+        os.close(fd)
+
+    def _try_lock_range(self, cache_path: str, block_index: int) -> bool:
+        with self._files_lock:
+            if cache_path in self._removing:
+                return False
+            fd = self._open_lock_file(cache_path)
+            if fd is None:
+                return True
+            try:
+                fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, block_index)
+            except OSError:
+                self._close_lock_file(cache_path)
+                return False
+            return True
+
+    def _unlock_range(self, cache_path: str, block_index: int) -> None:
+        with self._files_lock:
+            entry = self._lock_files.get(cache_path, None)
+            if entry is None:
+                return
+            try:
+                fcntl.lockf(entry[0], fcntl.LOCK_UN, 1, block_index)
+            except OSError:
+                pass
+            self._close_lock_file(cache_path)
+
+    def lock_file(self, cache_path: str) -> bool:
+        """
+        Takes the fetch locks of all blocks of a cache file, so that the file can be
+        removed. Returns False without waiting if any worker process is fetching a block
+        of the file. The locks are released with `unlock_file`.
+        """
+        with self._files_lock:
+            if cache_path in self._lock_files or cache_path in self._removing:
+                return False
+            if fcntl is not None:
+                try:
+                    fd = os.open(
+                        os.path.join(cache_path, FETCH_LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644
+                    )
+                except OSError:
+                    return False
+                try:
+                    fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    os.close(fd)
+                    return False
+                self._lock_files[cache_path] = (fd, 1)
+            self._removing.add(cache_path)
+            return True
+
+    def unlock_file(self, cache_path: str) -> None:
+        with self._files_lock:
+            if cache_path not in self._removing:
+                return
+            self._removing.discard(cache_path)
+            if fcntl is not None:
+                self._close_lock_file(cache_path)
+
+    def is_held(self, cache_path: str, block_index: int) -> bool:
+        return (cache_path, block_index) in self._held
+
+    async def acquire(self, cache_path: str, block_index: int, wait: bool = True) -> bool:
+        """
+        Takes the fetch lock of a block. With `wait`, waits for the current owner to
+        finish, otherwise returns False if the block is already being fetched.
+        """
+        key = (cache_path, block_index)
+        while key in self._held:
+            if not wait:
+                return False
+            await self._held[key].wait()
+        self._held[key] = asyncio.Event()
+
+        poll_interval = FETCH_LOCK_POLL_INTERVAL
+        while not self._try_lock_range(cache_path, block_index):
+            if not wait:
+                self._held.pop(key).set()
+                return False
+            await asyncio.sleep(poll_interval)
+            poll_interval = min(poll_interval * 2, FETCH_LOCK_MAX_POLL_INTERVAL)
+        return True
+
+    def release(self, cache_path: str, block_index: int) -> None:
+        event = self._held.pop((cache_path, block_index), None)
+        if event is None:
+            return
+        if fcntl is not None:
+            self._unlock_range(cache_path, block_index)
+        event.set()
+
+    def release_all(self, cache_path: str, block_indices: Set[int]) -> None:
+        for block_index in list(block_indices):
+            self.release(cache_path, block_index)
+        block_indices.clear()
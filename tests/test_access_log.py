@@ -0,0 +1,29 @@
+import json
+
+from olah.cache.simulator import read_access_log
+from olah.utils.access_log import AccessLog
+
+
+def test_access_log_replays_in_simulator(tmp_path):
+    path = str(tmp_path / "access.jsonl")
+    access_log = AccessLog(path, sample_rate=1.0)
+    access_log.start()
+    trace = access_log.start_trace("GET", "org/repo", "model.bin", revision="main")
+    trace.file_size = 1000
+    trace.ranges = [(100, 600)]
+    trace.record_bytes("disk", 200)
+    trace.record_bytes("upstream", 300)
+    with trace.timer("upstream_ttfb"):
+        pass
+    access_log.write(trace)
+    assert AccessLog(path, sample_rate=0).start_trace("GET", "org/repo", "model.bin") is None
+    access_log.stop()
+
+    with open(path, "r", encoding="utf-8") as f:
+        entry = json.loads(f.readline())
+    assert entry["cache_bytes"] == 200 and entry["upstream_bytes"] == 300
+    assert entry["timings"]["upstream_ttfb"] >= 0
+    accesses = list(read_access_log(path))
+    assert len(accesses) == 1
+    assert accesses[0].object_key == "org/repo/main/model.bin"
+    assert (accesses[0].range_start, accesses[0].range_end) == (100, 600)
@@ -0,0 +1,215 @@
+import asyncio
+import os
+
+from olah.cache.admission import CacheAdmissionFilter
+from olah.cache.eviction import CacheEvictionDaemon, CacheEvictor
+from olah.cache.index import CacheAccessIndex
+from olah.cache.ledger import CacheSizeLedger
+from olah.cache.olah_cache import OlahCache
+from olah.cache.policies import EVICTION_POLICIES, GDSFPolicy, create_eviction_policy
+from olah.cache.simulator import Access, simulate
+from olah.configs import OlahRule
+from olah.utils.disk_utils import get_folder_size
+
+BLOCK_SIZE = 1024
+
+
+def _write_cache(repos_path, name, ledger, index, block_number=3):
+    async def write():
+        cache = OlahCache.create(
+            os.path.join(repos_path, "files", name),
+            block_size=BLOCK_SIZE,
+            ledger=ledger,
+            index=index,
+        )
+        cache.resize(BLOCK_SIZE * block_number)
+        for i in range(block_number):
+            await cache.write_block(i, os.urandom(BLOCK_SIZE))
+        cache.close()
+
+    asyncio.run(write())
+
+
+def test_ledger_tracks_block_writes(tmp_path):
+    repos_path = str(tmp_path)
+    ledger = CacheSizeLedger(repos_path)
+    _write_cache(repos_path, "a", ledger, None)
+    assert ledger.size == get_folder_size(repos_path)
+
+    ledger.save()
+    loaded = CacheSizeLedger(repos_path)
+    assert loaded.load()
+    assert loaded.size == ledger.size
+
+
+def test_evict_lru_blocks(tmp_path):
+    repos_path = str(tmp_path)
+    ledger = CacheSizeLedger(repos_path)
+    index = CacheAccessIndex(repos_path)
+    assert index.rebuild() == 0
+
+    for name in ["a", "b", "c"]:
+        _write_cache(repos_path, name, ledger, index)
+
+    async def read():
+        cache = OlahCache(os.path.join(repos_path, "files", "a"), ledger=ledger, index=index)
+        await cache.read_block(0)
+        cache.close()
+
+    asyncio.run(read())
+
+    evictor = CacheEvictor(ledger, index)
+    evicted_blocks, evicted_size = evictor.evict(ledger.size - 1)
+    assert evicted_blocks == 1
+    assert index.get(os.path.join(repos_path, "files", "a"), 0) is not None
+    assert index.get(os.path.join(repos_path, "files", "a"), 1) is None
+    assert not os.path.exists(os.path.join(repos_path, "files", "a", "blocks", "block_00000001.bin"))
+
+    # Evicting every block removes the cache files as well
+    evictor.evict(0)
+    assert len(index) == 0
+    assert os.listdir(os.path.join(repos_path, "files")) == []
+    assert ledger.size == 0
+
+
+def test_index_saves_incrementally(tmp_path, monkeypatch):
+    repos_path = str(tmp_path)
+    index = CacheAccessIndex(repos_path)
+    assert index.rebuild() == 0
+    index_path = os.path.join(repos_path, ".olah", "access_index.json")
+    snapshot_mtime = os.stat(index_path).st_mtime_ns
+
+    a_path, b_path = os.path.join(repos_path, "files", "a"), os.path.join(repos_path, "files", "b")
+    index.record_write(a_path, 0, 100)
+    index.record_write(b_path, 0, 200)
+    index.record_access(a_path, 0)
+    index.save()
+    index.discard_file(b_path)
+    index.save()
+    # Only the changes are appended, the snapshot is left alone
+    assert os.stat(index_path).st_mtime_ns == snapshot_mtime
+
+    loaded = CacheAccessIndex(repos_path)
+    assert loaded.load()
+    assert loaded.get(a_path, 0).hits == 1
+    assert loaded.get(b_path, 0) is None
+
+    # A log larger than the snapshot is compacted into a new one
+    monkeypatch.setattr("olah.cache.index.CACHE_INDEX_COMPACT_MIN_EVENTS", 2)
+    index.record_access(a_path, 0)
+    index.save()
+    assert os.stat(index_path).st_mtime_ns != snapshot_mtime
+    assert not any(name.endswith(".log") for name in os.listdir(os.path.join(repos_path, ".olah")))
+    loaded = CacheAccessIndex(repos_path)
+    assert loaded.load()
+    assert loaded.get(a_path, 0).hits == 2
+    assert len(loaded) == 1
+
+
+def test_simulator_scan_resistance():
+    # A small hot set, each round followed by a scan of one-off objects
+    accesses = []
+    for round_index in range(20):
+        for h in list(range(4)) * 2:
+            accesses.append(Access(f"hot/{h}", BLOCK_SIZE, 0, BLOCK_SIZE))
+        for i in range(6):
+            accesses.append(Access(f"scan/{round_index}/{i}", BLOCK_SIZE, 0, BLOCK_SIZE))
+    capacity = BLOCK_SIZE * 8
+
+    results = {}
+    for name in EVICTION_POLICIES:
+        policy = create_eviction_policy(name, capacity=capacity)
+        results[name] = simulate(accesses, policy, capacity, block_size=BLOCK_SIZE)
+        assert results[name].requests == len(accesses)
+
+    for name in ["LFU", "2Q", "TINYLFU", "GDSF"]:
+        assert results[name].hit_ratio > results["LRU"].hit_ratio
+        assert results[name].byte_hit_ratio > results["LRU"].byte_hit_ratio
+
+
+def test_gdsf_inflation_follows_evictions():
+    policy = GDSFPolicy()
+    policy.record_insert("cold", BLOCK_SIZE, BLOCK_SIZE * 4)
+    policy.record_insert("hot", BLOCK_SIZE, BLOCK_SIZE)
+    for _ in range(10):
+        policy.record_access("hot", BLOCK_SIZE, BLOCK_SIZE)
+
+    # Deleting a hot file is not an eviction and must not age the remaining entries
+    policy.record_remove("hot")
+    assert policy._inflation == 0.0
+
+    assert policy.victim() == "cold"
+    policy.record_evict("cold")
+    assert policy._inflation == 1 / (BLOCK_SIZE * 4)
+    assert len(policy) == 0
+
+
+def test_eviction_daemon_watermarks(tmp_path):
+    repos_path = str(tmp_path)
+    ledger = CacheSizeLedger(repos_path)
+    index = CacheAccessIndex(repos_path)
+    assert index.rebuild() == 0
+
+    async def run():
+        await ledger.reconcile()
+        limit_size = BLOCK_SIZE * 12
+        daemon = CacheEvictionDaemon(
+            ledger,
+            index,
+            CacheEvictor(ledger, index),
+            limit_size,
+            high_watermark=0.9,
+            low_watermark=0.5,
+            batch_blocks=2,
+            batch_interval=0,
+        )
+        daemon.start()
+        for name in ["a", "b", "c", "d"]:
+            cache = OlahCache.create(
+                os.path.join(repos_path, "files", name),
+                block_size=BLOCK_SIZE,
+                ledger=ledger,
+                index=index,
+            )
+            cache.resize(BLOCK_SIZE * 3)
+            for i in range(3):
+                await cache.write_block(i, os.urandom(BLOCK_SIZE))
+            cache.close()
+            # Let the woken daemon run
+            for _ in range(20):
+                await asyncio.sleep(0.01)
+        await daemon.stop()
+        assert ledger.size < daemon.high_size
+        assert not daemon.running
+
+    asyncio.run(run())
+
+
+def test_admission_filter(tmp_path):
+    repos_path = str(tmp_path)
+    index = CacheAccessIndex(repos_path)
+    admission = CacheAdmissionFilter(index)
+    rule = OlahRule.from_dict({"repo": "*/*", "allow": True, "min_accesses": 2, "max_size": "1K"})
+
+    # Small files are admitted right away, large ones from the second request on
+    assert admission.admit(rule, os.path.join(repos_path, "files", "small"), 1024)
+    large_path = os.path.join(repos_path, "files", "large")
+    assert not admission.admit(rule, large_path, 1024 * 1024)
+    assert admission.admit(rule, large_path, 1024 * 1024)
+    # The default rule caches everything
+    assert admission.admit(OlahRule(), os.path.join(repos_path, "files", "other"), 1024 * 1024)
+
+
+def test_admission_filter_chunked_download(tmp_path):
+    repos_path = str(tmp_path)
+    admission = CacheAdmissionFilter(CacheAccessIndex(repos_path))
+    rule = OlahRule.from_dict({"repo": "*/*", "allow": True, "min_accesses": 2, "max_size": "1K"})
+
+    # A parallel downloader pulls the file once, with a range request per chunk
+    shard_path = os.path.join(repos_path, "files", "shard")
+    chunk_size = 64 * 1024
+    for start in range(0, 1024 * 1024, chunk_size):
+        assert not admission.admit(rule, shard_path, 1024 * 1024, start)
+    assert admission.estimate(shard_path) == 1
+    # The next download is the second access
+    assert admission.admit(rule, shard_path, 1024 * 1024, 0)
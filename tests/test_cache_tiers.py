@@ -0,0 +1,127 @@
+import asyncio
+import os
+
+from olah.cache.olah_cache import OlahCache
+from olah.cache.tiers import MemoryBlockCache, TieredCache
+from olah.cache.uploader import S3BlockUploader
+from olah.proxy.files import _get_file_range_from_cache
+
+BLOCK_SIZE = 1024
+
+
+def test_memory_block_cache_lru():
+    memory = MemoryBlockCache(BLOCK_SIZE * 2)
+    memory.put("a", 0, b"0" * BLOCK_SIZE)
+    memory.put("a", 1, b"1" * BLOCK_SIZE)
+    assert memory.get("a", 0) is not None
+    memory.put("a", 2, b"2" * BLOCK_SIZE)
+    assert memory.get("a", 1) is None
+    assert memory.get("a", 0) is not None
+    assert memory.size == BLOCK_SIZE * 2
+
+
+def test_disk_blocks_are_promoted_to_memory(tmp_path):
+    tiers = TieredCache(memory=MemoryBlockCache(BLOCK_SIZE * 4))
+    data = os.urandom(BLOCK_SIZE * 2)
+
+    async def run():
+        cache = OlahCache.create(str(tmp_path / "file"), block_size=BLOCK_SIZE)
+        cache.resize(len(data))
+        await cache.write_block(0, data[:BLOCK_SIZE])
+        await cache.write_block(1, data[BLOCK_SIZE:])
+        for _ in range(2):
+            chunks = [
+                chunk
+                async for chunk in _get_file_range_from_cache(cache, 10, len(data), tiers=tiers)
+            ]
+            assert b"".join(chunks) == data[10:]
+        cache.close()
+        assert not await tiers.s3_has_object("key", len(data))
+
+    asyncio.run(run())
+    stats = tiers.stats()
+    assert stats["disk"].hits == 2
+    assert stats["memory"].hits == 2
+
+
+class InMemoryMultipartS3(object):
+    def __init__(self, failures=0):
+        self.objects = {}
+        self.uploads = {}
+        self.failures = failures
+
+    async def create_multipart_upload(self, key):
+        upload_id = str(len(self.uploads))
+        self.uploads[upload_id] = {}
+        return upload_id
+
+    async def upload_part(self, key, upload_id, part_number, data):
+        if self.failures > 0:
+            self.failures -= 1
+            raise Exception("transient failure")
+        self.uploads[upload_id][part_number] = data
+        return f'"{part_number}"'
+
+    async def complete_multipart_upload(self, key, upload_id, parts):
+        uploaded = self.uploads.pop(upload_id)
+        self.objects[key] = b"".join(uploaded[part_number] for part_number, _ in sorted(parts))
+
+    async def abort_multipart_upload(self, key, upload_id):
+        self.uploads.pop(upload_id, None)
+
+
+def test_blocks_are_uploaded_as_multipart_parts(tmp_path):
+    s3 = InMemoryMultipartS3(failures=1)
+    completed = {}
+    data = os.urandom(BLOCK_SIZE * 2 + 100)
+
+    async def run():
+        uploader = S3BlockUploader(s3, concurrency=2, on_complete=completed.__setitem__)
+        cache = OlahCache.create(str(tmp_path / "file"), block_size=BLOCK_SIZE)
+        cache.resize(len(data))
+        # The last block is padded to the block size in the cache
+        blocks = [data[i:i + BLOCK_SIZE].ljust(BLOCK_SIZE, b"\x00") for i in range(0, len(data), BLOCK_SIZE)]
+        await cache.write_block(0, blocks[0])
+        await uploader.submit_block("key", cache, 0, blocks[0])
+        # Blocks cached before are picked up from disk
+        await cache.write_block(1, blocks[1])
+        await cache.write_block(2, blocks[2])
+        cache.close()
+        await uploader.fill_missing_blocks("key", str(tmp_path / "file"))
+        await uploader.close()
+
+    asyncio.run(run())
+    assert s3.objects["key"] == data
+    assert completed == {"key": len(data)}
+    assert s3.uploads == {}
+
+
+def test_idle_uploads_of_partial_files_are_aborted(tmp_path):
+    s3 = InMemoryMultipartS3()
+    data = os.urandom(BLOCK_SIZE * 3)
+
+    async def run():
+        uploader = S3BlockUploader(s3, idle_ttl=0.1)
+        cache = OlahCache.create(str(tmp_path / "file"), block_size=BLOCK_SIZE)
+        cache.resize(len(data))
+        # A range reader only downloads the first block
+        await cache.write_block(0, data[:BLOCK_SIZE])
+        await uploader.submit_block("key", cache, 0, data[:BLOCK_SIZE])
+        await asyncio.sleep(0.05)
+        assert len(s3.uploads) == 1
+        await asyncio.sleep(0.5)
+        # The upload is aborted before the server shuts down
+        assert s3.uploads == {}
+        assert uploader._sessions == {}
+        # A later download of the rest starts a new upload
+        for i in range(1, 3):
+            block = data[i * BLOCK_SIZE:(i + 1) * BLOCK_SIZE]
+            await cache.write_block(i, block)
+            await uploader.submit_block("key", cache, i, block)
+        cache.close()
+        await uploader.fill_missing_blocks("key", str(tmp_path / "file"))
+        await uploader.close()
+
+    asyncio.run(run())
+    assert s3.objects["key"] == data
+    assert s3.uploads == {}
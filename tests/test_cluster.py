@@ -0,0 +1,171 @@
+import asyncio
+import os
+from types import SimpleNamespace
+
+import httpx
+
+from olah.cache.olah_cache import OlahCache
+from olah.cache.tiers import TieredCache
+import pytest
+
+from olah.cluster.membership import (
+    CLUSTER_BLOCK_DIGEST_HEADER,
+    CLUSTER_FILE_SIZE_HEADER,
+    ClusterMembership,
+)
+from olah.cluster.ring import ConsistentHashRing
+from olah.configs import OlahConfig
+from olah.proxy.files import _get_file_range_from_peers, read_block_through
+
+BLOCK_SIZE = 1024
+
+
+def test_consistent_hash_ring_moves_few_keys():
+    nodes = [f"http://node{i}:8090" for i in range(8)]
+    ring = ConsistentHashRing(nodes)
+    keys = [f"models/org/repo/resolve/sha/file#{i}" for i in range(2000)]
+    before = {key: ring.owner(key) for key in keys}
+    assert len(set(before.values())) == 8
+
+    ring.remove(nodes[0])
+    moved = [key for key in keys if ring.owner(key) != before[key]]
+    # Only the keys of the removed node move
+    assert all(before[key] == nodes[0] for key in moved)
+
+
+def test_blocks_are_fetched_from_owning_peers(tmp_path):
+    data = os.urandom(BLOCK_SIZE * 4 + 100)
+    peer_url = "http://peer:8090"
+
+    def peer(request: httpx.Request) -> httpx.Response:
+        block = int(request.url.params["block"])
+        # The peer only has the even blocks
+        if block % 2 == 1:
+            return httpx.Response(404)
+        content = data[block * BLOCK_SIZE:(block + 1) * BLOCK_SIZE]
+        return httpx.Response(
+            200,
+            content=content,
+            headers={
+                CLUSTER_FILE_SIZE_HEADER: str(len(data)),
+                CLUSTER_BLOCK_DIGEST_HEADER: cluster.block_digest(
+                    "models/a/b/file", block, len(data), content
+                ),
+            },
+        )
+
+    cluster = ClusterMembership(
+        "http://self:8090", peers=[peer_url], secret="secret", transport=httpx.MockTransport(peer)
+    )
+    # Take this node out of the ring, so that the peer owns every block
+    cluster.mark_down(cluster.node_url)
+    tiers = TieredCache()
+    fallback_ranges = []
+
+    async def fallback(start_pos, end_pos):
+        fallback_ranges.append((start_pos, end_pos))
+        yield data[start_pos:end_pos]
+
+    async def run():
+        cache_file = OlahCache.create(str(tmp_path / "file"), block_size=BLOCK_SIZE)
+        cache_file.resize(len(data))
+        chunks = [
+            chunk
+            async for chunk in _get_file_range_from_peers(
+                cluster, tiers, "models/a/b/file", cache_file, 10, len(data), fallback
+            )
+        ]
+        cache_file.close()
+        await cluster.stop()
+        return b"".join(chunks)
+
+    assert asyncio.run(run()) == data[10:]
+    assert fallback_ranges == [(BLOCK_SIZE, BLOCK_SIZE * 2), (BLOCK_SIZE * 3, BLOCK_SIZE * 4)]
+    assert tiers.stats()["peer"].hits == 3
+
+
+def test_cluster_only_trusts_its_members(tmp_path):
+    # Anyone could join a cluster gossiping without a secret
+    with pytest.raises(Exception):
+        ClusterMembership("http://self:8090", peers=["http://peer:8090"])
+    static_cluster = ClusterMembership(
+        "http://self:8090", peers=["http://127.0.0.1:8090"], gossip_interval=0
+    )
+
+    async def check_static_callers():
+        # Without a secret, only the static peers are answered
+        assert await static_cluster.check_caller(None, "127.0.0.1")
+        assert not await static_cluster.check_caller(None, "10.9.9.9")
+
+    asyncio.run(check_static_callers())
+
+    data = os.urandom(BLOCK_SIZE * 2)
+
+    def peer(request: httpx.Request) -> httpx.Response:
+        # A node which does not know the secret cannot sign the blocks
+        return httpx.Response(
+            200,
+            content=b"x" * BLOCK_SIZE,
+            headers={CLUSTER_FILE_SIZE_HEADER: str(len(data)), CLUSTER_BLOCK_DIGEST_HEADER: "0" * 64},
+        )
+
+    cluster = ClusterMembership(
+        "http://self:8090",
+        peers=["http://peer:8090"],
+        secret="secret",
+        allowed_peers=["http://10.0.0.*:8090"],
+        transport=httpx.MockTransport(peer),
+    )
+    cluster.merge(["http://10.0.0.5:8090", "http://attacker:8090"])
+    assert cluster.members == ["http://10.0.0.5:8090", "http://peer:8090", "http://self:8090"]
+
+    async def run():
+        assert await cluster.check_caller("secret", None)
+        assert not await cluster.check_caller("guess", "127.0.0.1")
+        assert not await cluster.check_caller(None, "127.0.0.1")
+        block = await cluster.fetch_block("http://peer:8090", "models/a/b/file", 0, len(data), BLOCK_SIZE)
+        await cluster.stop()
+        return block
+
+    assert asyncio.run(run()) is None
+    # The peer is skipped for a while
+    assert "http://peer:8090" not in cluster.alive_members()
+
+
+def test_owner_reads_missing_blocks_through(tmp_path, monkeypatch):
+    data = os.urandom(3000)
+    upstream_requests = []
+
+    def upstream(request: httpx.Request) -> httpx.Response:
+        upstream_requests.append(request)
+        start, end = request.headers["range"][len("bytes="):].split("-")
+        content = data[int(start):int(end) + 1]
+        # Streamed like a network response, which the proxy reads raw
+        return httpx.Response(
+            206, headers={"content-length": str(len(content))}, stream=httpx.ByteStream(content)
+        )
+
+    async_client = httpx.AsyncClient
+    monkeypatch.setattr(
+        httpx,
+        "AsyncClient",
+        lambda *args, **kwargs: async_client(transport=httpx.MockTransport(upstream)),
+    )
+    config = OlahConfig()
+    config.basic.repos_path = str(tmp_path)
+    app = SimpleNamespace(state=SimpleNamespace(app_settings=SimpleNamespace(config=config)))
+    cache_key = "models/org/repo/resolve/0123456789abcdef0123456789abcdef01234567/model.bin"
+
+    async def run():
+        first = await read_block_through(app, cache_key, 0, len(data), authorization="Bearer token")
+        # The block is cached now, the next peer asking for it is answered locally
+        second = await read_block_through(app, cache_key, 0, len(data))
+        return first, second
+
+    assert asyncio.run(run()) == (data, data)
+    assert len(upstream_requests) == 1
+    assert upstream_requests[0].url.path == "/org/repo/resolve/0123456789abcdef0123456789abcdef01234567/model.bin"
+    assert upstream_requests[0].headers["authorization"] == "Bearer token"
+    cache_file = OlahCache(str(tmp_path / "files" / cache_key))
+    assert cache_file.has_block(0)
+    cache_file.close()
@@ -0,0 +1,23 @@
+import logging
+import queue
+
+from olah.utils.logging import BoundedQueueHandler
+
+
+def _record(message: str) -> logging.LogRecord:
+    return logging.LogRecord("olah", logging.INFO, __file__, 0, message, None, None)
+
+
+def test_bounded_queue_handler_drops():
+    for drop_policy, kept in [("oldest", ["b", "c"]), ("newest", ["a", "b"])]:
+        log_queue = queue.Queue(maxsize=2)
+        handler = BoundedQueueHandler(log_queue, drop_policy=drop_policy)
+        dropped = BoundedQueueHandler.dropped
+        for message in ["a", "b", "c"]:
+            handler.handle(_record(message))
+        assert BoundedQueueHandler.dropped == dropped + 1
+        assert [log_queue.get_nowait().getMessage() for _ in range(2)] == kept
+
+        # The next record reports the drop
+        handler.handle(_record("d"))
+        assert "1 log records dropped" in log_queue.get_nowait().getMessage()
@@ -0,0 +1,117 @@
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+import httpx
+
+from olah.cache.olah_cache import OlahCache
+from olah.configs import OlahConfig
+from olah.utils.cache_utils import write_cache_request
+from olah.utils.profiling import LoopBlockDetector
+from olah.utils.repo_utils import get_meta_save_path
+
+# Longest step the event loop may spend in a request handler, in seconds
+LOOP_BLOCK_THRESHOLD = float(os.environ.get("OLAH_TEST_LOOP_BLOCK_THRESHOLD", "0.1"))
+
+ORG = "org"
+REPO = "repo"
+COMMIT = "0123456789abcdef0123456789abcdef01234567"
+FILE_PATH = "model.bin"
+FILE_SIZE = 3 * 1024 * 1024
+
+
+async def _populate_cache(repos_path: str) -> bytes:
+    for revision in ["main", COMMIT]:
+        meta_path = get_meta_save_path(repos_path, "models", ORG, REPO, revision)
+        os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+        await write_cache_request(meta_path, 200, {}, json.dumps({"sha": COMMIT}).encode())
+
+    pathsinfo_path = os.path.join(
+        repos_path,
+        f"api/models/{ORG}/{REPO}/paths-info/{COMMIT}/{FILE_PATH}/paths-info_post.json",
+    )
+    os.makedirs(os.path.dirname(pathsinfo_path), exist_ok=True)
+    pathsinfo = [{"type": "file", "path": FILE_PATH, "size": FILE_SIZE}]
+    await write_cache_request(pathsinfo_path, 200, {}, json.dumps(pathsinfo).encode())
+
+    save_path = os.path.join(repos_path, f"files/models/{ORG}/{REPO}/resolve/{COMMIT}/{FILE_PATH}")
+    cache_file = OlahCache.create(save_path)
+    cache_file.resize(FILE_SIZE)
+    data = os.urandom(FILE_SIZE)
+    await cache_file.write_block(0, data.ljust(cache_file._get_block_size(), b"\x00"))
+    cache_file.close()
+    return data
+
+
+def _create_mirror(mirrors_path: str) -> None:
+    import git
+
+    repo_path = os.path.join(mirrors_path, "models", ORG, "mirrored")
+    os.makedirs(repo_path)
+    git_repo = git.Repo.init(repo_path, initial_branch="main")
+    with open(os.path.join(repo_path, "README.md"), "w") as f:
+        f.write("---\nlicense: mit\n---\n# Mirrored\n")
+    os.makedirs(os.path.join(repo_path, "configs"))
+    with open(os.path.join(repo_path, "configs", "config.json"), "w") as f:
+        f.write('{"hidden_size": 8}\n')
+    git_repo.index.add(["README.md", "configs/config.json"])
+    actor = git.Actor("olah", "olah@example.com")
+    git_repo.index.commit("init", author=actor, committer=actor)
+
+
+def test_loop_block_detector():
+    async def run():
+        with LoopBlockDetector(0.05) as detector:
+            await asyncio.sleep(0)
+            time.sleep(0.1)
+            await asyncio.sleep(0)
+        return detector
+
+    detector = asyncio.run(run())
+    assert len(detector.blocks) == 1
+    assert detector.blocks[0][1] >= 0.1
+
+
+def test_handlers_do_not_block_loop():
+    from olah.server import AppSettings, app, warm_up
+
+    with tempfile.TemporaryDirectory() as tmp:
+        config = OlahConfig()
+        config.basic.repos_path = os.path.join(tmp, "repos")
+        config.basic.mirrors_path = [os.path.join(tmp, "mirrors")]
+        config.accessibility.offline = True
+        _create_mirror(config.basic.mirrors_path[0])
+        app.state.app_settings = AppSettings(config=config)
+
+        async def run():
+            data = await _populate_cache(config.repos_path)
+            # Run by the lifespan, which the transport does not run
+            await warm_up(config)
+
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://olah") as client:
+                # The first request imports the modules of the test client
+                await client.get("/not-found")
+                with LoopBlockDetector(LOOP_BLOCK_THRESHOLD) as detector:
+                    responses = [
+                        await client.get(f"/{ORG}/{REPO}/resolve/main/{FILE_PATH}"),
+                        await client.get(
+                            f"/{ORG}/{REPO}/resolve/main/{FILE_PATH}",
+                            headers={"range": "bytes=1024-2047"},
+                        ),
+                        await client.head(f"/{ORG}/{REPO}/resolve/main/{FILE_PATH}"),
+                        await client.get(f"/api/models/{ORG}/mirrored/revision/main"),
+                        await client.get(f"/api/models/{ORG}/mirrored/tree/main/configs"),
+                        await client.get(f"/{ORG}/mirrored/resolve/main/configs/config.json"),
+                    ]
+            return data, responses, detector
+
+        data, responses, detector = asyncio.run(run())
+
+    assert [response.status_code for response in responses] == [200] * 6
+    assert responses[0].content == data
+    assert responses[1].content == data[1024:2048]
+    assert responses[5].content == b'{"hidden_size": 8}\n'
+    assert detector.blocks == [], f"The event loop was blocked:\n{detector.format_blocks()}"
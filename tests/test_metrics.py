@@ -0,0 +1,57 @@
+from olah.configs import OlahConfig
+from olah.metrics.registry import Counter, Gauge, Histogram, MetricsRegistry
+
+
+def test_render_prometheus_text():
+    registry = MetricsRegistry()
+    requests = Counter("test_requests_total", "Requests.", ["router"])
+    in_flight = Gauge("test_in_flight", "In flight.")
+    duration = Histogram("test_duration_seconds", "Duration.", ["router"], buckets=(0.1, 1.0))
+    for metric in [requests, in_flight, duration]:
+        registry.register(metric)
+    registry.add_collector(lambda: in_flight.set(3))
+
+    requests.inc(router="files")
+    requests.inc(2, router="files")
+    duration.observe(0.1, router="files")
+    duration.observe(0.5, router="files")
+    duration.observe(5, router="files")
+
+    lines = registry.render().splitlines()
+    assert "# TYPE test_requests_total counter" in lines
+    assert 'test_requests_total{router="files"} 3' in lines
+    assert "test_in_flight 3" in lines
+    assert 'test_duration_seconds_bucket{router="files",le="0.1"} 1' in lines
+    assert 'test_duration_seconds_bucket{router="files",le="1"} 2' in lines
+    assert 'test_duration_seconds_bucket{router="files",le="+Inf"} 3' in lines
+    assert 'test_duration_seconds_count{router="files"} 3' in lines
+    assert 'test_duration_seconds_sum{router="files"} 5.6' in lines
+
+
+def test_metrics_endpoint(tmp_path, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    from olah.server import AppSettings, app
+
+    # The lifespan writes the log files to the working directory
+    monkeypatch.chdir(tmp_path)
+    config = OlahConfig()
+    config.basic.repos_path = str(tmp_path / "repos")
+    config.basic.mirrors_path = [str(tmp_path / "mirrors")]
+    config.accessibility.offline = True
+    config.metrics.enable = True
+    app.state.app_settings = AppSettings(config=config)
+
+    try:
+        with TestClient(app) as client:
+            tree_response = client.get("/api/models/org/repo/tree/main/configs")
+            response = client.get("/metrics")
+            cache_size = app.state.cache_ledger.size
+    finally:
+        app.state.metrics = None
+
+    assert response.status_code == 200
+    lines = response.text.splitlines()
+    status = tree_response.status_code
+    assert f'olah_http_requests_total{{router="tree",method="GET",status="{status}"}} 1' in lines
+    assert f"olah_cache_size_bytes {cache_size}" in lines
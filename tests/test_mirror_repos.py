@@ -0,0 +1,336 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+import threading
+
+import git
+
+from olah.mirror import repos
+from olah.mirror.repos import MIRROR_REPO_REGISTRY, MirrorRepoRegistry
+from olah.utils.mirror_utils import stream_mirror_file
+
+
+def _commit_file(git_repo: git.Repo, path: str, content: str) -> str:
+    with open(os.path.join(git_repo.working_dir, path), "w") as f:
+        f.write(content)
+    git_repo.index.add([path])
+    actor = git.Actor("olah", "olah@example.com")
+    return git_repo.index.commit(f"update {path}", author=actor, committer=actor).hexsha
+
+
+def test_registry_reuses_repos_until_refs_change():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "models", "org", "repo")
+        os.makedirs(path)
+        git_repo = git.Repo.init(path, initial_branch="main")
+        first_sha = _commit_file(git_repo, "README.md", "first\n")
+
+        registry = MirrorRepoRegistry(capacity=4)
+        local_repo = registry.get(path, "models", "org", "repo")
+        assert registry.get(path, "models", "org", "repo") is local_repo
+        assert local_repo.get_file_head("main", "README.md")["x-repo-commit"] == first_sha
+        assert local_repo.get_file_head("main", "missing.txt") is None
+
+        second_sha = _commit_file(git_repo, "README.md", "second\n")
+        reopened = registry.get(path, "models", "org", "repo")
+        assert reopened is not local_repo
+        assert reopened.get_file_head("main", "README.md")["x-repo-commit"] == second_sha
+        assert reopened.get_file("main", "README.md").data == b"second\n"
+        assert len(registry) == 1
+        registry.clear()
+
+
+def test_registry_evicts_least_recently_used():
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = []
+        for name in ["a", "b", "c"]:
+            path = os.path.join(tmp, name)
+            os.makedirs(path)
+            _commit_file(git.Repo.init(path, initial_branch="main"), "README.md", name)
+            paths.append(path)
+
+        registry = MirrorRepoRegistry(capacity=2)
+        repo_a = registry.get(paths[0], "models", "org", "a")
+        repo_b = registry.get(paths[1], "models", "org", "b")
+        assert registry.get(paths[0], "models", "org", "a") is repo_a
+        repo_c = registry.get(paths[2], "models", "org", "c")
+        assert len(registry) == 2
+        # b was the least recently used
+        assert registry.get(paths[0], "models", "org", "a") is repo_a
+        assert registry.get(paths[2], "models", "org", "c") is repo_c
+        assert registry.get(paths[1], "models", "org", "b") is not repo_b
+        registry.clear()
+        assert len(registry) == 0
+
+
+def test_path_lookup():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "repo")
+        os.makedirs(os.path.join(path, "data", "train"))
+        git_repo = git.Repo.init(path, initial_branch="main")
+        _commit_file(git_repo, "README.md", "readme\n")
+        _commit_file(git_repo, "data/train/part-0.json", "{}\n")
+        sha = _commit_file(git_repo, "data/train/part-1.json", "[]\n")
+
+        registry = MirrorRepoRegistry()
+        local_repo = registry.get(path, "models", "org", "repo")
+        entry = local_repo.get_index_object_by_path("main", "data/train/part-1.json")
+        assert entry.type == "blob" and entry.path == "data/train/part-1.json"
+        assert local_repo.get_index_object_by_path("main", "data/train").type == "tree"
+        assert local_repo.get_index_object_by_path("main", "data/test") is None
+        assert local_repo.get_index_object_by_path("main", "README.md/data") is None
+
+        root = local_repo.get_tree("main", "")
+        assert sorted(item["path"] for item in root) == ["README.md", "data"]
+        assert local_repo.get_tree("main", "README.md") is None
+
+        infos = local_repo.get_pathinfos(
+            "main", ["README.md", "data/train/part-0.json", "missing.txt"]
+        )
+        assert [info["path"] for info in infos] == ["README.md", "data/train/part-0.json"]
+        # The multi-path lookup built the index of the commit
+        assert "data/train/part-1.json" in local_repo.get_path_index(sha)
+        assert local_repo.get_index_object_by_path(sha, "data/train/part-1.json").path == entry.path
+        registry.clear()
+
+
+def test_stream_files():
+    async def read(mirror_file, start, end):
+        return b"".join([chunk async for chunk in stream_mirror_file(mirror_file, start, end)])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "repo")
+        os.makedirs(path)
+        git_repo = git.Repo.init(path, initial_branch="main")
+        blob = os.urandom(3 * 1024 * 1024)
+        with open(os.path.join(path, "blob.bin"), "wb") as f:
+            f.write(blob)
+        git_repo.index.add(["blob.bin"])
+        lfs_data = os.urandom(2 * 1024 * 1024 + 5)
+        oid = hashlib.sha256(lfs_data).hexdigest()
+        lfs_dir = os.path.join(git_repo.git_dir, "lfs", "objects", oid[:2], oid[2:4])
+        os.makedirs(lfs_dir)
+        with open(os.path.join(lfs_dir, oid), "wb") as f:
+            f.write(lfs_data)
+        _commit_file(
+            git_repo,
+            "model.bin",
+            f"version https://git-lfs.github.com/spec/v1\noid sha256:{oid}\nsize {len(lfs_data)}\n",
+        )
+        _commit_file(
+            git_repo,
+            "missing.bin",
+            f"version https://git-lfs.github.com/spec/v1\noid sha256:{'0' * 64}\nsize 10\n",
+        )
+        _commit_file(git_repo, "README.md", "readme\n")
+
+        registry = MirrorRepoRegistry()
+        local_repo = registry.get(path, "models", "org", "repo")
+        readme = local_repo.get_file("main", "README.md")
+        assert readme.data == b"readme\n"
+        assert asyncio.run(read(readme, 2, 4)) == b"ad"
+
+        blob_file = local_repo.get_file("main", "blob.bin")
+        assert blob_file.data is None and blob_file.size == len(blob)
+        assert asyncio.run(read(blob_file, 0, len(blob))) == blob
+        assert asyncio.run(read(blob_file, 1024 * 1024 + 3, 2 * 1024 * 1024)) == blob[1024 * 1024 + 3:2 * 1024 * 1024]
+
+        lfs_file = local_repo.get_file("main", "model.bin")
+        assert lfs_file.size == len(lfs_data) and lfs_file.headers["etag"] == oid
+        assert asyncio.run(read(lfs_file, 0, len(lfs_data))) == lfs_data
+        assert asyncio.run(read(lfs_file, len(lfs_data) - 10, len(lfs_data))) == lfs_data[-10:]
+        head = local_repo.get_file_head("main", "model.bin")
+        assert head["etag"] == oid and head["content-length"] == str(len(lfs_data))
+        assert local_repo.get_file_head("main", "blob.bin")["etag"] == blob_file.headers["etag"]
+        # Pointers to objects missing from the mirror are left to the other sources
+        assert local_repo.get_file("main", "missing.bin") is None
+        assert local_repo.get_file_head("main", "missing.bin") is None
+        registry.clear()
+
+
+def test_tree_last_commits():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "repo")
+        os.makedirs(os.path.join(path, "data", "train"))
+        git_repo = git.Repo.init(path, initial_branch="main")
+        _commit_file(git_repo, "README.md", "readme\n")
+        _commit_file(git_repo, "data/train/part-0.json", "{}\n")
+        _commit_file(git_repo, "data/test.json", "{}\n")
+        _commit_file(git_repo, "data/train/part-0.json", "[]\n")
+        head_sha = _commit_file(git_repo, "README.md", "readme 2\n")
+
+        registry = MirrorRepoRegistry()
+        local_repo = registry.get(path, "models", "org", "repo")
+        items = local_repo.get_tree("HEAD~1", "", recursive=True, expand=True)
+        assert [item["path"] for item in items] == [
+            "README.md", "data", "data/test.json", "data/train", "data/train/part-0.json"
+        ]
+        # Relative to the listed commit, not to the head of the repository
+        for item in items:
+            expected = next(git_repo.iter_commits("HEAD~1", paths=item["path"], max_count=1))
+            assert item["lastCommit"]["id"] == expected.hexsha
+        assert local_repo.get_tree("main", "", expand=True)[0]["lastCommit"]["id"] == head_sha
+
+        # Paths missed by the log walk fall back to a lookup from the listed commit
+        local_repo._last_commits.clear()
+        walks = []
+        local_repo._walk_last_commits = lambda git_dir, commit_sha, paths: walks.append(paths) or {}
+        items = local_repo.get_tree("HEAD~1", "", expand=True)
+        expected = next(git_repo.iter_commits("HEAD~1", paths="README.md", max_count=1))
+        assert items[0]["lastCommit"]["id"] == expected.hexsha
+        # The misses are remembered as well
+        local_repo.get_tree("HEAD~1", "", expand=True)
+        assert len(walks) == 1
+        registry.clear()
+
+
+def test_tree_pages_resume_after_path():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "repo")
+        os.makedirs(os.path.join(path, "a", "c"))
+        git_repo = git.Repo.init(path, initial_branch="main")
+        # Neither the plain order of the paths nor the order of a depth-first walk
+        for name in ["b", "a-b", "a/x", "a/c/y", "a/z"]:
+            _commit_file(git_repo, name, f"{name}\n")
+
+        registry = MirrorRepoRegistry()
+        local_repo = registry.get(path, "models", "org", "repo")
+        for tree_path, recursive in [("", True), ("", False), ("a", True)]:
+            items = local_repo.get_tree("main", tree_path, recursive=recursive)
+            expected = [item["path"] for item in items]
+            listed, after = [], None
+            while True:
+                page = local_repo.get_tree_page("main", tree_path, after, 2, recursive=recursive)
+                listed += [item["path"] for item in page.items]
+                after = page.next_position
+                if after is None:
+                    break
+            assert listed == expected
+        registry.clear()
+
+
+def test_paginated_listings():
+    import httpx
+    from olah.configs import OlahConfig
+    from olah.server import AppSettings, app
+
+    with tempfile.TemporaryDirectory() as tmp:
+        config = OlahConfig()
+        config.basic.repos_path = os.path.join(tmp, "repos")
+        config.basic.mirrors_path = [os.path.join(tmp, "mirrors")]
+        config.accessibility.offline = True
+        path = os.path.join(config.basic.mirrors_path[0], "models", "org", "repo")
+        os.makedirs(path)
+        git_repo = git.Repo.init(path, initial_branch="main")
+        shas = [_commit_file(git_repo, f"file-{i}.txt", f"{i}\n") for i in range(5)]
+        app.state.app_settings = AppSettings(config=config)
+
+        async def list_all(url):
+            transport = httpx.ASGITransport(app=app)
+            pages = []
+            async with httpx.AsyncClient(transport=transport, base_url="http://olah") as client:
+                while url is not None:
+                    response = await client.get(url)
+                    assert response.status_code == 200
+                    pages.append(response.json())
+                    url = response.links.get("next", {}).get("url", None)
+                invalid = await client.get("/api/models/org/repo/commits/main?cursor=invalid")
+            return pages, invalid
+
+        pages, invalid = asyncio.run(list_all("/api/models/org/repo/tree/main/?limit=2"))
+        assert [len(page) for page in pages] == [2, 2, 1]
+        assert [item["path"] for page in pages for item in page] == [f"file-{i}.txt" for i in range(5)]
+        assert invalid.status_code == 400
+
+        pages, _ = asyncio.run(list_all("/api/models/org/repo/commits/main?limit=3"))
+        assert [item["id"] for page in pages for item in page] == shas[::-1]
+        MIRROR_REPO_REGISTRY.clear()
+
+
+def test_snapshots_follow_refs():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "repo")
+        os.makedirs(os.path.join(path, "data", "old"))
+        git_repo = git.Repo.init(path, initial_branch="main")
+        _commit_file(git_repo, "README.md", "---\nlicense: mit\n---\n# Repo\n")
+        _commit_file(git_repo, "data/old/part-0.json", "{}\n")
+        _commit_file(git_repo, "data.txt", "data\n")
+
+        registry = MirrorRepoRegistry()
+        meta = registry.get(path, "models", "org", "repo").get_meta("main")
+        assert meta["cardData"] == {"license": "mit"}
+        assert [item["rfilename"] for item in meta["siblings"]] == [
+            "README.md", "data.txt", "data/old/part-0.json"
+        ]
+
+        git_repo.index.remove(["data/old/part-0.json"], working_tree=True, r=True)
+        os.makedirs(os.path.join(path, "data", "new"))
+        _commit_file(git_repo, "data/new/part-0.json", "[]\n")
+        _commit_file(git_repo, "README.md", "---\nlicense: apache-2.0\n---\n# Repo\n")
+
+        local_repo = registry.get(path, "models", "org", "repo")
+
+        def build_snapshot(commit):
+            raise AssertionError("The snapshot should be derived from the previous one")
+
+        local_repo._build_snapshot = build_snapshot
+        snapshot = local_repo.get_snapshot("main")
+        expected = MirrorRepoRegistry().get(path, "models", "org", "repo").get_snapshot("main")
+        assert snapshot.tree_index == expected.tree_index
+        assert snapshot.commit_shas == expected.commit_shas
+        assert snapshot.created == expected.created
+        assert snapshot.meta_json == expected.meta_json
+        meta = local_repo.get_meta("main")
+        assert meta["cardData"] == {"license": "apache-2.0"}
+        assert [item["rfilename"] for item in meta["siblings"]] == [
+            "README.md", "data.txt", "data/new/part-0.json"
+        ]
+        assert local_repo.get_index_object_by_path("main", "data/old") is None
+        assert local_repo.get_index_object_by_path("main", "data/new").type == "tree"
+        assert local_repo.get_commits_page("main", 1, 2).next_position == 3
+        registry.clear()
+
+
+def test_snapshot_builds_do_not_hold_the_repo_lock(monkeypatch):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "repo")
+        os.makedirs(path)
+        git_repo = git.Repo.init(path, initial_branch="main")
+        sha = _commit_file(git_repo, "README.md", "# Repo\n")
+        local_repo = MirrorRepoRegistry().get(path, "models", "org", "repo")
+
+        run_git = repos._run_git
+        ls_tree_started = threading.Event()
+        ls_tree_release = threading.Event()
+        ls_tree_calls = []
+
+        def slow_run_git(git_dir, *args):
+            if args[0] == "ls-tree":
+                ls_tree_calls.append(args)
+                ls_tree_started.set()
+                ls_tree_release.wait(5)
+            return run_git(git_dir, *args)
+
+        monkeypatch.setattr(repos, "_run_git", slow_run_git)
+        snapshots = []
+
+        def query_snapshot():
+            with local_repo.lock:
+                snapshots.append(local_repo.get_snapshot("main"))
+
+        builder = threading.Thread(target=query_snapshot)
+        builder.start()
+        assert ls_tree_started.wait(5)
+        waiter = threading.Thread(target=query_snapshot)
+        waiter.start()
+
+        # Other queries of the repository go on while the snapshot is built
+        with local_repo.lock:
+            assert local_repo.get_file_head("main", "README.md")["x-repo-commit"] == sha
+        ls_tree_release.set()
+        builder.join(5)
+        waiter.join(5)
+        assert len(snapshots) == 2 and snapshots[0] is snapshots[1]
+        assert len(ls_tree_calls) == 1
+        local_repo.close()
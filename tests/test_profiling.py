@@ -0,0 +1,36 @@
+import asyncio
+import threading
+import time
+
+from olah.utils.profiling import EventLoopLagMonitor, dump_tasks, sample_stacks
+
+
+def test_loop_lag_and_task_dump():
+    async def run():
+        monitor = EventLoopLagMonitor(interval=0.01)
+        monitor.start()
+        await asyncio.sleep(0.02)
+        # Blocks the loop
+        time.sleep(0.2)
+        await asyncio.sleep(0.05)
+        dump = dump_tasks()
+        await monitor.stop()
+        return monitor.stats(), dump
+
+    stats, dump = asyncio.run(run())
+    assert stats["max_lag"] >= 0.1
+    assert "_run" in dump
+
+
+def test_sample_stacks():
+    def busy_wait():
+        deadline = time.monotonic() + 0.3
+        while time.monotonic() < deadline:
+            pass
+
+    thread = threading.Thread(target=busy_wait)
+    thread.start()
+    stacks = sample_stacks(thread.ident, 0.1, interval=0.005)
+    thread.join()
+    assert "busy_wait" in stacks
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in stacks.splitlines())
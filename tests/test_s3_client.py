@@ -0,0 +1,127 @@
+import asyncio
+import os
+from urllib.parse import parse_qs, unquote, urlparse
+
+import httpx
+
+from olah.cache.olah_cache import OlahCache
+from olah.cache.uploader import S3BlockUploader
+from olah.utils.s3_client import S3Client
+
+BLOCK_SIZE = 1024
+BUCKET = "olah"
+
+
+class LocalS3(object):
+    """An in-process stand-in of the S3 API subset used by olah."""
+
+    def __init__(self):
+        self.objects = {}
+        self.uploads = {}
+        self.requests = 0
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        url = urlparse(str(request.url))
+        query = {k: v[0] for k, v in parse_qs(url.query, keep_blank_values=True).items()}
+        if "authorization" not in request.headers and "X-Amz-Signature" not in query:
+            return httpx.Response(403)
+        path = unquote(url.path).lstrip("/")
+        bucket, _, key = path.partition("/")
+        assert bucket == BUCKET
+
+        if request.method == "GET" and key == "":
+            return self._list(query)
+        if request.method == "POST" and "uploads" in query:
+            upload_id = str(len(self.uploads))
+            self.uploads[upload_id] = {}
+            return httpx.Response(
+                200, content=f"<InitiateMultipartUploadResult><UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>"
+            )
+        if request.method == "PUT" and "partNumber" in query:
+            self.uploads[query["uploadId"]][int(query["partNumber"])] = request.read()
+            return httpx.Response(200, headers={"etag": f'"{query["partNumber"]}"'})
+        if request.method == "POST" and "uploadId" in query:
+            parts = self.uploads.pop(query["uploadId"])
+            self.objects[key] = b"".join(parts[i] for i in sorted(parts))
+            return httpx.Response(200, content="<CompleteMultipartUploadResult/>")
+        if request.method == "DELETE" and "uploadId" in query:
+            self.uploads.pop(query["uploadId"], None)
+            return httpx.Response(204)
+
+        if key not in self.objects:
+            return httpx.Response(404)
+        data = self.objects[key]
+        if request.method == "HEAD":
+            return httpx.Response(200, headers={"content-length": str(len(data))})
+        if "range" in request.headers:
+            start, end = request.headers["range"][len("bytes="):].split("-")
+            end = len(data) - 1 if end == "" else int(end)
+            return httpx.Response(206, content=data[int(start):end + 1])
+        return httpx.Response(200, content=data)
+
+    def _list(self, query):
+        keys = sorted(k for k in self.objects if k.startswith(query.get("prefix", "")))
+        start = int(query.get("continuation-token", "0"))
+        max_keys = int(query.get("max-keys", "1000"))
+        page = keys[start:start + max_keys]
+        truncated = start + max_keys < len(keys)
+        body = "<ListBucketResult>" + "".join(
+            f"<Contents><Key>{k}</Key><Size>{len(self.objects[k])}</Size></Contents>" for k in page
+        )
+        body += f"<IsTruncated>{'true' if truncated else 'false'}</IsTruncated>"
+        if truncated:
+            body += f"<NextContinuationToken>{start + max_keys}</NextContinuationToken>"
+        body += "</ListBucketResult>"
+        return httpx.Response(200, content=body)
+
+
+def _create_client(s3: LocalS3) -> S3Client:
+    return S3Client(
+        endpoint="http://s3.local",
+        region="us-east-1",
+        access_key="access",
+        secret_key="secret",
+        bucket=BUCKET,
+        transport=httpx.MockTransport(s3.handle),
+    )
+
+
+def test_s3_client_round_trip(tmp_path):
+    s3 = LocalS3()
+    client = _create_client(s3)
+    data = os.urandom(BLOCK_SIZE * 3 + 10)
+
+    async def run():
+        # Upload a cached file block by block
+        source = OlahCache.create(str(tmp_path / "source"), block_size=BLOCK_SIZE)
+        source.resize(len(data))
+        for i in range(0, len(data), BLOCK_SIZE):
+            await source.write_block(i // BLOCK_SIZE, data[i:i + BLOCK_SIZE].ljust(BLOCK_SIZE, b"\x00"))
+        source.close()
+        uploader = S3BlockUploader(client)
+        await uploader.fill_missing_blocks("models/a/b/file name.bin", str(tmp_path / "source"))
+        await uploader.close()
+
+        headers = await client.head_object("models/a/b/file name.bin")
+        assert int(headers["content-length"]) == len(data)
+        assert await client.head_object("missing") is None
+        chunks = [c async for c in client.get_object("models/a/b/file name.bin", 5, 2000)]
+        assert b"".join(chunks) == data[5:2000]
+
+        for i in range(5):
+            s3.objects[f"datasets/x/{i}"] = b"x"
+        listed = [o["Key"] async for o in client.list_objects("datasets/", max_keys=2)]
+        assert listed == [f"datasets/x/{i}" for i in range(5)]
+
+        await client.aclose()
+
+    asyncio.run(run())
+
+
+def test_presigned_urls_are_cached():
+    client = _create_client(LocalS3())
+    url = client.get_presigned_url("models/a/b/file")
+    assert "X-Amz-Signature=" in url
+    assert client.get_presigned_url("models/a/b/file") == url
+    assert client.get_presigned_url("models/a/b/other") != url
@@ -0,0 +1,32 @@
+import json
+import subprocess
+import sys
+
+# Imported on first use only
+LAZY_MODULES = ["git", "yaml", "jinja2", "huggingface_hub", "peewee", "uvicorn"]
+
+
+def _loaded_modules(module: str, cwd: str):
+    code = (
+        "import json, os, sys\n"
+        f"import {module}\n"
+        "print(json.dumps({'modules': sorted(sys.modules), "
+        "'stdout_replaced': sys.stdout is not sys.__stdout__, "
+        "'logs': os.path.exists('logs')}))\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True, cwd=cwd
+    )
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def test_server_import_is_lazy(tmp_path):
+    loaded = _loaded_modules("olah.server", str(tmp_path))
+    assert [m for m in LAZY_MODULES if m in loaded["modules"]] == []
+    assert not loaded["stdout_replaced"]
+    assert not loaded["logs"]
+
+
+def test_cli_import_is_lazy(tmp_path):
+    loaded = _loaded_modules("olah.commands.app", str(tmp_path))
+    assert [m for m in LAZY_MODULES + ["fastapi", "olah.configs"] if m in loaded["modules"]] == []
@@ -0,0 +1,159 @@
+import asyncio
+import os
+
+from olah.cache.eviction import CacheEvictor
+from olah.cache.index import CacheAccessIndex
+from olah.cache.ledger import CacheSizeLedger
+from olah.cache.olah_cache import OlahCache
+from olah.configs import OlahConfig, OlahRule
+from olah.proxy.files import _get_file_range_coordinated
+from olah.utils.worker_utils import (
+    WORKER_CONFIG_ENV,
+    BlockFetchLocks,
+    WorkerLeader,
+    export_worker_config,
+    import_worker_config,
+)
+
+
+def test_single_leader(tmp_path):
+    lock_path = str(tmp_path / ".olah" / "leader.lock")
+    first = WorkerLeader(lock_path)
+    second = WorkerLeader(lock_path)
+    assert first.try_acquire()
+    assert not second.try_acquire()
+    first.release()
+    assert second.try_acquire()
+    second.release()
+
+
+def test_shared_ledger_and_index_journal(tmp_path):
+    repos_path = str(tmp_path)
+    # Two workers on the same cache
+    leader_ledger, follower_ledger = CacheSizeLedger(repos_path), CacheSizeLedger(repos_path)
+    leader_ledger.add(100)
+    leader_ledger.save()
+    follower_ledger.load()
+    follower_ledger.add(50)
+    follower_ledger.save()
+    leader_ledger.add(10)
+    leader_ledger.save()
+    assert leader_ledger.size == 160
+    follower_ledger.save()
+    assert follower_ledger.size == 160
+
+    leader_index, follower_index = CacheAccessIndex(repos_path), CacheAccessIndex(repos_path)
+    follower_index.start_journal()
+    follower_index.record_write(str(tmp_path / "files" / "a"), 0, 50)
+    follower_index.record_access(str(tmp_path / "files" / "a"), 0)
+    follower_index.flush_journal()
+    assert leader_index.ingest_journals() == 2
+    assert leader_index.get(str(tmp_path / "files" / "a"), 0).hits == 1
+    assert leader_index.ingest_journals() == 0
+
+
+def test_block_fetch_locks(tmp_path):
+    cache_path = str(tmp_path)
+    locks = BlockFetchLocks()
+    order = []
+
+    async def fetch(name: str, hold: float):
+        await locks.acquire(cache_path, 0)
+        order.append(name)
+        await asyncio.sleep(hold)
+        locks.release(cache_path, 0)
+
+    async def run():
+        first = asyncio.create_task(fetch("first", 0.05))
+        await asyncio.sleep(0)
+        assert not await locks.acquire(cache_path, 0, wait=False)
+        assert await locks.acquire(cache_path, 1, wait=False)
+        locks.release(cache_path, 1)
+        await asyncio.gather(first, fetch("second", 0))
+
+    asyncio.run(run())
+    assert order == ["first", "second"]
+
+
+def test_evictor_keeps_files_being_fetched(tmp_path):
+    repos_path = str(tmp_path)
+    cache_path = os.path.join(repos_path, "files", "a")
+    ledger, index = CacheSizeLedger(repos_path), CacheAccessIndex(repos_path)
+    locks = BlockFetchLocks()
+    index.rebuild()
+
+    async def run():
+        cache_file = OlahCache.create(cache_path, block_size=1024, ledger=ledger, index=index)
+        cache_file.resize(2048)
+        await cache_file.write_block(0, os.urandom(1024))
+        cache_file.close()
+        # Another request starts fetching block 1 while block 0 is evicted
+        assert await locks.acquire(cache_path, 1)
+        evictor = CacheEvictor(ledger, index, fetch_locks=locks)
+        assert evictor.evict(0)[0] == 1
+        assert os.path.exists(os.path.join(cache_path, "meta.bin"))
+        locks.release(cache_path, 1)
+
+        # Without fetch locks, a file another worker may be fetching into is kept
+        CacheEvictor(ledger, index)._remove_empty_cache(cache_path)
+        assert os.path.exists(os.path.join(cache_path, "meta.bin"))
+        evictor._remove_empty_cache(cache_path)
+        assert not os.path.exists(cache_path)
+
+    asyncio.run(run())
+
+
+def test_partial_blocks_are_not_locked(tmp_path):
+    block_size = 1024
+    data = os.urandom(block_size * 3)
+    cache_path = str(tmp_path / "file")
+    locks = BlockFetchLocks()
+
+    async def fetch(start_pos, end_pos):
+        yield data[start_pos:end_pos]
+
+    async def run():
+        cache_file = OlahCache.create(cache_path, block_size=block_size)
+        cache_file.resize(len(data))
+        # A slow client streams a range covering block 1, and parts of blocks 0 and 2
+        slow_held = set()
+        slow = _get_file_range_coordinated(
+            locks, slow_held, None, cache_path, cache_file, 100, block_size * 2 + 100, fetch
+        )
+        assert await slow.__anext__() == data[100:block_size * 2 + 100]
+        assert slow_held == {1}
+
+        # Another request caching block 0 does not wait for the slow client
+        held = set()
+        chunks = [
+            chunk
+            async for chunk in _get_file_range_coordinated(
+                locks, held, None, cache_path, cache_file, 0, block_size, fetch
+            )
+        ]
+        assert b"".join(chunks) == data[:block_size]
+        assert held == {0}
+        locks.release_all(cache_path, held)
+        locks.release_all(cache_path, slow_held)
+        await slow.aclose()
+        cache_file.close()
+
+    asyncio.run(asyncio.wait_for(run(), 5))
+
+
+def test_worker_config_round_trip(monkeypatch):
+    config = OlahConfig()
+    config.basic.port = 8091
+    config.basic.mirrors_path = ["/data/mirrors"]
+    config.s3.secret_key = "s3-secret"
+    config.cluster.peers = ["http://10.0.0.2:8090"]
+    config.accessibility.cache.rules.append(OlahRule.from_dict({"repo": "org/*", "max_size": "1K"}))
+    monkeypatch.delenv(WORKER_CONFIG_ENV, raising=False)
+    export_worker_config(config)
+
+    # Only the path of the config is in the environment
+    path = os.environ[WORKER_CONFIG_ENV]
+    assert "s3-secret" not in path
+    assert os.stat(path).st_mode & 0o077 == 0
+    assert import_worker_config() == config
+    os.remove(path)